@@ -0,0 +1,213 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright (C) 2010 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://genshi.edgewall.org/wiki/License.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://genshi.edgewall.org/log/.
+
+"""Reproducible benchmark suite for Genshi.
+
+The suite measures parsing, template preparation and rendering, serialization,
+XPath selection, sanitizing, transformations and translation, each on small,
+medium and huge input. Results can be stored as JSON and compared against a
+baseline, so that performance regressions are caught when upgrading:
+
+  $ python suite.py run -o baseline.json
+  ... (change or upgrade Genshi) ...
+  $ python suite.py run -o current.json
+  $ python suite.py compare baseline.json current.json
+
+The ``compare`` command exits with status 1 if any benchmark became slower
+(or used more memory) by more than the threshold, which makes it usable in
+continuous integration.
+"""
+
+import getopt
+import sys
+
+from benchsuite.cases import SIZES, benchmarks
+from benchsuite.harness import environment, load, measure, save
+
+__all__ = ['run', 'compare', 'main']
+
+USAGE = """Usage:
+  suite.py list [-s SIZE]... [PATTERN]...
+  suite.py run [-s SIZE]... [-o FILE] [-w N] [-r N] [-t SEC] [-n] [PATTERN]...
+  suite.py compare [-t RATIO] [--stat STAT] BASELINE CURRENT
+
+Options for run:
+  -s SIZE   only run the benchmarks for the given size (small, medium, huge)
+  -o FILE   write the results as JSON to FILE ("-" for standard output)
+  -w N      number of warmup calls (default 1)
+  -r N      number of timed samples (default 5)
+  -t SEC    minimum duration of a sample in seconds (default 0.2)
+  -n        do not run every benchmark in a separate process
+
+Options for compare:
+  -t RATIO  relative change that is reported as a regression (default 0.1)
+  --stat    the statistic to compare: min, median or mean (default median)
+"""
+
+
+def run(benches, warmup=1, repeat=5, min_time=0.2, isolate=True, out=None):
+    """Run the given benchmarks and return the results, as a dictionary with
+    an ``"environment"`` and a ``"results"`` entry, the latter mapping
+    benchmark keys to their statistics.
+
+    :param benches: a list of `Benchmark` objects
+    :param warmup: the number of calls before timing starts
+    :param repeat: the number of samples to take
+    :param min_time: the minimum duration of a sample, in seconds
+    :param isolate: whether to run every benchmark in a separate process
+    :param out: a file-like object progress is reported to
+    :rtype: `dict`
+    """
+    results = {}
+    for bench in benches:
+        result = measure(bench, warmup=warmup, repeat=repeat,
+                         min_time=min_time, isolate=isolate)
+        result['group'] = bench.group
+        result['size'] = bench.size
+        results[bench.key] = result
+        if out is not None:
+            out.write('%-32s %12.3f ms %8s\n' % (
+                bench.key, result['median'] * 1000, _memory(result['memory'])
+            ))
+            out.flush()
+    return {'environment': environment(),
+            'settings': {'warmup': warmup, 'repeat': repeat,
+                         'min_time': min_time, 'isolate': isolate},
+            'results': results}
+
+
+def compare(baseline, current, threshold=0.1, stat='median'):
+    """Compare two sets of results, and return a list of
+    ``(key, old, new, ratio, status)`` tuples, sorted by benchmark key.
+
+    The status is ``"regression"`` if the benchmark became slower by more than
+    the threshold, ``"memory"`` if its peak memory use grew by more than the
+    threshold (and by at least a megabyte), ``"improved"`` if it became
+    faster by more than the threshold, ``"added"`` or ``"removed"`` if the
+    benchmark is only present in one of the results, and ``"ok"`` otherwise.
+
+    :param baseline: the results to compare against
+    :param current: the new results
+    :param threshold: the relative change considered significant
+    :param stat: the timing statistic to compare
+    :rtype: `list`
+    """
+    old_results = baseline['results']
+    new_results = current['results']
+    keys = dict.fromkeys(old_results.keys() + new_results.keys()).keys()
+    keys.sort()
+
+    retval = []
+    for key in keys:
+        old = old_results.get(key)
+        new = new_results.get(key)
+        if old is None:
+            retval.append((key, None, new[stat], None, 'added'))
+            continue
+        elif new is None:
+            retval.append((key, old[stat], None, None, 'removed'))
+            continue
+        ratio = new[stat] / old[stat]
+        status = 'ok'
+        if ratio > 1 + threshold:
+            status = 'regression'
+        elif ratio < 1 - threshold:
+            status = 'improved'
+        elif old['memory'] is not None and new['memory'] is not None and \
+                new['memory'] - old['memory'] >= 1024 and \
+                new['memory'] > old['memory'] * (1 + threshold):
+            status = 'memory'
+        retval.append((key, old[stat], new[stat], ratio, status))
+    return retval
+
+
+def _memory(kbytes):
+    if kbytes is None:
+        return '-'
+    return '%d KB' % kbytes
+
+def _ms(seconds):
+    if seconds is None:
+        return '-'
+    return '%.3f' % (seconds * 1000)
+
+
+def main(args=None, out=sys.stdout):
+    """Run the command line interface of the suite.
+
+    :param args: the command line arguments, without the program name
+    :param out: the file-like object the output is written to
+    :return: the exit status
+    """
+    if args is None:
+        args = sys.argv[1:]
+    if not args or args[0] not in ('list', 'run', 'compare'):
+        out.write(USAGE)
+        return 2
+    command, args = args[0], args[1:]
+    try:
+        opts, args = getopt.getopt(args, 's:o:w:r:t:n', ['stat='])
+    except getopt.GetoptError, e:
+        out.write('%s\n%s' % (e, USAGE))
+        return 2
+    opts = dict([(name, value) for name, value in opts if name != '-s'] +
+                [('-s', [value for name, value in opts if name == '-s'])])
+    for size in opts['-s']:
+        if size not in SIZES:
+            out.write('Unknown size %r\n%s' % (size, USAGE))
+            return 2
+
+    if command == 'list':
+        for bench in benchmarks(opts['-s'], args):
+            out.write('%s\n' % bench.key)
+        return 0
+
+    if command == 'run':
+        results = run(benchmarks(opts['-s'], args),
+                      warmup=int(opts.get('-w', 1)),
+                      repeat=int(opts.get('-r', 5)),
+                      min_time=float(opts.get('-t', 0.2)),
+                      isolate='-n' not in opts,
+                      out=opts.get('-o') != '-' and out or sys.stderr)
+        if '-o' in opts:
+            save(results, opts['-o'])
+        return 0
+
+    if len(args) != 2:
+        out.write(USAGE)
+        return 2
+    stat = opts.get('--stat', 'median')
+    if stat not in ('min', 'median', 'mean'):
+        out.write('Unknown statistic %r\n%s' % (stat, USAGE))
+        return 2
+    baseline, current = load(args[0]), load(args[1])
+    for name in ('genshi', 'python', 'platform', 'speedups'):
+        old = baseline['environment'].get(name)
+        new = current['environment'].get(name)
+        if old != new:
+            out.write('Note: %s differs (%s vs %s)\n' % (name, old, new))
+    rows = compare(baseline, current, threshold=float(opts.get('-t', 0.1)),
+                   stat=stat)
+    out.write('%-32s %12s %12s %8s  %s\n' % ('benchmark', 'old (ms)',
+                                            'new (ms)', 'ratio', 'status'))
+    failed = False
+    for key, old, new, ratio, status in rows:
+        if ratio is None:
+            ratio = '-'
+        else:
+            ratio = '%.2f' % ratio
+        out.write('%-32s %12s %12s %8s  %s\n' % (key, _ms(old), _ms(new),
+                                                ratio, status))
+        if status in ('regression', 'memory'):
+            failed = True
+    return failed and 1 or 0
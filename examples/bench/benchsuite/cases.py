@@ -0,0 +1,306 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright (C) 2010 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://genshi.edgewall.org/wiki/License.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://genshi.edgewall.org/log/.
+
+"""The benchmarks of the suite.
+
+The input of every benchmark is generated deterministically from the size,
+so that runs on different machines and Genshi versions measure exactly the
+same work.
+"""
+
+from gettext import NullTranslations
+from StringIO import StringIO
+
+from benchsuite.harness import Benchmark
+
+__all__ = ['SIZES', 'benchmarks']
+
+SIZES = {'small': 10, 'medium': 500, 'huge': 10000}
+"""The number of rows, comments or template sections used for each size."""
+
+_registry = []
+
+def benchmark(group, name):
+    """Decorator that registers a setup function as a benchmark for every
+    input size.
+    """
+    def _register(setup):
+        _registry.append((group, name, setup))
+        return setup
+    return _register
+
+
+def benchmarks(sizes=None, patterns=None):
+    """Return the list of benchmarks, optionally restricted to the given sizes
+    and to the benchmarks with a key that contains one of the given patterns.
+
+    :param sizes: a list of size names
+    :param patterns: a list of strings to match against the benchmark keys
+    :rtype: `list`
+    """
+    if not sizes:
+        sizes = ['small', 'medium', 'huge']
+    retval = []
+    for group, name, setup in _registry:
+        for size in sizes:
+            bench = Benchmark(group, name, size, _bind(setup, SIZES[size]))
+            if patterns and not [p for p in patterns if p in bench.key]:
+                continue
+            retval.append(bench)
+    return retval
+
+def _bind(setup, count):
+    return lambda: setup(count)
+
+
+# Input data
+
+def _rows(count):
+    return [dict(id=i, summary='Summary of ticket %d & more' % i,
+                 owner=['joe', 'jane', 'bob'][i % 3], status=i % 4 and 'new'
+                 or 'closed')
+            for i in range(count)]
+
+def _xml_doc(count):
+    return '<table>\n%s</table>' % ''.join([
+        '<tr class="row%d"><td><a href="/ticket/%d">#%d</a></td>'
+        '<td>Summary of ticket %d &amp; more</td>'
+        '<td><!-- owner -->%s</td></tr>\n' % (row['id'] % 2, row['id'],
+                                               row['id'], row['id'],
+                                               row['owner'])
+        for row in _rows(count)
+    ])
+
+_COMMENT = ('<div class="comment"><p style="color: #333; margin: 0 1em">'
+            'Thanks for the patch, see <a href="%s">this link</a> &amp; the '
+            '<em>attached</em> file.<br>It <b>works</b></p>'
+            '<script>alert(%d)</script>'
+            '<img src="%s" alt="screenshot" onerror="alert(1)">'
+            '<ul><li>one<li>two &#8212; three</ul></div>\n')
+_LINKS = ['http://example.org/', '/wiki/WikiStart', 'javascript:alert(1)',
+          'mailto:joe@example.org']
+
+def _html_doc(count):
+    return ''.join([_COMMENT % (_LINKS[i % 4], i, _LINKS[(i + 1) % 4])
+                    for i in range(count)])
+
+_SECTION = '''
+  <div class="section" py:if="show">
+    <h2>Section %(num)d: ${title}</h2>
+    <p py:for="idx, item in enumerate(items)" class="${idx %% 2 and 'odd' or None}">
+      ${item} <em py:if="idx == %(num)d">selected</em>
+    </p>
+    ${greeting(user)}
+  </div>'''
+
+_TEMPLATE = '''<html xmlns="http://www.w3.org/1999/xhtml"
+      xmlns:py="http://genshi.edgewall.org/">
+  <py:match path="body" once="true">
+    <body><div id="header">${title}</div>${select('*|text()')}</body>
+  </py:match>
+  <py:def function="greeting(name)"><p>Hello, ${name}!</p></py:def>
+  <head><title>${title}</title></head>
+  <body>%s
+    <table>
+      <tr py:for="row in rows" class="${row.status}">
+        <td><a href="/ticket/${row.id}">#${row.id}</a></td>
+        <td>${row.summary}</td>
+        <td py:choose="row.owner">
+          <py:when test="'joe'"><strong>joe</strong></py:when>
+          <py:otherwise>${row.owner}</py:otherwise>
+        </td>
+      </tr>
+    </table>
+  </body>
+</html>'''
+
+def _template_source(sections):
+    return _TEMPLATE % ''.join([_SECTION % {'num': num}
+                                for num in range(sections)])
+
+class _Row(object):
+    def __init__(self, data):
+        self.__dict__.update(data)
+
+def _template_data(count):
+    return dict(title='Genshi benchmark', user='joe', show=True,
+                items=['Item %d' % i for i in range(10)],
+                rows=[_Row(row) for row in _rows(count)])
+
+def _rendered(count):
+    from genshi.core import Stream
+    from genshi.template import MarkupTemplate
+    tmpl = MarkupTemplate(_template_source(1))
+    return Stream(list(tmpl.generate(**_template_data(count))))
+
+
+class _Translations(NullTranslations):
+
+    def ugettext(self, message):
+        return message.upper()
+
+
+# Parsing
+
+@benchmark('parse', 'xml')
+def parse_xml(count):
+    from genshi.input import XMLParser
+    source = _xml_doc(count)
+    def run():
+        for event in XMLParser(StringIO(source)):
+            pass
+    return run
+
+@benchmark('parse', 'html')
+def parse_html(count):
+    from genshi.input import HTMLParser
+    source = _html_doc(count)
+    def run():
+        for event in HTMLParser(StringIO(source), encoding='utf-8'):
+            pass
+    return run
+
+
+# Templates
+
+@benchmark('prepare', 'markup')
+def prepare_markup(count):
+    from genshi.template import MarkupTemplate
+    source = _template_source(max(1, count // 10))
+    def run():
+        MarkupTemplate(source).stream
+    return run
+
+@benchmark('render', 'markup')
+def render_markup(count):
+    from genshi.template import MarkupTemplate
+    tmpl = MarkupTemplate(_template_source(1))
+    tmpl.stream
+    data = _template_data(count)
+    def run():
+        for event in tmpl.generate(**data):
+            pass
+    return run
+
+@benchmark('render', 'text')
+def render_text(count):
+    from genshi.template import NewTextTemplate
+    tmpl = NewTextTemplate('''Tickets for ${user}
+{% for row in rows %}\\
+{% if row.status == 'new' %}* {% end %}#${row.id} ${row.summary} (${row.owner})
+{% end %}''')
+    data = _template_data(count)
+    def run():
+        tmpl.generate(**data).render('text', encoding=None)
+    return run
+
+
+# Serialization
+
+@benchmark('serialize', 'xml')
+def serialize_xml(count):
+    stream = _rendered(count)
+    def run():
+        stream.render('xml', encoding='utf-8')
+    return run
+
+@benchmark('serialize', 'html')
+def serialize_html(count):
+    stream = _rendered(count)
+    def run():
+        stream.render('html', doctype='html', encoding='utf-8')
+    return run
+
+
+# XPath
+
+@benchmark('xpath', 'select')
+def xpath_select(count):
+    from genshi.input import XML
+    stream = XML(_xml_doc(count))
+    def run():
+        for event in stream.select('tr[@class="row1"]/td/a/text()'):
+            pass
+    return run
+
+@benchmark('xpath', 'descendant')
+def xpath_descendant(count):
+    from genshi.input import XML
+    stream = XML(_xml_doc(count))
+    def run():
+        for event in stream.select('//a[@href]'):
+            pass
+    return run
+
+
+# Filters
+
+@benchmark('sanitize', 'html')
+def sanitize_html(count):
+    from genshi.filters import HTMLSanitizer
+    from genshi.input import HTML
+    stream = HTML(_html_doc(count), encoding='utf-8')
+    sanitizer = HTMLSanitizer()
+    def run():
+        for event in stream | sanitizer:
+            pass
+    return run
+
+@benchmark('transform', 'attrs')
+def transform_attrs(count):
+    from genshi.filters import Transformer
+    from genshi.input import XML
+    stream = XML(_xml_doc(count))
+    transform = Transformer('//tr[@class="row1"]').attr('class', 'odd') \
+                    .rename('row').end().select('//td/a').append('!')
+    def run():
+        for event in stream | transform:
+            pass
+    return run
+
+@benchmark('transform', 'copy')
+def transform_copy(count):
+    from genshi.filters import Transformer
+    from genshi.filters.transform import StreamBuffer
+    from genshi.input import XML
+    stream = XML(_xml_doc(count))
+    buffer = StreamBuffer()
+    transform = Transformer('//tr[1]').copy(buffer).end() \
+                    .select('//tr').after(buffer)
+    def run():
+        for event in stream | transform:
+            pass
+    return run
+
+@benchmark('i18n', 'translate')
+def i18n_translate(count):
+    from genshi.filters import Translator
+    from genshi.input import XML
+    stream = XML(_xml_doc(count))
+    translator = Translator(_Translations())
+    def run():
+        for event in stream | translator:
+            pass
+    return run
+
+@benchmark('i18n', 'template')
+def i18n_template(count):
+    from genshi.filters import Translator
+    from genshi.template import MarkupTemplate
+    tmpl = MarkupTemplate(_template_source(1))
+    Translator(_Translations()).setup(tmpl)
+    data = _template_data(count)
+    def run():
+        for event in tmpl.generate(**data):
+            pass
+    return run
@@ -0,0 +1,277 @@
+# -*- encoding: utf-8 -*-
+#
+# Copyright (C) 2010 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://genshi.edgewall.org/wiki/License.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://genshi.edgewall.org/log/.
+
+"""Measurement of benchmarks: warmup, calibration of the number of calls per
+sample, timing, and peak memory use.
+"""
+
+import gc
+import os
+import platform
+import sys
+from time import time
+try:
+    import json
+except ImportError:
+    import simplejson as json
+try:
+    import resource
+except ImportError:
+    resource = None
+
+__all__ = ['Benchmark', 'measure', 'environment', 'load', 'save']
+
+
+class Benchmark(object):
+    """A single benchmark, a function that is timed repeatedly on input that
+    is prepared once by a setup function.
+    """
+
+    def __init__(self, group, name, size, setup):
+        """Create the benchmark.
+
+        :param group: the area of Genshi being measured, such as ``"parse"``
+        :param name: the name of the benchmark within the group
+        :param size: the size of the input, ``"small"``, ``"medium"`` or
+                     ``"huge"``
+        :param setup: a function that prepares the input and returns the
+                      function to time
+        """
+        self.group = group
+        self.name = name
+        self.size = size
+        self.setup = setup
+
+    def __repr__(self):
+        return '<%s %r>' % (type(self).__name__, self.key)
+
+    def key(self):
+        return '%s.%s.%s' % (self.group, self.name, self.size)
+    key = property(key)
+
+
+def _timeit(func, number):
+    gc.collect()
+    start = time()
+    for _ in xrange(number):
+        func()
+    return time() - start
+
+
+def _calibrate(func, min_time):
+    # Double the number of calls until a sample takes long enough to be
+    # measured reliably with the resolution of the timer
+    number = 1
+    while True:
+        elapsed = _timeit(func, number)
+        if elapsed >= min_time:
+            return number
+        if elapsed <= 0:
+            number *= 10
+        else:
+            number = max(number * 2,
+                         int(number * min_time / elapsed * 1.2) or 1)
+
+
+def _status(field):
+    # Read a memory figure in kilobytes from the process status on Linux
+    try:
+        fileobj = open('/proc/self/status')
+    except IOError:
+        return None
+    try:
+        for line in fileobj:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+    finally:
+        fileobj.close()
+
+
+def _reset_peak():
+    # Reset the peak resident set size reported by the Linux kernel, so that
+    # it reflects the benchmark rather than anything that ran before it
+    try:
+        fileobj = open('/proc/self/clear_refs', 'w')
+        try:
+            fileobj.write('5')
+        finally:
+            fileobj.close()
+    except (IOError, OSError):
+        return False
+    return _status('VmHWM') is not None
+
+
+def _maxrss():
+    # The peak resident set size of the process, in kilobytes
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        usage /= 1024
+    return usage
+
+
+def _peak_memory(func, calls):
+    # Call the function and return by how much it made the peak resident set
+    # size grow, in kilobytes, or None if that can not be determined
+    gc.collect()
+    if _reset_peak():
+        before = _status('VmRSS')
+        for _ in xrange(calls):
+            func()
+        return max(0, _status('VmHWM') - before)
+    elif resource is not None:
+        before = _maxrss()
+        for _ in xrange(calls):
+            func()
+        return _maxrss() - before
+    for _ in xrange(calls):
+        func()
+
+
+def _run(benchmark, warmup, repeat, min_time):
+    func = benchmark.setup()
+    memory = _peak_memory(func, max(warmup, 1))
+    number = _calibrate(func, min_time)
+    samples = [_timeit(func, number) / number for _ in xrange(repeat)]
+    return _summarize(samples, number, memory)
+
+
+def _summarize(samples, number, memory):
+    samples.sort()
+    count = len(samples)
+    mean = sum(samples) / count
+    if count % 2:
+        median = samples[count // 2]
+    else:
+        median = (samples[count // 2 - 1] + samples[count // 2]) / 2
+    variance = sum([(s - mean) ** 2 for s in samples]) / count
+    return {
+        'number': number, 'repeat': count,
+        'min': samples[0], 'max': samples[-1], 'mean': mean,
+        'median': median, 'stdev': variance ** 0.5,
+        'memory': memory
+    }
+
+
+def measure(benchmark, warmup=1, repeat=5, min_time=0.2, isolate=True):
+    """Run the benchmark and return a dictionary of statistics about it.
+
+    The benchmark is first run `warmup` times, then the number of calls per
+    sample is calibrated so that a sample takes at least `min_time` seconds.
+    Finally `repeat` samples are taken. Times are in seconds per call.
+
+    The ``memory`` entry is the growth of the peak resident set size of the
+    process during the warmup calls, in kilobytes, or `None` if the platform
+    does not provide it. To measure it for every benchmark on its own, and to
+    keep benchmarks from affecting each other through caches, each benchmark
+    is run in a forked process if `isolate` is true and the platform supports
+    it.
+
+    :param benchmark: the `Benchmark` to run
+    :param warmup: the number of calls before the timing starts
+    :param repeat: the number of samples to take
+    :param min_time: the minimum duration of a sample, in seconds
+    :param isolate: whether to run the benchmark in a separate process
+    :rtype: `dict`
+    """
+    if not isolate or not hasattr(os, 'fork'):
+        return _run(benchmark, warmup, repeat, min_time)
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+    rfd, wfd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(rfd)
+        status = 0
+        try:
+            try:
+                result = json.dumps(_run(benchmark, warmup, repeat, min_time))
+            except:
+                result = json.dumps({'error': str(sys.exc_info()[1])})
+                status = 1
+            out = os.fdopen(wfd, 'w')
+            out.write(result)
+            out.close()
+        finally:
+            os._exit(status)
+
+    os.close(wfd)
+    data = os.fdopen(rfd).read()
+    os.waitpid(pid, 0)
+    if not data:
+        raise RuntimeError('benchmark %s did not report results' %
+                           benchmark.key)
+    result = json.loads(data)
+    if 'error' in result:
+        raise RuntimeError('benchmark %s failed: %s' % (benchmark.key,
+                                                        result['error']))
+    return result
+
+
+def environment():
+    """Return a description of the environment the benchmarks are run in,
+    which is stored with the results to tell apart runs that are not
+    comparable.
+
+    :rtype: `dict`
+    """
+    import genshi
+    from genshi.input import lxml_etree
+    return {
+        'genshi': genshi.__version__,
+        'python': platform.python_version(),
+        'implementation': getattr(platform, 'python_implementation',
+                                  lambda: 'CPython')(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'speedups': _has_speedups(),
+        'lxml': lxml_etree is not None,
+        'timestamp': time()
+    }
+
+
+def _has_speedups():
+    try:
+        from genshi import _speedups
+    except ImportError:
+        return False
+    return True
+
+
+def load(filename):
+    """Read benchmark results from a JSON file.
+
+    :rtype: `dict`
+    """
+    fileobj = open(filename)
+    try:
+        return json.load(fileobj)
+    finally:
+        fileobj.close()
+
+
+def save(results, filename):
+    """Write benchmark results to a JSON file.
+
+    :param results: the results, as returned by `benchsuite.run()`
+    :param filename: the name of the file, or ``"-"`` for standard output
+    """
+    if filename == '-':
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+        return
+    fileobj = open(filename, 'w')
+    try:
+        json.dump(results, fileobj, indent=2, sort_keys=True)
+    finally:
+        fileobj.close()
@@ -0,0 +1,66 @@
+# -*- encoding: utf-8 -*-
+# Expression evaluation benchmarks
+#
+# Objective: Evaluate template expressions as fast as possible. Pages evaluate
+# tens of thousands of expressions per render, so the per-evaluation overhead
+# of setting up the execution context matters.
+
+import sys
+import timeit
+
+from genshi.template.eval import Expression
+
+data = {'item': {'name': 'Item', 'price': 10}, 'items': range(10)}
+
+shared = [Expression(source) for source in
+          ('item.name', 'item["price"] * 2', 'len(items) > 5')]
+unshared = [Expression(source) for source in
+            ('item.name', 'item["price"] * 2', 'len(items) > 5')]
+for expr in unshared:
+    # Force the construction of the globals on every evaluation
+    expr._shared_globals = None
+
+
+def test_shared():
+    """Expression (shared globals)"""
+    for i in range(1000):
+        for expr in shared:
+            expr.evaluate(data)
+
+def test_unshared():
+    """Expression (globals per call)"""
+    for i in range(1000):
+        for expr in unshared:
+            expr.evaluate(data)
+
+
+def run(which=None, number=10):
+    tests = ['test_shared', 'test_unshared']
+
+    if which:
+        tests = filter(lambda n: n[5:] in which, tests)
+
+    for test in [t for t in tests if hasattr(sys.modules[__name__], t)]:
+        t = timeit.Timer(setup='from __main__ import %s;' % test,
+                         stmt='%s()' % test)
+        time = t.timeit(number=number) / number
+        print '%-35s %16.2f ms' % (getattr(sys.modules[__name__], test).__doc__,
+                                   1000 * time)
+
+
+if __name__ == '__main__':
+    which = [arg for arg in sys.argv[1:] if arg[0] != '-']
+
+    if '-p' in sys.argv:
+        import cProfile, pstats
+        prof = cProfile.Profile()
+        prof.run('run(%r, number=1)' % which)
+        stats = pstats.Stats(prof)
+        stats.strip_dirs()
+        stats.sort_stats('time', 'calls')
+        stats.print_stats(25)
+        if '-v' in sys.argv:
+            stats.print_callees()
+            stats.print_callers()
+    else:
+        run(which)
@@ -0,0 +1,68 @@
+# -*- encoding: utf-8 -*-
+# Parser benchmarks
+#
+# Objective: Parse a large XML and HTML document as fast as possible, comparing
+# the built-in XML parser with the lxml based parser.
+
+import sys
+import timeit
+from StringIO import StringIO
+
+from genshi.input import XMLParser, HTMLParser, LXMLParser, lxml_etree
+
+rows = ''.join(['<tr class="row%d"><td><a href="/ticket/%d">#%d</a></td>'
+                '<td>Summary of ticket %d &amp; more</td>'
+                '<td><!-- owner -->joe</td></tr>\n' % (i % 2, i, i, i)
+                for i in range(5000)])
+xml_doc = '<table>\n%s</table>' % rows
+html_doc = '<div><p>Comment with <b>markup</b><br>and text<ul><li>one<li>two' \
+           '</ul></div>\n' * 1000 + '<table>%s</table>' % rows
+
+
+def test_xml():
+    """XMLParser"""
+    for event in XMLParser(StringIO(xml_doc)):
+        pass
+
+if lxml_etree:
+    def test_lxml():
+        """LXMLParser"""
+        for event in LXMLParser(StringIO(xml_doc)):
+            pass
+
+def test_html():
+    """HTMLParser"""
+    for event in HTMLParser(StringIO(html_doc), encoding='utf-8'):
+        pass
+
+
+def run(which=None, number=10):
+    tests = ['test_xml', 'test_lxml', 'test_html']
+
+    if which:
+        tests = filter(lambda n: n[5:] in which, tests)
+
+    for test in [t for t in tests if hasattr(sys.modules[__name__], t)]:
+        t = timeit.Timer(setup='from __main__ import %s;' % test,
+                         stmt='%s()' % test)
+        time = t.timeit(number=number) / number
+        print '%-35s %16.2f ms' % (getattr(sys.modules[__name__], test).__doc__,
+                                   1000 * time)
+
+
+if __name__ == '__main__':
+    which = [arg for arg in sys.argv[1:] if arg[0] != '-']
+
+    if '-p' in sys.argv:
+        import cProfile, pstats
+        prof = cProfile.Profile()
+        prof.run('run(%r, number=1)' % which)
+        stats = pstats.Stats(prof)
+        stats.strip_dirs()
+        stats.sort_stats('time', 'calls')
+        stats.print_stats(25)
+        if '-v' in sys.argv:
+            stats.print_callees()
+            stats.print_callers()
+    else:
+        run(which)
@@ -0,0 +1,80 @@
+# -*- encoding: utf-8 -*-
+# Sanitizer benchmarks
+#
+# Objective: Sanitize a corpus of user comments as fast as possible. Comments
+# tend to repeat the same links and inline styles, which is what the memo
+# caches of the sanitizer are meant to exploit.
+
+import sys
+import timeit
+
+from genshi.filters import HTMLSanitizer
+from genshi.input import HTML
+
+styles = ['color: red', 'font-weight: bold', 'color: #333; margin: 0 1em',
+          'background: url(javascript:alert(1))', 'position: absolute; top: 0',
+          'text-decoration: underline']
+links = ['http://example.org/', '/wiki/WikiStart', '#comment:%d',
+         'javascript:alert(document.cookie)', 'mailto:joe@example.org',
+         'https://example.com/ticket/%d']
+
+def comment(i):
+    return ('<div class="comment"><p style="%s">Thanks for the patch, '
+            'see <a href="%s" title="link">this link</a> &amp; the '
+            '<em>attached</em> file.</p><script>alert(%d)</script>'
+            '<img src="%s" alt="screenshot" onerror="alert(1)"/>'
+            '<ul><li style="%s">one</li><li>two &#8212; three</li></ul>'
+            '</div>' % (styles[i % len(styles)], links[i % len(links)], i,
+                        links[(i + 1) % len(links)],
+                        styles[(i + 2) % len(styles)])).replace('%d', str(i % 7))
+
+corpus = [HTML(comment(i), encoding='utf-8') for i in range(500)]
+
+safe_attrs = HTMLSanitizer.SAFE_ATTRS | set(['style'])
+cached = HTMLSanitizer(safe_attrs=safe_attrs)
+uncached = HTMLSanitizer(safe_attrs=safe_attrs, cache_size=0)
+
+
+def test_cached():
+    """HTMLSanitizer (memoized)"""
+    for stream in corpus:
+        for event in cached(stream):
+            pass
+
+def test_uncached():
+    """HTMLSanitizer (no cache)"""
+    for stream in corpus:
+        for event in uncached(stream):
+            pass
+
+
+def run(which=None, number=10):
+    tests = ['test_cached', 'test_uncached']
+
+    if which:
+        tests = filter(lambda n: n[5:] in which, tests)
+
+    for test in [t for t in tests if hasattr(sys.modules[__name__], t)]:
+        t = timeit.Timer(setup='from __main__ import %s;' % test,
+                         stmt='%s()' % test)
+        time = t.timeit(number=number) / number
+        print '%-35s %16.2f ms' % (getattr(sys.modules[__name__], test).__doc__,
+                                   1000 * time)
+
+
+if __name__ == '__main__':
+    which = [arg for arg in sys.argv[1:] if arg[0] != '-']
+
+    if '-p' in sys.argv:
+        import cProfile, pstats
+        prof = cProfile.Profile()
+        prof.run('run(%r, number=1)' % which)
+        stats = pstats.Stats(prof)
+        stats.strip_dirs()
+        stats.sort_stats('time', 'calls')
+        stats.print_stats(25)
+        if '-v' in sys.argv:
+            stats.print_callees()
+            stats.print_callers()
+    else:
+        run(which)
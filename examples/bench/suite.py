@@ -0,0 +1,14 @@
+# -*- encoding: utf-8 -*-
+# Benchmark suite
+#
+# Objective: Measure the performance of all areas of Genshi on small, medium
+# and huge input in a reproducible way, and compare the results against a
+# stored baseline. See the benchsuite package for details.
+
+import sys
+
+from benchsuite import main
+
+
+if __name__ == '__main__':
+    sys.exit(main())
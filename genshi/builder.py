@@ -68,8 +68,12 @@ returns an object of type `Fragment`:
 Hello, <em>world</em>!
 """
 
+import re
+
 from genshi.core import Attrs, Markup, Namespace, QName, Stream, \
-                        START, END, TEXT
+                        START, END, TEXT, escape
+from genshi.output import XMLSerializer, XHTMLSerializer, HTMLSerializer, \
+                          encode
 
 __all__ = ['Fragment', 'Element', 'ElementFactory', 'tag']
 __docformat__ = 'restructuredtext en'
@@ -104,13 +108,13 @@ class Fragment(object):
         return '<%s>' % type(self).__name__
 
     def __str__(self):
-        return str(self.generate())
+        return str(self.render())
 
     def __unicode__(self):
-        return unicode(self.generate())
+        return unicode(self.render())
 
     def __html__(self):
-        return Markup(self.generate())
+        return self.render()
 
     def append(self, node):
         """Append an element or string as child node.
@@ -132,17 +136,7 @@ class Fragment(object):
                 self.children.append(node)
 
     def _generate(self):
-        for child in self.children:
-            if isinstance(child, Fragment):
-                for event in child._generate():
-                    yield event
-            elif isinstance(child, Stream):
-                for event in child:
-                    yield event
-            else:
-                if not isinstance(child, basestring):
-                    child = unicode(child)
-                yield TEXT, child, (None, -1, -1)
+        return _generate(self.children)
 
     def generate(self):
         """Return a markup event stream for the fragment.
@@ -151,6 +145,47 @@ class Fragment(object):
         """
         return Stream(self._generate())
 
+    def render(self, method='xml', encoding=None, out=None, **kwargs):
+        """Return a string representation of the fragment.
+        
+        >>> print(tag.p('1 < 2', tag.br, class_='note').render('html'))
+        <p class="note">1 &lt; 2<br></p>
+        
+        Any additional keyword arguments are passed to the serializer, as with
+        `Stream.render`.
+        
+        For the "xml", "xhtml" and "html" methods, elements without namespaces
+        are serialized directly, without producing a markup event stream first.
+        The result is identical to serializing the stream returned by
+        `generate()` with the default serializer options, which is what is done
+        for any other method or content (such as nested `Stream` objects), and
+        if serializer options or the `out` parameter are given.
+        
+        :param method: the serialization method; can be either "xml", "xhtml",
+                       "html", "text", or a custom serializer class
+        :param encoding: how the output string should be encoded; if set to
+                         `None`, this method returns a `Markup` object (or a
+                         `unicode` object for the "text" method)
+        :param out: a file-like object that the output should be written to
+                    instead of being returned as one big string
+        :return: a `Markup`, `unicode` or `str` object, or `None` if the `out`
+                 parameter is provided
+        :see: `Stream.render`
+        :note: Added in 0.7
+        """
+        if out is not None:
+            return self.generate().render(method, encoding, out, **kwargs)
+        output = None
+        if method in _SERIALIZERS and not kwargs:
+            output = _serialize(self, method)
+        if output is None:
+            output = self.generate().render(method, encoding=None, **kwargs)
+            if method in _SERIALIZERS:
+                output = Markup(output)
+        if encoding is not None:
+            return encode([output], method=method, encoding=encoding)
+        return output
+
 
 def _kwargs_to_attrs(kwargs):
     attrs = []
@@ -266,8 +301,8 @@ class Element(Fragment):
 
     def _generate(self):
         yield START, (self.tag, self.attrib), (None, -1, -1)
-        for kind, data, pos in Fragment._generate(self):
-            yield kind, data, pos
+        for event in _generate(self.children):
+            yield event
         yield END, self.tag, (None, -1, -1)
 
     def generate(self):
@@ -278,6 +313,170 @@ class Element(Fragment):
         return Stream(self._generate())
 
 
+def _generate(children, pos=(None, -1, -1)):
+    # Walk the tree with an explicit stack instead of nesting one generator per
+    # element, so that deep trees neither recurse nor pay for the generator
+    # chain on every event
+    stack = []
+    children = iter(children)
+    while True:
+        for child in children:
+            if type(child) is Element or (isinstance(child, Element) and
+                    type(child)._generate == Element._generate):
+                yield START, (child.tag, child.attrib), pos
+                stack.append((children, child.tag))
+                children = iter(child.children)
+                break
+            elif isinstance(child, Fragment):
+                # Subclasses may override how their events are generated
+                for event in child._generate():
+                    yield event
+            elif isinstance(child, Stream):
+                for event in child:
+                    yield event
+            else:
+                if not isinstance(child, basestring):
+                    child = unicode(child)
+                yield TEXT, child, pos
+        else:
+            if not stack:
+                return
+            children, tag = stack.pop()
+            yield END, tag, pos
+
+
+_SERIALIZERS = {'xml': XMLSerializer, 'xhtml': XHTMLSerializer,
+                'html': HTMLSerializer}
+
+_start_tags = {}
+_START_TAGS_SIZE = 1000
+
+def _start_tag(method, tag, attrib, empty):
+    # Return the serialized start tag of an element, or `None` if it needs
+    # namespace processing; the results are cached, as helper code tends to
+    # create many elements with the same attributes
+    key = (method, tag, attrib, empty)
+    try:
+        return _start_tags[key]
+    except KeyError:
+        pass
+    except TypeError: # unhashable attribute value
+        key = None
+
+    if tag.namespace:
+        return None
+    cls = _SERIALIZERS[method]
+    buf = ['<', tag.localname]
+    for attr, value in attrib:
+        if attr.namespace or ':' in attr or attr == 'xmlns':
+            return None
+        if method == 'xml':
+            buf += [' ', attr, '="', escape(value), '"']
+        elif attr in cls._BOOLEAN_ATTRS:
+            if method == 'xhtml':
+                buf += [' ', attr, '="', attr, '"']
+            elif value:
+                buf += [' ', attr]
+        else:
+            buf += [' ', attr, '="', escape(value), '"']
+    if not empty:
+        buf.append('>')
+    elif method == 'xml':
+        buf.append('/>')
+    elif method == 'xhtml':
+        if tag in cls._EMPTY_ELEMS:
+            buf.append(' />')
+        else:
+            buf.append('></%s>' % tag.localname)
+    else:
+        buf.append('>')
+        if tag not in cls._EMPTY_ELEMS:
+            buf.append('</%s>' % tag.localname)
+    output = ''.join(buf)
+
+    if key is not None:
+        if len(_start_tags) >= _START_TAGS_SIZE:
+            _start_tags.clear()
+        _start_tags[key] = output
+    return output
+
+def _serialize(fragment, method,
+               trim_trailing_space=re.compile('[ \t]+(?=\n)').sub,
+               collapse_lines=re.compile('\n{2,}').sub):
+    # Serialize the fragment without going through the event stream, with the
+    # same result as the serializer for the given method including its
+    # whitespace filter; returns `None` if the fragment contains anything this
+    # can not handle, so that the caller can fall back to the stream
+    cls = _SERIALIZERS[method]
+    preserve_elems = cls._PRESERVE_SPACE
+    noescape_elems = getattr(cls, '_NOESCAPE_ELEMS', ())
+    preserve = 0
+    noescape = False
+
+    if type(fragment) is Element:
+        nodes = [fragment]
+    elif type(fragment) is Fragment:
+        nodes = fragment.children
+    else:
+        return None
+
+    buf = []
+    textbuf = []
+    stack = []
+    children = iter(nodes)
+    while True:
+        for child in children:
+            if isinstance(child, Element):
+                if type(child) is not Element:
+                    return None
+                if textbuf:
+                    text = ''.join(textbuf)
+                    del textbuf[:]
+                    if not preserve and '\n' in text:
+                        text = collapse_lines('\n',
+                                              trim_trailing_space('', text))
+                    buf.append(text)
+                tag = child.tag
+                start = _start_tag(method, tag, child.attrib,
+                                   not child.children)
+                if start is None:
+                    return None
+                buf.append(start)
+                if child.children:
+                    if preserve or tag in preserve_elems:
+                        preserve += 1
+                    if not noescape and tag in noescape_elems:
+                        noescape = True
+                    stack.append((children, tag))
+                    children = iter(child.children)
+                    break
+            elif isinstance(child, (Fragment, Stream)):
+                return None
+            else:
+                if not isinstance(child, basestring):
+                    child = unicode(child)
+                if noescape:
+                    textbuf.append(Markup(child))
+                else:
+                    textbuf.append(escape(child, quotes=False))
+        else:
+            if textbuf:
+                text = ''.join(textbuf)
+                del textbuf[:]
+                if not preserve and '\n' in text:
+                    text = collapse_lines('\n', trim_trailing_space('', text))
+                buf.append(text)
+            if not stack:
+                break
+            children, tag = stack.pop()
+            buf.append('</%s>' % tag.localname)
+            noescape = False
+            if preserve:
+                preserve -= 1
+
+    return Markup(''.join(buf))
+
+
 class ElementFactory(object):
     """Factory for `Element` objects.
     
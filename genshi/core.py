@@ -20,11 +20,12 @@ except NameError:
 import sys
 from itertools import chain
 import operator
+from time import time
 
 from genshi.util import plaintext, stripentities, striptags, stringrepr
 
-__all__ = ['Stream', 'Markup', 'escape', 'unescape', 'Attrs', 'Namespace',
-           'QName']
+__all__ = ['Stream', 'IndexedStream', 'Markup', 'escape', 'unescape', 'Attrs',
+           'Namespace', 'QName']
 __docformat__ = 'restructuredtext en'
 
 
@@ -154,7 +155,8 @@ class Stream(object):
         """
         return reduce(operator.or_, (self,) + filters)
 
-    def render(self, method=None, encoding=None, out=None, **kwargs):
+    def render(self, method=None, encoding=None, out=None, metrics=None,
+               **kwargs):
         """Return a string representation of the stream.
         
         Any additional keyword arguments are passed to the serializer, and thus
@@ -170,18 +172,36 @@ class Stream(object):
                     instead of being returned as one big string; note that if
                     this is a file or socket (or similar), the `encoding` must
                     not be `None` (that is, the output must be encoded)
+        :param metrics: a function that is called with the `RenderMetrics` of
+                        the serialization once the output is complete; when
+                        the output is written to `out`, the reported size is
+                        the number of characters before encoding
         :return: a `str` or `unicode` object (depending on the `encoding`
                  parameter), or `None` if the `out` parameter is provided
         :rtype: `basestring`
         
         :see: XMLSerializer, XHTMLSerializer, HTMLSerializer, TextSerializer
         :note: Changed in 0.5: added the `out` parameter
+        :note: Changed in 0.7: added the `metrics` parameter
         """
         from genshi.output import encode
         if method is None:
             method = self.serializer or 'xml'
-        generator = self.serialize(method=method, **kwargs)
-        return encode(generator, method=method, encoding=encoding, out=out)
+        if metrics is None:
+            generator = self.serialize(method=method, **kwargs)
+            return encode(generator, method=method, encoding=encoding, out=out)
+
+        collected = []
+        start = time()
+        generator = self.serialize(method=method, metrics=collected.append,
+                                   **kwargs)
+        output = encode(generator, method=method, encoding=encoding, out=out)
+        stats = collected[0]
+        stats.serialize_time = time() - start - stats.stream_time
+        if output is not None:
+            stats.bytes = len(output)
+        metrics(stats)
+        return output
 
     def select(self, path, namespaces=None, variables=None):
         """Return a new stream that contains the events matching the given
@@ -219,7 +239,7 @@ class Stream(object):
         from genshi.path import Path
         return Path(path).select(self, namespaces, variables)
 
-    def serialize(self, method='xml', **kwargs):
+    def serialize(self, method='xml', metrics=None, **kwargs):
         """Generate strings corresponding to a specific serialization of the
         stream.
         
@@ -234,15 +254,21 @@ class Stream(object):
                        "xml", "xhtml", "html", "text", or a custom serializer
                        class; if `None`, the default serialization method of
                        the stream is used
+        :param metrics: a function that is called with the `RenderMetrics` of
+                        the serialization once the output is complete
         :return: an iterator over the serialization results (`Markup` or
                  `unicode` objects, depending on the serialization method)
         :rtype: ``iterator``
         :see: XMLSerializer, XHTMLSerializer, HTMLSerializer, TextSerializer
+        :note: Changed in 0.7: added the `metrics` parameter
         """
-        from genshi.output import get_serializer
+        from genshi.output import get_serializer, _serialize
         if method is None:
             method = self.serializer or 'xml'
-        return get_serializer(method, **kwargs)(_ensure(self))
+        serializer = get_serializer(method, **kwargs)
+        if metrics is not None:
+            return _serialize(serializer, _ensure(self), metrics)
+        return serializer(_ensure(self))
 
     def __str__(self):
         return self.render()
@@ -254,6 +280,92 @@ class Stream(object):
         return self
 
 
+class IndexedStream(Stream):
+    """A fully materialized markup stream that can be queried repeatedly.
+
+    The events of an indexed stream are stored in a list, together with a
+    structural index that records, for every `START` event, the position of
+    the matching `END` event, the position of the enclosing element for every
+    event, and the positions of elements by local name.
+
+    >>> from genshi.input import XML
+    >>> doc = IndexedStream(XML('<doc><elem>foo</elem><elem>bar</elem></doc>'))
+    >>> doc.ends[0], doc.parents[2], doc.index['elem']
+    (7, 1, [1, 4])
+
+    Streams that are queried many times should be indexed once, as XPath
+    selections on an indexed stream use the index to skip over any subtrees
+    that can not possibly contain a match:
+
+    >>> print(doc.select('elem/text()'))
+    foobar
+    >>> print(doc.select('elem[2]'))
+    <elem>bar</elem>
+
+    :note: Added in 0.7
+    """
+    __slots__ = ['ends', 'parents', 'index']
+
+    def __init__(self, events, serializer=None):
+        """Initialize the stream by consuming the given sequence of events and
+        building the index.
+
+        :param events: a sequence or iterable providing the events
+        :param serializer: the default serialization method to use for this
+                           stream; if not specified, the serializer of the
+                           given stream (if any) is used
+        """
+        if serializer is None:
+            serializer = getattr(events, 'serializer', None)
+        events = list(events)
+        Stream.__init__(self, events, serializer=serializer)
+
+        #: Position of the matching `END` event for every `START` event (and
+        #: vice versa), or `None` for other kinds of events. This is `None` if
+        #: the stream is not well-formed.
+        self.ends = ends = [None] * len(events)
+        #: Position of the enclosing `START` event for every event, or ``-1``
+        #: for top-level events
+        self.parents = parents = []
+        #: Mapping of local names to the ordered positions of the `START`
+        #: events of elements with that name
+        self.index = index = {}
+
+        stack = []
+        for idx, (kind, data, pos) in enumerate(events):
+            if stack:
+                parents.append(stack[-1])
+            else:
+                parents.append(-1)
+            if kind is START:
+                index.setdefault(data[0].localname, []).append(idx)
+                stack.append(idx)
+            elif kind is END:
+                if not stack:
+                    stack = None
+                    break
+                start = stack.pop()
+                ends[start] = idx
+                ends[idx] = start
+        if stack or stack is None:
+            self.ends = None
+
+    def subtree(self, idx):
+        """Return the list of events making up the element whose `START` event
+        is at the given position, including the `START` and `END` events.
+
+        >>> from genshi.input import XML
+        >>> doc = IndexedStream(XML('<doc><elem>foo</elem></doc>'))
+        >>> print(Stream(doc.subtree(doc.index['elem'][0])))
+        <elem>foo</elem>
+
+        :param idx: the position of the `START` event
+        :return: the list of events
+        :rtype: `list`
+        """
+        return self.events[idx:self.ends[idx] + 1]
+
+
 START = Stream.START
 END = Stream.END
 TEXT = Stream.TEXT
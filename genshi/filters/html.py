@@ -18,9 +18,19 @@ try:
 except NameError:
     from genshi.util import any
 import re
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
+try:
+    import threading
+except ImportError:
+    import dummy_threading as threading
 
-from genshi.core import Attrs, QName, stripentities
+from genshi.core import Attrs, Markup, QName, stripentities
 from genshi.core import END, START, TEXT, COMMENT
+from genshi.input import HTML
+from genshi.util import LRUCache
 
 __all__ = ['HTMLFormFiller', 'HTMLSanitizer']
 __docformat__ = 'restructuredtext en'
@@ -70,6 +80,9 @@ class HTMLFormFiller(object):
     def __call__(self, stream):
         """Apply the filter to the given stream.
         
+        If the filter targets a form by `name` or `id`, the rest of the stream
+        is passed through unchanged once that form has been closed.
+        
         :param stream: the markup event stream to filter
         """
         in_form = in_select = in_option = in_textarea = False
@@ -77,77 +90,63 @@ class HTMLFormFiller(object):
         option_start = None
         option_text = []
         no_option_value = False
+        targeted = self.name or self.id
+        fields = {}
 
+        stream = iter(stream)
         for kind, data, pos in stream:
 
-            if kind is START:
+            if not in_form:
+                if kind is START and data[0].localname == 'form':
+                    in_form = self._is_target(data[1])
+                yield kind, data, pos
+
+            elif kind is START:
                 tag, attrs = data
                 tagname = tag.localname
 
-                if tagname == 'form' and (
-                        self.name and attrs.get('name') == self.name or
-                        self.id and attrs.get('id') == self.id or
-                        not (self.id or self.name)):
-                    in_form = True
-
-                elif in_form:
-                    if tagname == 'input':
-                        type = attrs.get('type', '').lower()
-                        if type in ('checkbox', 'radio'):
-                            name = attrs.get('name')
-                            if name and name in self.data:
-                                value = self.data[name]
-                                declval = attrs.get('value')
-                                checked = False
-                                if isinstance(value, (list, tuple)):
-                                    if declval is not None:
-                                        checked = declval in [unicode(v) for v
-                                                              in value]
-                                    else:
-                                        checked = any(value)
-                                else:
-                                    if declval is not None:
-                                        checked = declval == unicode(value)
-                                    elif type == 'checkbox':
-                                        checked = bool(value)
-                                if checked:
-                                    attrs |= [(QName('checked'), 'checked')]
-                                elif 'checked' in attrs:
-                                    attrs -= 'checked'
-                        elif type in ('', 'hidden', 'text') \
-                                or type == 'password' and self.passwords:
-                            name = attrs.get('name')
-                            if name and name in self.data:
-                                value = self.data[name]
-                                if isinstance(value, (list, tuple)):
-                                    value = value[0]
-                                if value is not None:
-                                    attrs |= [
-                                        (QName('value'), unicode(value))
-                                    ]
-                    elif tagname == 'select':
-                        name = attrs.get('name')
-                        if name in self.data:
-                            select_value = self.data[name]
-                            in_select = True
-                    elif tagname == 'textarea':
-                        name = attrs.get('name')
-                        if name in self.data:
-                            textarea_value = self.data.get(name)
-                            if isinstance(textarea_value, (list, tuple)):
-                                textarea_value = textarea_value[0]
-                            in_textarea = True
-                    elif in_select and tagname == 'option':
-                        option_start = kind, data, pos
-                        option_value = attrs.get('value')
-                        if option_value is None:
-                            no_option_value = True
-                            option_value = ''
-                        in_option = True
-                        continue
+                if tagname == 'input':
+                    type = attrs.get('type', '').lower()
+                    if type in ('checkbox', 'radio'):
+                        field = self._field(fields, attrs.get('name'))
+                        if field is not None:
+                            values, is_multi, truth, text = field
+                            declval = attrs.get('value')
+                            if declval is not None:
+                                checked = declval in values
+                            else:
+                                checked = truth and (is_multi or
+                                                     type == 'checkbox')
+                            if checked:
+                                attrs |= [(QName('checked'), 'checked')]
+                            elif 'checked' in attrs:
+                                attrs -= 'checked'
+                    elif type in ('', 'hidden', 'text') \
+                            or type == 'password' and self.passwords:
+                        field = self._field(fields, attrs.get('name'))
+                        if field is not None and field[3] is not None:
+                            attrs |= [(QName('value'), unicode(field[3]))]
+                elif tagname == 'select':
+                    field = self._field(fields, attrs.get('name'))
+                    if field is not None:
+                        select_value = field[0]
+                        in_select = True
+                elif tagname == 'textarea':
+                    field = self._field(fields, attrs.get('name'))
+                    if field is not None:
+                        textarea_value = field[3]
+                        in_textarea = True
+                elif in_select and tagname == 'option':
+                    option_start = kind, data, pos
+                    option_value = attrs.get('value')
+                    if option_value is None:
+                        no_option_value = True
+                        option_value = ''
+                    in_option = True
+                    continue
                 yield kind, (tag, attrs), pos
 
-            elif in_form and kind is TEXT:
+            elif kind is TEXT:
                 if in_select and in_option:
                     if no_option_value:
                         option_value += data
@@ -157,21 +156,20 @@ class HTMLFormFiller(object):
                     continue
                 yield kind, data, pos
 
-            elif in_form and kind is END:
+            elif kind is END:
                 tagname = data.localname
                 if tagname == 'form':
                     in_form = False
+                    yield kind, data, pos
+                    if targeted:
+                        break
+                    continue
                 elif tagname == 'select':
                     in_select = False
                     select_value = None
                 elif in_select and tagname == 'option':
-                    if isinstance(select_value, (tuple, list)):
-                        selected = option_value in [unicode(v) for v
-                                                    in select_value]
-                    else:
-                        selected = option_value == unicode(select_value)
                     okind, (tag, attrs), opos = option_start
-                    if selected:
+                    if option_value in select_value:
                         attrs |= [(QName('selected'), 'selected')]
                     elif 'selected' in attrs:
                         attrs -= 'selected'
@@ -193,6 +191,48 @@ class HTMLFormFiller(object):
             else:
                 yield kind, data, pos
 
+        for event in stream:
+            yield event
+
+    def _is_target(self, attrs):
+        if self.name:
+            if attrs.get('name') == self.name:
+                return True
+        if self.id:
+            return attrs.get('id') == self.id
+        return not self.name
+
+    def _field(self, fields, name):
+        # Return the normalized value of the given field as a tuple of the
+        # set of values as strings, whether multiple values were given, the
+        # truth value, and the first value (or `None`)
+        if not name:
+            return None
+        try:
+            return fields[name]
+        except KeyError:
+            pass
+        if name not in self.data:
+            field = None
+        else:
+            value = self.data[name]
+            if isinstance(value, (list, tuple)):
+                values = frozenset([unicode(v) for v in value])
+                is_multi = True
+                truth = any(value)
+                if value:
+                    first = value[0]
+                else:
+                    first = None
+            else:
+                values = frozenset([unicode(value)])
+                is_multi = False
+                truth = bool(value)
+                first = value
+            field = values, is_multi, truth, first
+        fields[name] = field
+        return field
+
 
 class HTMLSanitizer(object):
     """A filter that removes potentially dangerous HTML tags and attributes
@@ -228,6 +268,12 @@ class HTMLSanitizer(object):
     typical phishing attacks. For more sophisticated filtering, this class
     provides a couple of hooks that can be overridden in sub-classes.
     
+    The results of the URI and CSS checks are memoized per sanitizer instance
+    in bounded caches, as user generated content tends to repeat the same
+    links and inline styles over and over. If the configuration of an instance
+    is changed after it has been used, the caches should be cleared by calling
+    `clear_cache()`.
+    
     :warn: Note that this special processing of CSS is currently only applied to
            style attributes, **not** style elements.
     """
@@ -260,7 +306,8 @@ class HTMLSanitizer(object):
         'src'])
 
     def __init__(self, safe_tags=SAFE_TAGS, safe_attrs=SAFE_ATTRS,
-                 safe_schemes=SAFE_SCHEMES, uri_attrs=URI_ATTRS):
+                 safe_schemes=SAFE_SCHEMES, uri_attrs=URI_ATTRS,
+                 cache_size=1000):
         """Create the sanitizer.
         
         The exact set of allowed elements and attributes can be configured.
@@ -269,6 +316,9 @@ class HTMLSanitizer(object):
         :param safe_attrs: a set of attribute names that are considered safe
         :param safe_schemes: a set of URI schemes that are considered safe
         :param uri_attrs: a set of names of attributes that contain URIs
+        :param cache_size: the maximum number of URI and style attribute values
+                           for which the result of the check is memoized
+        :note: Changed in 0.7: added the `cache_size` parameter
         """
         self.safe_tags = safe_tags
         "The set of tag names that are considered safe."
@@ -278,6 +328,19 @@ class HTMLSanitizer(object):
         "The set of names of attributes that may contain URIs."
         self.safe_schemes = safe_schemes
         "The set of URI schemes that are considered safe."
+        self.cache_size = cache_size
+        self._lock = threading.RLock()
+        self.clear_cache()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_lock'] = state['_uri_cache'] = state['_css_cache'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__ = state
+        self._lock = threading.RLock()
+        self.clear_cache()
 
     def __call__(self, stream):
         """Apply the filter to the given stream.
@@ -285,6 +348,8 @@ class HTMLSanitizer(object):
         :param stream: the markup event stream to filter
         """
         waiting_for = None
+        safe_attrs = self.safe_attrs
+        uri_attrs = self.uri_attrs
 
         for kind, data, pos in stream:
             if kind is START:
@@ -297,19 +362,19 @@ class HTMLSanitizer(object):
 
                 new_attrs = []
                 for attr, value in attrs:
-                    value = stripentities(value)
-                    if attr not in self.safe_attrs:
+                    if attr not in safe_attrs:
                         continue
-                    elif attr in self.uri_attrs:
+                    if '&' in value:
+                        value = stripentities(value)
+                    if attr in uri_attrs:
                         # Don't allow URI schemes such as "javascript:"
-                        if not self.is_safe_uri(value):
+                        if not self._check_uri(value):
                             continue
                     elif attr == 'style':
                         # Remove dangerous CSS declarations from inline styles
-                        decls = self.sanitize_css(value)
-                        if not decls:
+                        value = self._check_css(value)
+                        if not value:
                             continue
-                        value = '; '.join(decls)
                     new_attrs.append((attr, value))
 
                 yield kind, (tag, Attrs(new_attrs)), pos
@@ -326,6 +391,86 @@ class HTMLSanitizer(object):
                 if not waiting_for:
                     yield kind, data, pos
 
+    def sanitize_many(self, documents, workers=None, chunksize=None,
+                      encoding=None):
+        """Parse, sanitize and serialize a batch of HTML documents, using a
+        pool of worker processes.
+        
+        >>> sanitizer = HTMLSanitizer()
+        >>> results = sanitizer.sanitize_many([
+        ...     u'<p onclick="evil()">Hello</p>',
+        ...     u'<div class="a""b">',
+        ...     u'<a href="javascript:void">Click</a>'
+        ... ], workers=1)
+        >>> print(results[0])
+        <p>Hello</p>
+        >>> results[1].__class__.__name__
+        'ParseError'
+        >>> print(results[2])
+        <a>Click</a>
+        
+        The results are returned in the order of the input documents, as
+        `Markup` objects serialized using the HTML method. Errors are isolated
+        per document: if a document can not be processed, the exception is
+        returned in its place, and the remaining documents are still processed.
+        
+        The sanitizer is pickled to the worker processes, so subclasses must be
+        defined at the top level of an importable module. If `workers` is 1, or
+        the ``multiprocessing`` module is not available, the documents are
+        processed in the current process.
+        
+        :param documents: an iterable of HTML documents as strings
+        :param workers: the number of worker processes, defaults to the number
+                        of CPUs
+        :param chunksize: the number of documents sent to a worker at a time
+        :param encoding: the encoding of documents given as byte strings
+        :return: a list of `Markup` or exception objects
+        :rtype: `list`
+        :note: Added in 0.7
+        """
+        if multiprocessing is None or workers == 1:
+            return [_sanitize_document(self, text, encoding)
+                    for text in documents]
+        pool = multiprocessing.Pool(workers, _init_worker, (self, encoding))
+        try:
+            return pool.map(_sanitize_in_worker, documents, chunksize)
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def clear_cache(self):
+        """Discard the memoized results of the URI and CSS checks.
+        
+        :note: Added in 0.7
+        """
+        self._uri_cache = LRUCache(self.cache_size)
+        self._css_cache = LRUCache(self.cache_size)
+
+    def _check_uri(self, uri):
+        return self._memoize(self._uri_cache, self.is_safe_uri, uri)
+
+    def _check_css(self, text):
+        def _sanitize(text):
+            return '; '.join(self.sanitize_css(text))
+        return self._memoize(self._css_cache, _sanitize, text)
+
+    def _memoize(self, cache, func, value):
+        self._lock.acquire()
+        try:
+            try:
+                return cache[value]
+            except KeyError:
+                pass
+        finally:
+            self._lock.release()
+        retval = func(value)
+        self._lock.acquire()
+        try:
+            cache[value] = retval
+        finally:
+            self._lock.release()
+        return retval
+
     def is_safe_css(self, propname, value):
         """Determine whether the given css property declaration is to be
         considered safe for inclusion in the output.
@@ -432,7 +577,7 @@ class HTMLSanitizer(object):
             is_evil = False
             if 'expression' in value:
                 is_evil = True
-            for match in re.finditer(r'url\s*\(([^)]+)', value):
+            for match in self._CSS_URLS(value):
                 if not self.is_safe_uri(match.group(1)):
                     is_evil = True
                     break
@@ -440,6 +585,7 @@ class HTMLSanitizer(object):
                 decls.append(decl.strip())
         return decls
 
+    _CSS_URLS = re.compile(r'url\s*\(([^)]+)').finditer
     _NORMALIZE_NEWLINES = re.compile(r'\r\n').sub
     _UNICODE_ESCAPE = re.compile(r'\\([0-9a-fA-F]{1,6})\s?').sub
 
@@ -452,3 +598,21 @@ class HTMLSanitizer(object):
 
     def _strip_css_comments(self, text):
         return self._CSS_COMMENTS('', text)
+
+
+def _sanitize_document(sanitizer, text, encoding):
+    try:
+        stream = HTML(text, encoding=encoding) | sanitizer
+        return Markup(stream.render('html', encoding=None))
+    except Exception, e:
+        return e
+
+_worker_state = None
+
+def _init_worker(sanitizer, encoding):
+    global _worker_state
+    _worker_state = sanitizer, encoding
+
+def _sanitize_in_worker(text):
+    sanitizer, encoding = _worker_state
+    return _sanitize_document(sanitizer, text, encoding)
@@ -23,19 +23,31 @@ try:
 except NameError:
     from genshi.util import any
 from gettext import NullTranslations
+try:
+    from hashlib import sha1
+except ImportError:
+    from sha import new as sha1
+from itertools import chain
 import os
 import re
 from types import FunctionType
+from weakref import WeakKeyDictionary
 
 from genshi.core import Attrs, Namespace, QName, START, END, TEXT, \
                         XML_NAMESPACE, _ensure, StreamEventKind
 from genshi.template.eval import _ast
-from genshi.template.base import DirectiveFactory, EXPR, SUB, _apply_directives
+from genshi.template.base import Context, DirectiveFactory, EXPR, SUB, \
+                                 _apply_directives
 from genshi.template.directives import Directive, StripDirective
 from genshi.template.markup import MarkupTemplate, EXEC
-from genshi.compat import IS_PYTHON2
+from genshi.compat import IS_PYTHON2, BytesIO
+
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
 
-__all__ = ['Translator', 'extract']
+__all__ = ['Translator', 'extract', 'extract_files']
 __docformat__ = 'restructuredtext en'
 
 
@@ -588,6 +600,11 @@ class Translator(DirectiveFactory):
     Note that elements defining ``xml:lang`` attributes that do not contain
     variable expressions are ignored by this filter. That can be used to
     exclude specific parts of a template from being extracted and translated.
+    
+    If the translations are provided as a ``NullTranslations`` or
+    ``GNUTranslations`` object, the translated text nodes and attribute values
+    are cached per translations object and domain. If the catalog of such an
+    object is changed after it has been used, `clear_cache()` should be called.
     """
 
     directives = [
@@ -609,7 +626,8 @@ class Translator(DirectiveFactory):
     NAMESPACE = I18N_NAMESPACE
 
     def __init__(self, translate=NullTranslations(), ignore_tags=IGNORE_TAGS,
-                 include_attrs=INCLUDE_ATTRS, extract_text=True):
+                 include_attrs=INCLUDE_ATTRS, extract_text=True,
+                 cache_size=5000):
         """Initialize the translator.
         
         :param translate: the translation function, for example ``gettext`` or
@@ -619,15 +637,30 @@ class Translator(DirectiveFactory):
         :param extract_text: whether the content of text nodes should be
                              extracted, or only text in explicit ``gettext``
                              function calls
+        :param cache_size: the maximum number of translated strings to cache
+                           per translations object and domain, or 0 to
+                           disable the cache
         
         :note: Changed in 0.6: the `translate` parameter can now be either
                a ``gettext``-style function, or an object compatible with the
                ``NullTransalations`` or ``GNUTranslations`` interface
+        :note: Changed in 0.7: added the `cache_size` parameter
         """
         self.translate = translate
         self.ignore_tags = ignore_tags
         self.include_attrs = include_attrs
         self.extract_text = extract_text
+        self.cache_size = cache_size
+        self.clear_cache()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_caches'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__ = state
+        self.clear_cache()
 
     def __call__(self, stream, ctxt=None, translate_text=True,
                  translate_attrs=True):
@@ -655,37 +688,24 @@ class Translator(DirectiveFactory):
             translate_text = False
             translate_attrs = False
 
-        if type(self.translate) is FunctionType:
-            gettext = self.translate
-            if ctxt:
-                ctxt['_i18n.gettext'] = gettext
-        else:
-            if IS_PYTHON2:
-                gettext = self.translate.ugettext
-                ngettext = self.translate.ungettext
-            else:
-                gettext = self.translate.gettext
-                ngettext = self.translate.ngettext
-            try:
-                if IS_PYTHON2:
-                    dgettext = self.translate.dugettext
-                    dngettext = self.translate.dungettext
-                else:
-                    dgettext = self.translate.dgettext
-                    dngettext = self.translate.dngettext
-            except AttributeError:
-                dgettext = lambda _, y: gettext(y)
-                dngettext = lambda _, s, p, n: ngettext(s, p, n)
-            if ctxt:
-                ctxt['_i18n.gettext'] = gettext
-                ctxt['_i18n.ngettext'] = ngettext
-                ctxt['_i18n.dgettext'] = dgettext
-                ctxt['_i18n.dngettext'] = dngettext
+        functions = self._get_functions()
+        if ctxt:
+            ctxt.update(functions)
+        gettext = functions['_i18n.gettext']
+        dgettext = functions.get('_i18n.dgettext')
 
+        domain = None
         if ctxt and ctxt.get('_i18n.domain'):
             # TODO: This can cause infinite recursion if dgettext is defined
             #       via the AttributeError case above!
-            gettext = lambda msg: dgettext(ctxt.get('_i18n.domain'), msg)
+            domain = ctxt.get('_i18n.domain')
+            gettext = lambda msg: dgettext(domain, msg)
+
+        text_cache = attr_cache = None
+        cache = self._get_cache(domain)
+        if cache is not None:
+            text_cache, attr_cache = cache
+            cache_size = self.cache_size
 
         for kind, data, pos in stream:
 
@@ -714,7 +734,16 @@ class Translator(DirectiveFactory):
                     newval = value
                     if isinstance(value, basestring):
                         if translate_attrs and name in include_attrs:
-                            newval = gettext(value)
+                            if attr_cache is None:
+                                newval = gettext(value)
+                            else:
+                                try:
+                                    newval = attr_cache[value]
+                                except KeyError:
+                                    newval = gettext(value)
+                                    if len(attr_cache) >= cache_size:
+                                        attr_cache.clear()
+                                    attr_cache[value] = newval
                     else:
                         newval = list(
                             self(_ensure(value), ctxt, translate_text=False)
@@ -729,9 +758,21 @@ class Translator(DirectiveFactory):
                 yield kind, (tag, attrs), pos
 
             elif translate_text and kind is TEXT:
-                text = data.strip()
-                if text:
-                    data = data.replace(text, unicode(gettext(text)))
+                if text_cache is not None and type(data) is unicode:
+                    try:
+                        data = text_cache[data]
+                    except KeyError:
+                        key = data
+                        text = data.strip()
+                        if text:
+                            data = data.replace(text, unicode(gettext(text)))
+                        if len(text_cache) >= cache_size:
+                            text_cache.clear()
+                        text_cache[key] = data
+                else:
+                    text = data.strip()
+                    if text:
+                        data = data.replace(text, unicode(gettext(text)))
                 yield kind, data, pos
 
             elif kind is SUB:
@@ -898,6 +939,36 @@ class Translator(DirectiveFactory):
                 if in_comment:
                     comment_stack.pop()
 
+    def _get_functions(self):
+        # Return the translation functions, as they are stored in the context
+        if type(self.translate) is FunctionType:
+            return {'_i18n.gettext': self.translate}
+        if IS_PYTHON2:
+            gettext = self.translate.ugettext
+            ngettext = self.translate.ungettext
+        else:
+            gettext = self.translate.gettext
+            ngettext = self.translate.ngettext
+        try:
+            if IS_PYTHON2:
+                dgettext = self.translate.dugettext
+                dngettext = self.translate.dungettext
+            else:
+                dgettext = self.translate.dgettext
+                dngettext = self.translate.dngettext
+        except AttributeError:
+            dgettext = lambda _, y: gettext(y)
+            dngettext = lambda _, s, p, n: ngettext(s, p, n)
+        return {'_i18n.gettext': gettext, '_i18n.ngettext': ngettext,
+                '_i18n.dgettext': dgettext, '_i18n.dngettext': dngettext}
+
+    def clear_cache(self):
+        """Discard all cached translations.
+        
+        :note: Added in 0.7
+        """
+        self._caches = WeakKeyDictionary()
+
     def get_directive_index(self, dir_cls):
         total = len(self._dir_order)
         if dir_cls in self._dir_order:
@@ -908,12 +979,37 @@ class Translator(DirectiveFactory):
         """Convenience function to register the `Translator` filter and the
         related directives with the given template.
         
+        When registered this way, and the translations are provided as a
+        ``NullTranslations`` compatible object, the static text and attribute
+        values of the template are translated only once per translations
+        object and domain. Rendering the template then only involves the
+        translation of dynamic content, such as ``i18n:msg`` directives with
+        parameters and ``gettext`` calls in expressions.
+        
         :param template: a `Template` instance
+        :note: Changed in 0.7: templates are translated once per translations
+               object and domain
         """
-        template.filters.insert(0, self)
+        template.filters.insert(0, _TemplateTranslator(self, template))
         if hasattr(template, 'add_directives'):
             template.add_directives(Translator.NAMESPACE, self)
 
+    def _get_cache(self, domain):
+        # Only translations objects are cached, as the result of a plain
+        # function may depend on anything (such as the locale of the request)
+        translate = self.translate
+        if not self.cache_size or not isinstance(translate, NullTranslations):
+            return None
+        try:
+            caches = self._caches[translate]
+        except KeyError:
+            caches = self._caches[translate] = {}
+        try:
+            return caches[domain]
+        except KeyError:
+            cache = caches[domain] = ({}, {})
+            return cache
+
     def _extract_attrs(self, event, gettext_functions, search_text):
         for name, value in event[1][1]:
             if search_text and isinstance(value, basestring):
@@ -927,6 +1023,56 @@ class Translator(DirectiveFactory):
                     yield message
 
 
+class _TemplateTranslator(object):
+    """Template filter registered by `Translator.setup()`, which keeps the
+    translated stream of the template per translations object and domain.
+    """
+
+    def __init__(self, translator, template):
+        self.translator = translator
+        self.template = template
+        self._source = self._streams = None
+
+    def __call__(self, stream, ctxt=None, **vars):
+        translator = self.translator
+        if ctxt is None or translator._get_cache(None) is None or \
+                self.template.filters[0] is not self:
+            return translator(stream, ctxt)
+
+        # The translated stream can only be used in place of the unfiltered
+        # template stream, and not for example for the fallback content of
+        # an include, which is passed through the same filters
+        stream = iter(stream)
+        template_stream = self.template.stream
+        try:
+            first = stream.next()
+        except StopIteration:
+            return translator(stream, ctxt)
+        stream = chain([first], stream)
+        if not template_stream or first is not template_stream[0]:
+            return translator(stream, ctxt)
+
+        domain = ctxt.get('_i18n.domain')
+        if self._source is not translator._caches:
+            # The cache of the translator has been cleared
+            self._source = translator._caches
+            self._streams = WeakKeyDictionary()
+        try:
+            streams = self._streams[translator.translate]
+        except KeyError:
+            streams = self._streams[translator.translate] = {}
+        try:
+            translated = streams[domain]
+        except KeyError:
+            tctxt = Context()
+            if domain:
+                tctxt['_i18n.domain'] = domain
+            translated = streams[domain] = list(translator(stream, tctxt))
+
+        ctxt.update(translator._get_functions())
+        return iter(translated)
+
+
 class MessageBuffer(object):
     """Helper class for managing internationalized mixed content.
     
@@ -1015,7 +1161,7 @@ class MessageBuffer(object):
         """
         return ''.join(self.string).strip()
 
-    def translate(self, string, regex=re.compile(r'%\((\w+)\)s')):
+    def translate(self, string):
         """Interpolate the given message translation with the events in the
         buffer and return the translated stream.
         
@@ -1023,28 +1169,24 @@ class MessageBuffer(object):
         """
         substream = None
 
-        def yield_parts(string):
-            for idx, part in enumerate(regex.split(string)):
-                if idx % 2:
-                    yield self.values[part]
-                elif part:
-                    yield (TEXT,
-                           part.replace('\[', '[').replace('\]', ']'),
-                           (None, -1, -1)
-                    )
-
-        parts = parse_msg(string)
-        parts_counter = {}
-        for order, string in parts:
-            parts_counter.setdefault(order, []).append(None)
+        def yield_parts(pieces):
+            for is_param, piece in pieces:
+                if is_param:
+                    yield self.values[piece]
+                else:
+                    yield TEXT, piece, (None, -1, -1)
+
+        parts, counts = _compile_msg(string)
+        parts = list(parts)
+        parts_counter = dict(counts)
 
         while parts:
             order, string = parts.pop(0)
-            if len(parts_counter[order]) == 1:
+            if parts_counter[order] == 1:
                 events = self.events[order]
             else:
                 events = [self.events[order].pop(0)]
-            parts_counter[order].pop()
+            parts_counter[order] -= 1
 
             for event in events:
                 if event[0] is SUB_START:
@@ -1151,6 +1293,40 @@ def parse_msg(string, regex=re.compile(r'(?:\[(\d+)\:)|(?<!\\)\]')):
 
     return parts
 
+_msg_cache = {}
+_MSG_CACHE_SIZE = 1000
+
+def _compile_msg(string, regex=re.compile(r'%\((\w+)\)s')):
+    """Return the parsed structure of a translated message string, as used by
+    `MessageBuffer.translate()`.
+    
+    The result is a ``(parts, counts)`` tuple, where `parts` is a tuple of
+    ``(order, pieces)`` tuples as returned by `parse_msg`, with each string
+    further split into ``(is_param, text)`` pieces, and `counts` maps every
+    order number to the number of parts it occurs in. The structure only
+    depends on the message string, so it is kept in a bounded module-level
+    cache, and must not be modified by the caller.
+    """
+    compiled = _msg_cache.get(string)
+    if compiled is None:
+        parts = []
+        counts = {}
+        for order, part in parse_msg(string):
+            pieces = []
+            for idx, piece in enumerate(regex.split(part)):
+                if idx % 2:
+                    pieces.append((True, piece))
+                elif piece:
+                    pieces.append((False, piece.replace('\\[', '[')
+                                               .replace('\\]', ']')))
+            parts.append((order, tuple(pieces)))
+            counts[order] = counts.get(order, 0) + 1
+        compiled = tuple(parts), counts
+        if len(_msg_cache) >= _MSG_CACHE_SIZE:
+            _msg_cache.clear()
+        _msg_cache[string] = compiled
+    return compiled
+
 
 def extract_from_code(code, gettext_functions):
     """Extract strings from Python bytecode.
@@ -1216,6 +1392,10 @@ def extract(fileobj, keywords, comment_tags, options):
     :return: an iterator over ``(lineno, funcname, message, comments)`` tuples
     :rtype: ``iterator``
     """
+    return _extract(fileobj, getattr(fileobj, 'name', None), keywords, options)
+
+
+def _extract(fileobj, filename, keywords, options):
     template_class = options.get('template_class', MarkupTemplate)
     if isinstance(template_class, basestring):
         module, clsname = template_class.split(':', 1)
@@ -1236,8 +1416,7 @@ def extract(fileobj, keywords, comment_tags, options):
         include_attrs = include_attrs.split()
     include_attrs = [QName(attr) for attr in include_attrs]
 
-    tmpl = template_class(fileobj, filename=getattr(fileobj, 'name', None),
-                          encoding=encoding)
+    tmpl = template_class(fileobj, filename=filename, encoding=encoding)
     tmpl.loader = None
 
     translator = Translator(None, ignore_tags, include_attrs, extract_text)
@@ -1245,3 +1424,100 @@ def extract(fileobj, keywords, comment_tags, options):
         tmpl.add_directives(Translator.NAMESPACE, translator)
     for message in translator.extract(tmpl.stream, gettext_functions=keywords):
         yield message
+
+
+def extract_files(filenames, keywords=GETTEXT_FUNCTIONS, comment_tags=(),
+                  options=None, workers=None, chunksize=None, cache=None):
+    """Extract the localizable messages from a batch of template files, using
+    a pool of worker processes.
+    
+    The messages are returned as a single list of
+    ``(filename, lineno, funcname, message, comments)`` tuples, ordered by the
+    position of the file in `filenames` and then by the order in which the
+    messages were found in the file. The result therefore does not depend on
+    the number of workers or on which of them finishes first.
+    
+    If a `cache` is given, it is used to store the messages extracted from
+    each file, keyed by a hash of the file content and of the extraction
+    parameters. Files whose content has not changed since a previous run are
+    then not parsed again. Any mapping with string keys can serve as a cache;
+    to reuse the results across processes, pass a ``shelve`` object.
+    
+    If `workers` is 1, or the ``multiprocessing`` module is not available, the
+    files are processed in the current process. Errors raised while parsing a
+    file are propagated to the caller.
+    
+    :param filenames: the names of the template files
+    :param keywords: a list of keywords (i.e. function names) that should be
+                     recognized as translation functions
+    :param comment_tags: a list of translator tags to search for and include
+                         in the results
+    :param options: a dictionary of additional options, as accepted by the
+                    `extract` function
+    :param workers: the number of worker processes, defaults to the number of
+                    CPUs
+    :param chunksize: the number of files sent to a worker at a time
+    :param cache: a mapping used to store and look up the messages of each
+                  file, or `None` to disable caching
+    :return: a list of ``(filename, lineno, funcname, message, comments)``
+             tuples
+    :rtype: `list`
+    :note: Added in 0.7
+    """
+    if options is None:
+        options = {}
+    params = repr((sorted(keywords), sorted(comment_tags),
+                   sorted(options.items())))
+
+    filenames = list(filenames)
+    results = [None] * len(filenames)
+    keys = [None] * len(filenames)
+    pending = []
+    for idx, filename in enumerate(filenames):
+        fileobj = open(filename, 'rb')
+        try:
+            content = fileobj.read()
+        finally:
+            fileobj.close()
+        if cache is not None:
+            key = keys[idx] = sha1(content + params.encode('utf-8')).hexdigest()
+            if key in cache:
+                results[idx] = cache[key]
+                continue
+        pending.append((idx, filename, content))
+
+    if pending:
+        jobs = [(filename, content) for idx, filename, content in pending]
+        if multiprocessing is None or workers == 1 or len(jobs) == 1:
+            extracted = [list(_extract(BytesIO(content), filename, keywords,
+                                       options))
+                         for filename, content in jobs]
+        else:
+            pool = multiprocessing.Pool(workers, _init_extract_worker,
+                                        (keywords, options))
+            try:
+                extracted = pool.map(_extract_in_worker, jobs, chunksize)
+            finally:
+                pool.terminate()
+                pool.join()
+        for (idx, filename, content), messages in zip(pending, extracted):
+            results[idx] = messages
+            if cache is not None:
+                cache[keys[idx]] = messages
+
+    merged = []
+    for filename, messages in zip(filenames, results):
+        for lineno, funcname, message, comments in messages:
+            merged.append((filename, lineno, funcname, message, comments))
+    return merged
+
+_extract_state = None
+
+def _init_extract_worker(keywords, options):
+    global _extract_state
+    _extract_state = keywords, options
+
+def _extract_in_worker(job):
+    filename, content = job
+    keywords, options = _extract_state
+    return list(_extract(BytesIO(content), filename, keywords, options))
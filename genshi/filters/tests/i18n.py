@@ -14,11 +14,15 @@
 from datetime import datetime
 import doctest
 from gettext import NullTranslations
+import os
+import shutil
+import tempfile
 import unittest
 
 from genshi.core import Attrs
 from genshi.template import MarkupTemplate, Context
-from genshi.filters.i18n import Translator, extract
+from genshi.filters import i18n
+from genshi.filters.i18n import Translator, extract, extract_files
 from genshi.input import HTML
 from genshi.compat import IS_PYTHON2, StringIO
 
@@ -214,6 +218,133 @@ class TranslatorTestCase(unittest.TestCase):
           <p>Voh</p>
         </html>""", tmpl.generate().render())
 
+    def test_translate_cached(self):
+        calls = []
+        class CountingTranslations(DummyTranslations):
+            def ugettext(self, message):
+                calls.append(message)
+                return DummyTranslations.ugettext(self, message)
+            if not IS_PYTHON2:
+                gettext = ugettext
+        tmpl = MarkupTemplate("""<html xmlns:py="http://genshi.edgewall.org/">
+          <p title="Foo">Foo</p>
+          <p title="Foo">  Foo  </p>
+        </html>""")
+        translations = CountingTranslations({'Foo': 'Voh'})
+        translator = Translator(translations)
+        translator.setup(tmpl)
+        for i in range(3):
+            self.assertEqual("""<html>
+          <p title="Voh">Voh</p>
+          <p title="Voh">  Voh  </p>
+        </html>""", tmpl.generate().render())
+        self.assertEqual(['Foo'] * 3, calls)
+
+        # A different translations object gets its own cache
+        translator.translate = CountingTranslations({'Foo': 'Fu'})
+        self.assertEqual("""<html>
+          <p title="Fu">Fu</p>
+          <p title="Fu">  Fu  </p>
+        </html>""", tmpl.generate().render())
+        self.assertEqual(['Foo'] * 6, calls)
+
+        # Clearing the cache picks up changes to the catalog
+        translations._catalog['Foo'] = 'Vu'
+        translator.translate = translations
+        translator.clear_cache()
+        self.assertEqual("""<html>
+          <p title="Vu">Vu</p>
+          <p title="Vu">  Vu  </p>
+        </html>""", tmpl.generate().render())
+
+    def test_translate_cache_is_bounded(self):
+        tmpl = MarkupTemplate("""<html xmlns:py="http://genshi.edgewall.org/">
+          <p>Foo</p><p>Bar</p><p>Baz</p>
+        </html>""")
+        translations = DummyTranslations()
+        translator = Translator(translations, cache_size=2)
+        translator.setup(tmpl)
+        tmpl.generate().render()
+        text_cache, attr_cache = translator._caches[translations][None]
+        self.assert_(len(text_cache) <= 2)
+
+    def test_translate_function_not_cached(self):
+        catalog = {'Foo': 'Voh'}
+        tmpl = MarkupTemplate("""<html xmlns:py="http://genshi.edgewall.org/">
+          <p>Foo</p>
+        </html>""")
+        translator = Translator(lambda s: catalog.get(s, s))
+        translator.setup(tmpl)
+        self.assertEqual("""<html>
+          <p>Voh</p>
+        </html>""", tmpl.generate().render())
+        catalog['Foo'] = 'Fu'
+        self.assertEqual("""<html>
+          <p>Fu</p>
+        </html>""", tmpl.generate().render())
+
+    def test_translate_template_once(self):
+        calls = []
+        class CountingTranslations(DummyTranslations):
+            def ugettext(self, message):
+                calls.append(message)
+                return DummyTranslations.ugettext(self, message)
+            if not IS_PYTHON2:
+                gettext = ugettext
+        tmpl = MarkupTemplate("""<html xmlns:py="http://genshi.edgewall.org/"
+            xmlns:i18n="http://genshi.edgewall.org/i18n">
+          <p title="Foo">Foo</p>
+          <p i18n:msg="name">Hello, $name</p>
+        </html>""")
+        translator = Translator(CountingTranslations({
+            'Foo': 'Voh', 'Hello, %(name)s': 'Hallo, %(name)s'
+        }))
+        translator.setup(tmpl)
+        for name in ['Hans', 'Erika']:
+            self.assertEqual("""<html>
+          <p title="Voh">Voh</p>
+          <p>Hallo, %s</p>
+        </html>""" % name, tmpl.generate(name=name).render())
+        # The static text is translated once, the message on every render
+        self.assertEqual(['Foo', 'Foo', 'Hello, %(name)s', 'Hello, %(name)s'],
+                         sorted(calls))
+
+        # Another translations object gets its own translated stream
+        translator.translate = DummyTranslations({'Foo': 'Fu'})
+        self.assertEqual("""<html>
+          <p title="Fu">Fu</p>
+          <p>Hello, Hans</p>
+        </html>""", tmpl.generate(name='Hans').render())
+
+    def test_translate_template_include_fallback(self):
+        import os, shutil, tempfile
+        from genshi.template.loader import TemplateLoader
+        dirname = tempfile.mkdtemp(suffix='genshi_test')
+        try:
+            file1 = open(os.path.join(dirname, 'tmpl1.html'), 'w')
+            try:
+                file1.write("""<html xmlns:xi="http://www.w3.org/2001/XInclude">
+                  <p>Foo</p>
+                  <xi:include href="missing.html"><xi:fallback>
+                    <p>Bar</p>
+                  </xi:fallback></xi:include>
+                </html>""")
+            finally:
+                file1.close()
+
+            def callback(template):
+                translations = DummyTranslations({'Foo': 'Voh', 'Bar': 'Bahr'})
+                Translator(translations).setup(template)
+            loader = TemplateLoader([dirname], callback=callback)
+            tmpl = loader.load('tmpl1.html')
+            for i in range(2):
+                self.assertEqual("""<html>
+                  <p>Voh</p>
+                    <p>Bahr</p>
+                </html>""", tmpl.generate().render())
+        finally:
+            shutil.rmtree(dirname)
+
 
 class MsgDirectiveTestCase(unittest.TestCase):
 
@@ -244,6 +375,25 @@ class MsgDirectiveTestCase(unittest.TestCase):
           <p>Für Details siehe bitte <a href="help.html">Hilfe</a>.</p>
         </html>""".encode('utf-8'), tmpl.generate().render(encoding='utf-8'))
 
+    def test_translate_i18n_msg_parsed_once(self):
+        tmpl = MarkupTemplate("""<html xmlns:py="http://genshi.edgewall.org/"
+            xmlns:i18n="http://genshi.edgewall.org/i18n">
+          <p py:for="name in names" i18n:msg="name">
+            Hello, <em>${name}</em>, see [<a href="help.html">Help</a>].
+          </p>
+        </html>""")
+        translation = u"[2:Hilfe \\[hier\\]] f\xfcr [1:%(name)s]."
+        gettext = lambda s: translation
+        translator = Translator(gettext)
+        translator.setup(tmpl)
+        i18n._msg_cache.clear()
+        for idx in range(2):
+            self.assertEqual(u"""<html>
+          <p><a href="help.html">Hilfe [hier]</a> f\xfcr <em>Joe</em>.</p>\
+<p><a href="help.html">Hilfe [hier]</a> f\xfcr <em>Jane</em>.</p>
+        </html>""", tmpl.generate(names=['Joe', 'Jane']).render(encoding=None))
+        self.assertEqual([translation], list(i18n._msg_cache))
+
     def test_extract_i18n_msg_nonewline(self):
         tmpl = MarkupTemplate("""<html xmlns:py="http://genshi.edgewall.org/"
             xmlns:i18n="http://genshi.edgewall.org/i18n">
@@ -1548,7 +1698,8 @@ class DomainDirectiveTestCase(unittest.TestCase):
         translations.add_domain('foo', {'FooBar': 'BarFoo', 'Bar': 'PT_Foo'})
         translator = Translator(translations)
         translator.setup(tmpl)
-        self.assertEqual("""<html>
+        for i in range(2): # the cached translations are kept per domain
+            self.assertEqual("""<html>
           <p>Voh</p>
           <div>
             <p>BarFoo</p>
@@ -1978,6 +2129,70 @@ class ExtractTestCase(unittest.TestCase):
             (30, None, 'White space changes', []),
             (34, '_', 'Update', [])], messages)
 
+    def _write_templates(self, dirname, contents):
+        filenames = []
+        for idx, content in enumerate(contents):
+            filename = os.path.join(dirname, 'tmpl%d.html' % idx)
+            fileobj = open(filename, 'wb')
+            try:
+                fileobj.write(content.encode('utf-8'))
+            finally:
+                fileobj.close()
+            filenames.append(filename)
+        return filenames
+
+    def _test_extract_files(self, workers):
+        dirname = tempfile.mkdtemp(suffix='genshi_test')
+        try:
+            filenames = self._write_templates(dirname, [
+                '<p>First ${_("one")}</p>',
+                '<html>\n  <p title="Second">two</p>\n</html>',
+                '<p>Third</p>'
+            ])
+            results = extract_files(filenames, workers=workers)
+            self.assertEqual([
+                (filenames[0], 1, None, 'First', []),
+                (filenames[0], 1, '_', 'one', []),
+                (filenames[1], 2, None, 'Second', []),
+                (filenames[1], 2, None, 'two', []),
+                (filenames[2], 1, None, 'Third', []),
+            ], results)
+        finally:
+            shutil.rmtree(dirname)
+
+    def test_extract_files(self):
+        self._test_extract_files(workers=1)
+
+    def test_extract_files_in_pool(self):
+        self._test_extract_files(workers=2)
+
+    def test_extract_files_cached(self):
+        dirname = tempfile.mkdtemp(suffix='genshi_test')
+        try:
+            filenames = self._write_templates(dirname, ['<p>Foo</p>',
+                                                        '<p>Bar</p>'])
+            cache = {}
+            results = extract_files(filenames, workers=1, cache=cache)
+            self.assertEqual(2, len(cache))
+            self.assertEqual([(filenames[0], 1, None, 'Foo', []),
+                              (filenames[1], 1, None, 'Bar', [])], results)
+
+            # Unchanged files are taken from the cache
+            for key in cache:
+                cache[key] = [(1, None, 'Cached', [])]
+            self._write_templates(dirname, ['<p>Foo</p>', '<p>Baz</p>'])
+            results = extract_files(filenames, workers=1, cache=cache)
+            self.assertEqual([(filenames[0], 1, None, 'Cached', []),
+                              (filenames[1], 1, None, 'Baz', [])], results)
+            self.assertEqual(3, len(cache))
+
+            # Different options do not share cache entries
+            results = extract_files(filenames, workers=1, cache=cache,
+                                    options={'extract_text': False})
+            self.assertEqual([], results)
+        finally:
+            shutil.rmtree(dirname)
+
 
 def suite():
     suite = unittest.TestSuite()
@@ -12,8 +12,10 @@
 # history and logs, available at http://genshi.edgewall.org/log/.
 
 import doctest
+import pickle
 import unittest
 
+from genshi.core import Markup
 from genshi.input import HTML, ParseError
 from genshi.filters.html import HTMLFormFiller, HTMLSanitizer
 from genshi.template import MarkupTemplate
@@ -360,6 +362,63 @@ class HTMLFormFillerTestCase(unittest.TestCase):
           <input type="password" name="pass" value="1234"/>
         </p></form>""", html.render())
 
+    def test_fill_form_by_name(self):
+        html = HTML(u"""<form name="a"><input type="text" name="foo" /></form>
+        <form name="b"><input type="text" name="foo" /></form>""") \
+            | HTMLFormFiller(name='b', data={'foo': 'bar'})
+        self.assertEquals("""<form name="a"><input type="text" name="foo"/></form>
+        <form name="b"><input type="text" name="foo" value="bar"/></form>""",
+            html.render())
+
+    def test_fill_form_by_id(self):
+        html = HTML(u"""<form id="a"><input type="text" name="foo" /></form>
+        <form id="b"><input type="text" name="foo" /></form>""") \
+            | HTMLFormFiller(id='a', data={'foo': 'bar'})
+        self.assertEquals("""<form id="a"><input type="text" name="foo" value="bar"/></form>
+        <form id="b"><input type="text" name="foo"/></form>""",
+            html.render())
+
+    def test_fill_stops_after_targeted_form(self):
+        html = HTML(u"""<form name="a"><input type="text" name="foo" /></form>
+        <form name="a"><input type="text" name="foo" /></form>""") \
+            | HTMLFormFiller(name='a', data={'foo': 'bar'})
+        self.assertEquals("""<form name="a"><input type="text" name="foo" value="bar"/></form>
+        <form name="a"><input type="text" name="foo"/></form>""",
+            html.render())
+
+    def test_fill_all_forms_without_target(self):
+        html = HTML(u"""<form><input type="text" name="foo" /></form>
+        <form><input type="text" name="foo" /></form>""") \
+            | HTMLFormFiller(data={'foo': 'bar'})
+        self.assertEquals("""<form><input type="text" name="foo" value="bar"/></form>
+        <form><input type="text" name="foo" value="bar"/></form>""",
+            html.render())
+
+    def test_fill_outside_form_unchanged(self):
+        html = HTML(u"""<p><input type="text" name="foo" /></p>
+        <form><input type="text" name="foo" /></form>""") \
+            | HTMLFormFiller(data={'foo': 'bar'})
+        self.assertEquals("""<p><input type="text" name="foo"/></p>
+        <form><input type="text" name="foo" value="bar"/></form>""",
+            html.render())
+
+    def test_fill_non_string_values(self):
+        html = HTML(u"""<form>
+          <input type="checkbox" name="num" value="1" />
+          <input type="checkbox" name="num" value="2" />
+          <select name="sel"><option value="3">3</option>
+          <option>4</option></select>
+          <input type="text" name="empty" />
+        </form>""") | HTMLFormFiller(data={'num': [1, 3], 'sel': 4,
+                                            'empty': []})
+        self.assertEquals("""<form>
+          <input type="checkbox" name="num" value="1" checked="checked"/>
+          <input type="checkbox" name="num" value="2"/>
+          <select name="sel"><option value="3">3</option>
+          <option selected="selected">4</option></select>
+          <input type="text" name="empty"/>
+        </form>""", html.render())
+
 
 class HTMLSanitizerTestCase(unittest.TestCase):
 
@@ -500,6 +559,86 @@ class HTMLSanitizerTestCase(unittest.TestCase):
         html = HTML(u'<IMG SRC=\'jav&#x09;ascript:alert("foo");\'>')
         self.assertEquals('<img/>', (html | HTMLSanitizer()).render())
 
+    def test_sanitize_memoizes_uri_checks(self):
+        calls = []
+        class CountingSanitizer(HTMLSanitizer):
+            def is_safe_uri(self, uri):
+                calls.append(uri)
+                return HTMLSanitizer.is_safe_uri(self, uri)
+        sanitizer = CountingSanitizer()
+        html = HTML(u'<a href="/foo">1</a><a href="/foo">2</a>'
+                    u'<a href="javascript:x()">3</a>'
+                    u'<a href="javascript:x()">4</a>')
+        self.assertEquals('<a href="/foo">1</a><a href="/foo">2</a>'
+                          '<a>3</a><a>4</a>', (html | sanitizer).render())
+        self.assertEquals([u'/foo', u'javascript:x()'], calls)
+
+    def test_sanitize_memoizes_css(self):
+        calls = []
+        class CountingSanitizer(HTMLSanitizer):
+            def sanitize_css(self, text):
+                calls.append(text)
+                return HTMLSanitizer.sanitize_css(self, text)
+        sanitizer = CountingSanitizer(safe_attrs=HTMLSanitizer.SAFE_ATTRS |
+                                      set(['style']))
+        html = HTML(u'<p style="color: red; position: fixed">1</p>'
+                    u'<p style="color: red; position: fixed">2</p>'
+                    u'<p style="position: fixed">3</p>'
+                    u'<p style="position: fixed">4</p>')
+        self.assertEquals('<p style="color: red">1</p>'
+                          '<p style="color: red">2</p><p>3</p><p>4</p>',
+                          (html | sanitizer).render())
+        self.assertEquals(2, len(calls))
+
+    def test_sanitize_cache_is_bounded(self):
+        sanitizer = HTMLSanitizer(cache_size=2)
+        html = HTML(u''.join(['<a href="/%d">%d</a>' % (i, i)
+                              for i in range(10)]))
+        (html | sanitizer).render()
+        self.assertEquals(2, len(sanitizer._uri_cache))
+        sanitizer.clear_cache()
+        self.assertEquals(0, len(sanitizer._uri_cache))
+
+    def test_sanitize_cache_disabled(self):
+        sanitizer = HTMLSanitizer(cache_size=0)
+        html = HTML(u'<a href="/foo">1</a><a href="javascript:x()">2</a>')
+        self.assertEquals('<a href="/foo">1</a><a>2</a>',
+                          (html | sanitizer).render())
+        self.assertEquals(0, len(sanitizer._uri_cache))
+
+    def test_sanitize_pickle(self):
+        sanitizer = HTMLSanitizer(safe_schemes=frozenset(['https']))
+        html = HTML(u'<a href="http://example.org/">1</a>')
+        self.assertEquals('<a>1</a>', (html | sanitizer).render())
+        sanitizer = pickle.loads(pickle.dumps(sanitizer, 2))
+        self.assertEquals(frozenset(['https']), sanitizer.safe_schemes)
+        self.assertEquals(0, len(sanitizer._uri_cache))
+        self.assertEquals('<a>1</a>', (html | sanitizer).render())
+
+    def _test_sanitize_many(self, workers):
+        sanitizer = HTMLSanitizer(safe_schemes=frozenset(['https']))
+        documents = [u'<a href="https://example.org/">%d</a>'
+                     u'<a href="http://example.org/">x</a>' % i
+                     for i in range(20)]
+        documents.insert(5, u'<div class="a""b">')
+        documents.insert(10, 'caf\xc3\xa9<br>')
+        results = sanitizer.sanitize_many(documents, workers=workers,
+                                          chunksize=3, encoding='utf-8')
+        self.assertEquals(22, len(results))
+        self.assert_(isinstance(results[5], ParseError))
+        self.assertEquals(Markup(u'caf\xe9<br>'), results[10])
+        del results[10], results[5]
+        for i, result in enumerate(results):
+            self.assert_(isinstance(result, Markup))
+            self.assertEquals('<a href="https://example.org/">%d</a><a>x</a>'
+                              % i, result)
+
+    def test_sanitize_many(self):
+        self._test_sanitize_many(workers=1)
+
+    def test_sanitize_many_pool(self):
+        self._test_sanitize_many(workers=2)
+
 
 def suite():
     suite = unittest.TestSuite()
@@ -13,13 +13,16 @@
 
 import doctest
 from pprint import pprint
+from StringIO import StringIO
 import unittest
 
 from genshi import HTML
 from genshi.builder import Element
 from genshi.core import START, END, TEXT, QName, Attrs
 from genshi.filters.transform import Transformer, StreamBuffer, ENTER, EXIT, \
-                                     OUTSIDE, INSIDE, ATTR, BREAK
+                                     OUTSIDE, INSIDE, ATTR, BREAK, \
+                                     EventTransformation, \
+                                     FusedTransformation, RenameTransformation
 import genshi.filters.transform
 
 
@@ -1479,6 +1482,167 @@ class CutTest(unittest.TestCase, BufferTestMixin):
 #            )
 
 
+class StreamBufferTest(unittest.TestCase):
+    """Test the StreamBuffer storage modes"""
+
+    def _events(self, count):
+        return [(TEXT, u'%d' % i, (None, 1, i)) for i in range(count)]
+
+    def test_spill(self):
+        buffer = StreamBuffer(spill=3)
+        events = self._events(10)
+        for event in events:
+            buffer.append(event)
+        self.assertEqual(3, len(buffer.events))
+        self.assertEqual(2, len(buffer._batches))
+        self.assertEqual(events, list(buffer))
+        # Can be replayed more than once
+        self.assertEqual(events, list(buffer))
+        self.assertEqual(events[4:], list(buffer._replay(4)))
+        self.assertEqual(events[7:], list(buffer._replay(7)))
+
+    def test_spill_reset(self):
+        buffer = StreamBuffer(spill=2)
+        for event in self._events(5):
+            buffer.append(event)
+        fileobj = buffer._file
+        buffer.reset()
+        self.assertEqual(None, buffer._file)
+        self.assert_(fileobj.closed)
+        self.assertEqual([], list(buffer))
+
+    def test_consume(self):
+        buffer = StreamBuffer(consume=True)
+        events = self._events(4)
+        for event in events:
+            buffer.append(event)
+        replay = iter(buffer)
+        self.assertEqual(events[0], replay.next())
+        self.assertEqual([None, events[1], events[2], events[3]],
+                         buffer.events)
+        self.assertEqual(events[1:], list(replay))
+        self.assertEqual([], list(buffer))
+
+    def test_consume_spill(self):
+        buffer = StreamBuffer(consume=True, spill=2)
+        events = self._events(7)
+        for event in events:
+            buffer.append(event)
+        self.assertEqual(events, list(buffer))
+        self.assertEqual(None, buffer._file)
+        self.assertEqual([], list(buffer))
+
+    def test_copy_spill(self):
+        html = HTML(FOOBAR, encoding='utf-8')
+        buffer = StreamBuffer(spill=2)
+        xform = Transformer('foo').copy(buffer).end().select('bar') \
+                                  .append(buffer)
+        self.assertEqual(
+            '<root>ROOT<foo name="foo" size="100">FOO</foo><bar name="bar">'
+            'BAR<foo name="foo" size="100">FOO</foo></bar></root>',
+            html.filter(xform).render())
+
+    def test_copy_accumulate_spill(self):
+        html = HTML(FOOBAR, encoding='utf-8')
+        buffer = StreamBuffer(spill=1)
+        xform = Transformer('*/text()').copy(buffer, accumulate=True)
+        self.assertEqual(FOOBAR, html.filter(xform).render())
+        self.assertEqual([u'FOO', u'BAR'], [data for _, data, _ in buffer])
+
+    def test_buffer_spill(self):
+        html = HTML(u'<doc><notes/><body>%s</body></doc>' %
+                    u''.join([u'<note>%d</note>' % i for i in range(50)]))
+        buffer = StreamBuffer(consume=True, spill=10)
+        xform = Transformer('body/note').cut(buffer, accumulate=True).end() \
+                                        .buffer(spill=10).select('notes') \
+                                        .prepend(buffer)
+        self.assertEqual(
+            u'<doc><notes>%s</notes><body/></doc>' %
+            u''.join([u'<note>%d</note>' % i for i in range(50)]),
+            html.filter(xform).render(encoding=None))
+
+
+class PlanTest(unittest.TestCase):
+    """Test the fusion of event transformations"""
+
+    def test_fuse_consecutive(self):
+        xform = Transformer('foo').attr('a', '1').rename('bar').end() \
+                                  .select('bar').remove()
+        plan = xform._get_plan()
+        self.assertEqual(4, len(plan))
+        self.assert_(isinstance(plan[1], FusedTransformation))
+        self.assertEqual(xform.transforms[1:4], list(plan[1].transforms))
+        self.assert_(plan[2] is xform.transforms[4])
+        self.assert_(plan[3] is xform.transforms[5])
+        self.assertEqual(
+            '<root>ROOT</root>',
+            HTML(FOO, encoding='utf-8').filter(xform).render())
+
+    def test_fused_result(self):
+        xform = Transformer('foo').attr('a', '1').rename('bar') \
+                                  .map(unicode.lower, TEXT).invert() \
+                                  .substitute('R', 'r').unwrap()
+        self.assertEqual(
+            '<root>rOOT<bar name="foo" a="1">foo</bar></root>',
+            HTML(FOO, encoding='utf-8').filter(xform).render())
+
+    def test_plan_cached(self):
+        xform = Transformer('foo').attr('a', '1').rename('bar')
+        self.assert_(xform._get_plan() is xform._get_plan())
+
+    def test_plan_rebuilt_after_change(self):
+        xform = Transformer('foo').attr('a', '1')
+        plan = xform._get_plan()
+        xform.transforms.append(xform.transforms[-1].__class__('b', '2'))
+        self.assert_(plan is not xform._get_plan())
+        self.assertEqual(
+            '<root>ROOT<foo name="foo" a="1" b="2">FOO</foo></root>',
+            HTML(FOO, encoding='utf-8').filter(xform).render())
+
+    def test_overridden_call_not_fused(self):
+        calls = []
+        class Counting(RenameTransformation):
+            def __call__(self, stream):
+                calls.append(True)
+                return RenameTransformation.__call__(self, stream)
+        xform = Transformer('foo').apply(Counting('bar')).attr('a', '1')
+        plan = xform._get_plan()
+        self.assertEqual(3, len(plan))
+        self.assertEqual(
+            '<root>ROOT<bar name="foo" a="1">FOO</bar></root>',
+            HTML(FOO, encoding='utf-8').filter(xform).render())
+        self.assertEqual([True], calls)
+
+    def test_trace_before_remove(self):
+        out = StringIO()
+        xform = Transformer('foo').trace(fileobj=out).remove()
+        self.assertEqual(
+            '<root>y</root>',
+            HTML(u'<root><foo>x</foo>y</root>').filter(xform).render())
+        self.assertEqual([
+            "(None, ('START', (QName('root'), Attrs()), (None, 1, 0)))",
+            "('ENTER', ('START', (QName('foo'), Attrs()), (None, 1, 6)))",
+            "('INSIDE', ('TEXT', u'x', (None, 1, 11)))",
+            "('EXIT', ('END', QName('foo'), (None, 1, 12)))",
+            "(None, ('TEXT', u'y', (None, 1, 18)))",
+            "(None, ('END', QName('root'), (None, 1, 19)))"
+        ], out.getvalue().splitlines())
+
+    def test_function_gets_input_mark(self):
+        marks = []
+        class Recording(EventTransformation):
+            def route(self, mark):
+                def _record(mark, event):
+                    marks.append(mark)
+                    return event
+                if mark is ENTER:
+                    return OUTSIDE, _record
+                return mark, None
+        xform = Transformer('foo').apply(Recording())
+        HTML(FOO, encoding='utf-8').filter(xform).render()
+        xform.attr('a', '1')
+        HTML(FOO, encoding='utf-8').filter(xform).render()
+        self.assertEqual([ENTER, ENTER], marks)
 
 
 def suite():
@@ -1489,7 +1653,8 @@ def suite():
     for test in (SelectTest, InvertTest, EndTest,
                  EmptyTest, RemoveTest, UnwrapText, WrapTest, FilterTest,
                  MapTest, SubstituteTest, RenameTest, ReplaceTest, BeforeTest,
-                 AfterTest, PrependTest, AppendTest, AttrTest, CopyTest, CutTest):
+                 AfterTest, PrependTest, AppendTest, AttrTest, CopyTest, CutTest,
+                 StreamBufferTest, PlanTest):
         suite.addTest(unittest.makeSuite(test, 'test'))
     suite.addTest(doctest.DocTestSuite(
         genshi.filters.transform, optionflags=doctest.NORMALIZE_WHITESPACE,
@@ -48,11 +48,18 @@ box, but custom transformations can be added easily.
 :since: version 0.5
 """
 
+from itertools import izip
 import re
 import sys
+import tempfile
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
 
 from genshi.builder import Element
 from genshi.core import Stream, Attrs, QName, TEXT, START, END, _ensure, Markup
+from genshi.output import _record_buffer
 from genshi.path import Path
 
 __all__ = ['Transformer', 'StreamBuffer', 'InjectorTransformation', 'ENTER',
@@ -177,7 +184,7 @@ class Transformer(object):
     class="emphasis">body</em> text.</body></html>
     """
 
-    __slots__ = ['transforms']
+    __slots__ = ['transforms', '_plan']
 
     def __init__(self, path='.'):
         """Construct a new transformation filter.
@@ -185,6 +192,7 @@ class Transformer(object):
         :param path: an XPath expression (as string) or a `Path` instance
         """
         self.transforms = [SelectTransformation(path)]
+        self._plan = None
 
     def __call__(self, stream, keep_marks=False):
         """Apply the transform filter to the marked stream.
@@ -196,7 +204,7 @@ class Transformer(object):
         :rtype: `Stream`
         """
         transforms = self._mark(stream)
-        for link in self.transforms:
+        for link in self._get_plan():
             transforms = link(transforms)
         if not keep_marks:
             transforms = self._unmark(transforms)
@@ -579,7 +587,7 @@ class Transformer(object):
         """
         return self.apply(CutTransformation(buffer, accumulate))
 
-    def buffer(self):
+    def buffer(self, spill=None):
         """Buffer the entire stream (can consume a considerable amount of
         memory).
 
@@ -600,8 +608,29 @@ class Transformer(object):
         <doc><notes><note>one</note><note>two</note></notes><body>Some  text
         .</body></doc>
 
+        To keep the memory use bounded for large documents, the buffered stream
+        can be spilled to a temporary file once a number of events have been
+        buffered:
+
+        >>> buffer = StreamBuffer(consume=True, spill=100)
+        >>> print(doc | Transformer('body/note').cut(buffer, accumulate=True)
+        ...     .end().buffer(spill=100).select('notes').prepend(buffer))
+        <doc><notes><note>one</note><note>two</note></notes><body>Some  text
+        .</body></doc>
+
+        :param spill: the maximum number of events to keep in memory, or `None`
+                      to keep the entire stream in memory
+        :rtype: `Transformer`
+        :note: Changed in 0.7: added the `spill` parameter
         """
-        return self.apply(list)
+        if spill is None:
+            return self.apply(list)
+        def _buffer(stream):
+            buffer = StreamBuffer(consume=True, spill=spill)
+            for item in stream:
+                buffer.append(item)
+            return buffer
+        return self.apply(_buffer)
 
     #{ Miscellaneous operations
 
@@ -698,6 +727,28 @@ class Transformer(object):
 
     # Internal methods
 
+    def _get_plan(self):
+        # Consecutive event transformations are fused into a single pass over
+        # the stream; the plan is rebuilt only if the list of transformations
+        # has been changed since it was last used
+        transforms = tuple(self.transforms)
+        if self._plan is None or self._plan[0] != transforms:
+            plan = []
+            group = []
+            for link in transforms + (None,):
+                if _is_event_transformation(link):
+                    group.append(link)
+                    continue
+                if len(group) > 1:
+                    plan.append(FusedTransformation(group))
+                elif group:
+                    plan.append(group[0])
+                group = []
+                if link is not None:
+                    plan.append(link)
+            self._plan = transforms, plan
+        return self._plan[1]
+
     def _mark(self, stream):
         for event in stream:
             yield OUTSIDE, event
@@ -709,6 +760,123 @@ class Transformer(object):
                 yield event
 
 
+class EventTransformation(object):
+    """Abstract base class for transformations that handle every marked event
+    on its own, and produce at most one marked event for it.
+
+    Sub-classes implement the `route()` method instead of `__call__()`, which
+    lets `Transformer` fuse consecutive transformations of this kind into a
+    single pass over the stream.
+
+    >>> class Upper(EventTransformation):
+    ...     def route(self, mark):
+    ...         def _upper(mark, event):
+    ...             kind, data, pos = event
+    ...             if kind is TEXT:
+    ...                 data = data.upper()
+    ...             return kind, data, pos
+    ...         if mark:
+    ...             return mark, _upper
+    ...         return mark, None
+    >>> html = HTML('<body>Some <em>test</em> text</body>', encoding='utf-8')
+    >>> print(html | Transformer('.//em').apply(Upper()).attr('class', 'x'))
+    <body>Some <em class="x">TEST</em> text</body>
+    """
+
+    def __call__(self, stream):
+        """Apply the transform filter to the marked stream.
+
+        :param stream: the marked event stream to filter
+        """
+        routes = {}
+        for inmark, event in stream:
+            try:
+                route = routes[inmark]
+            except KeyError:
+                route = routes[inmark] = self.route(inmark)
+            if route is not None:
+                mark, function = route
+                if function is not None:
+                    event = function(inmark, event)
+                yield mark, event
+
+    def route(self, mark):
+        """Determine how events with the given mark are transformed.
+
+        The result only depends on the mark, and is computed once for every
+        mark encountered in the stream.
+
+        :param mark: the mark of the events
+        :return: `None` if the events should be removed from the stream,
+                 otherwise a ``(mark, function)`` tuple of the new mark and
+                 a function that accepts the original mark and the event and
+                 returns the transformed event, or `None` if the events are
+                 left unchanged
+        """
+        raise NotImplementedError
+
+
+def _is_event_transformation(link):
+    # Only transformations that have not overridden `__call__()` can be fused
+    if not isinstance(link, EventTransformation):
+        return False
+    call = type(link).__call__
+    return getattr(call, 'im_func', call) is \
+        getattr(EventTransformation.__call__, 'im_func',
+                EventTransformation.__call__)
+
+
+class FusedTransformation(object):
+    """Apply a sequence of event transformations in a single pass."""
+
+    def __init__(self, transforms):
+        """Create the fused transformation.
+
+        :param transforms: the sequence of `EventTransformation` objects
+        """
+        self.transforms = tuple(transforms)
+
+    def __call__(self, stream):
+        """Apply the transform filter to the marked stream.
+
+        :param stream: the marked event stream to filter
+        """
+        routes = {}
+        for item in stream:
+            mark = item[0]
+            try:
+                route = routes[mark]
+            except KeyError:
+                route = routes[mark] = self._route(mark)
+            if route is not None:
+                keep, mark, functions = route
+                if functions:
+                    event = item[1]
+                    for inmark, function in functions:
+                        event = function(inmark, event)
+                    if keep:
+                        yield mark, event
+                elif mark is item[0]:
+                    yield item
+                else:
+                    yield mark, item[1]
+
+    def _route(self, mark):
+        functions = []
+        for link in self.transforms:
+            route = link.route(mark)
+            if route is None:
+                # The event is removed, but the functions of the preceding
+                # transformations are still applied to it for their effects
+                if functions:
+                    return False, None, functions
+                return None
+            if route[1] is not None:
+                functions.append((mark, route[1]))
+            mark = route[0]
+        return True, mark, functions
+
+
 class SelectTransformation(object):
     """Select and mark events that match an XPath expression."""
 
@@ -769,35 +937,24 @@ class SelectTransformation(object):
                 yield None, event
 
 
-class InvertTransformation(object):
+class InvertTransformation(EventTransformation):
     """Invert selection so that marked events become unmarked, and vice versa.
 
     Specificaly, all input marks are converted to null marks, and all input
     null marks are converted to OUTSIDE marks.
     """
 
-    def __call__(self, stream):
-        """Apply the transform filter to the marked stream.
-
-        :param stream: the marked event stream to filter
-        """
-        for mark, event in stream:
-            if mark:
-                yield None, event
-            else:
-                yield OUTSIDE, event
+    def route(self, mark):
+        if mark:
+            return None, None
+        return OUTSIDE, None
 
 
-class EndTransformation(object):
+class EndTransformation(EventTransformation):
     """End the current selection."""
 
-    def __call__(self, stream):
-        """Apply the transform filter to the marked stream.
-
-        :param stream: the marked event stream to filter
-        """
-        for mark, event in stream:
-            yield OUTSIDE, event
+    def route(self, mark):
+        return OUTSIDE, None
 
 
 class EmptyTransformation(object):
@@ -817,30 +974,20 @@ class EmptyTransformation(object):
                         break
 
 
-class RemoveTransformation(object):
+class RemoveTransformation(EventTransformation):
     """Remove selection from the stream."""
 
-    def __call__(self, stream):
-        """Apply the transform filter to the marked stream.
-
-        :param stream: the marked event stream to filter
-        """
-        for mark, event in stream:
-            if mark is None:
-                yield mark, event
+    def route(self, mark):
+        if mark is None:
+            return mark, None
 
 
-class UnwrapTransformation(object):
+class UnwrapTransformation(EventTransformation):
     """Remove outtermost enclosing elements from selection."""
 
-    def __call__(self, stream):
-        """Apply the transform filter to the marked stream.
-
-        :param stream: the marked event stream to filter
-        """
-        for mark, event in stream:
-            if mark not in (ENTER, EXIT):
-                yield mark, event
+    def route(self, mark):
+        if mark not in (ENTER, EXIT):
+            return mark, None
 
 
 class WrapTransformation(object):
@@ -878,7 +1025,7 @@ class WrapTransformation(object):
                 yield mark, event
 
 
-class TraceTransformation(object):
+class TraceTransformation(EventTransformation):
     """Print events as they pass through the transform."""
 
     def __init__(self, prefix='', fileobj=None):
@@ -890,14 +1037,11 @@ class TraceTransformation(object):
         self.prefix = prefix
         self.fileobj = fileobj or sys.stdout
 
-    def __call__(self, stream):
-        """Apply the transform filter to the marked stream.
-
-        :param stream: the marked event stream to filter
-        """
-        for event in stream:
-            self.fileobj.write('%s%s\n' % (self.prefix, event))
-            yield event
+    def route(self, mark):
+        def _trace(mark, event):
+            self.fileobj.write('%s%s\n' % (self.prefix, (mark, event)))
+            return event
+        return mark, _trace
 
 
 class FilterTransformation(object):
@@ -951,7 +1095,7 @@ class FilterTransformation(object):
             yield queue_event
 
 
-class MapTransformation(object):
+class MapTransformation(EventTransformation):
     """Apply a function to the `data` element of events of ``kind`` in the
     selection.
     """
@@ -966,19 +1110,18 @@ class MapTransformation(object):
         self.function = function
         self.kind = kind
 
-    def __call__(self, stream):
-        """Apply the transform filter to the marked stream.
+    def route(self, mark):
+        def _map(mark, event):
+            kind, data, pos = event
+            if self.kind in (None, kind):
+                return kind, self.function(data), pos
+            return event
+        if mark:
+            return mark, _map
+        return mark, None
 
-        :param stream: The marked event stream to filter
-        """
-        for mark, (kind, data, pos) in stream:
-            if mark and self.kind in (None, kind):
-                yield mark, (kind, self.function(data), pos)
-            else:
-                yield mark, (kind, data, pos)
 
-
-class SubstituteTransformation(object):
+class SubstituteTransformation(EventTransformation):
     """Replace text matching a regular expression.
 
     Refer to the documentation for ``re.sub()`` for details.
@@ -997,22 +1140,21 @@ class SubstituteTransformation(object):
         self.count = count
         self.replace = replace
 
-    def __call__(self, stream):
-        """Apply the transform filter to the marked stream.
-
-        :param stream: The marked event stream to filter
-        """
-        for mark, (kind, data, pos) in stream:
-            if mark is not None and kind is TEXT:
-                new_data = self.pattern.sub(self.replace, data, self.count)
-                if isinstance(data, Markup):
-                    data = Markup(new_data)
-                else:
-                    data = new_data
-            yield mark, (kind, data, pos)
-
-
-class RenameTransformation(object):
+    def route(self, mark):
+        def _substitute(mark, event):
+            kind, data, pos = event
+            if kind is not TEXT:
+                return event
+            new_data = self.pattern.sub(self.replace, data, self.count)
+            if isinstance(data, Markup):
+                new_data = Markup(new_data)
+            return kind, new_data, pos
+        if mark is not None:
+            return mark, _substitute
+        return mark, None
+
+
+class RenameTransformation(EventTransformation):
     """Rename matching elements."""
     def __init__(self, name):
         """Create the transform.
@@ -1021,17 +1163,17 @@ class RenameTransformation(object):
         """
         self.name = QName(name)
 
-    def __call__(self, stream):
-        """Apply the transform filter to the marked stream.
-
-        :param stream: The marked event stream to filter
-        """
-        for mark, (kind, data, pos) in stream:
-            if mark is ENTER:
-                data = self.name, data[1]
-            elif mark is EXIT:
-                data = self.name
-            yield mark, (kind, data, pos)
+    def route(self, mark):
+        def _rename_start(mark, event):
+            kind, data, pos = event
+            return kind, (self.name, data[1]), pos
+        def _rename_end(mark, event):
+            return event[0], self.name, event[2]
+        if mark is ENTER:
+            return mark, _rename_start
+        elif mark is EXIT:
+            return mark, _rename_end
+        return mark, None
 
 
 class InjectorTransformation(object):
@@ -1174,7 +1316,7 @@ class AppendTransformation(InjectorTransformation):
                 yield mark, event
 
 
-class AttrTransformation(object):
+class AttrTransformation(EventTransformation):
     """Set an attribute on selected elements."""
 
     def __init__(self, name, value):
@@ -1186,44 +1328,124 @@ class AttrTransformation(object):
         self.name = name
         self.value = value
 
-    def __call__(self, stream):
-        """Apply the transform filter to the marked stream.
-
-        :param stream: The marked event stream to filter
-        """
-        callable_value = hasattr(self.value, '__call__')
-        for mark, (kind, data, pos) in stream:
-            if mark is ENTER:
-                if callable_value:
-                    value = self.value(self.name, (kind, data, pos))
-                else:
-                    value = self.value
-                if value is None:
-                    attrs = data[1] - [QName(self.name)]
-                else:
-                    attrs = data[1] | [(QName(self.name), value)]
-                data = (data[0], attrs)
-            yield mark, (kind, data, pos)
+    def route(self, mark):
+        def _attr(mark, event):
+            kind, data, pos = event
+            if hasattr(self.value, '__call__'):
+                value = self.value(self.name, event)
+            else:
+                value = self.value
+            if value is None:
+                attrs = data[1] - [QName(self.name)]
+            else:
+                attrs = data[1] | [(QName(self.name), value)]
+            return kind, (data[0], attrs), pos
+        if mark is ENTER:
+            return mark, _attr
+        return mark, None
 
 
 
 class StreamBuffer(Stream):
-    """Stream event buffer used for cut and copy transformations."""
+    """Stream event buffer used for cut and copy transformations.
+
+    By default, the buffer keeps all events in memory, and can be replayed any
+    number of times. For large selections, the buffer can instead be created
+    so that its events are released as they are replayed, and so that only a
+    limited number of events are kept in memory, with the rest written to a
+    temporary file:
 
-    def __init__(self):
-        """Create the buffer."""
+    >>> buffer = StreamBuffer(consume=True, spill=2)
+    >>> html = HTML('<doc><note>one <b>two</b></note><body/></doc>',
+    ...             encoding='utf-8')
+    >>> print(html | Transformer('note').cut(buffer).end().select('body')
+    ...     .append(buffer))
+    <doc><body><note>one <b>two</b></note></body></doc>
+    >>> print(buffer)
+    <BLANKLINE>
+    """
+
+    def __init__(self, consume=False, spill=None):
+        """Create the buffer.
+
+        :param consume: whether events are removed from the buffer as it is
+                        iterated over, so that it can only be replayed once;
+                        such a buffer must not be replayed before the
+                        selection it is filled from has been passed
+        :param spill: the maximum number of events to keep in memory; further
+                      events are written to a temporary file in batches of
+                      this size
+        :note: Changed in 0.7: added the `consume` and `spill` parameters
+        """
         Stream.__init__(self, [])
+        self.consume = consume
+        self.spill = spill
+        self._file = None
+        self.reset()
+
+    def __iter__(self):
+        _record_buffer('transform', self._count())
+        if self.spill is None and not self.consume:
+            return iter(self.events)
+        return self._replay(0, self.consume)
 
     def append(self, event):
         """Add an event to the buffer.
 
         :param event: the markup event to add
         """
-        self.events.append(event)
+        if self.spill is None or len(self.events) < self.spill:
+            self.events.append(event)
+        else:
+            self._pending.append(event)
+            if len(self._pending) >= self.spill:
+                self._flush()
 
     def reset(self):
         """Empty the buffer of events."""
+        if self.events or self._file is not None:
+            _record_buffer('transform', self._count())
         del self.events[:]
+        self._pending = []
+        self._batches = []
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _count(self):
+        count = len(self.events) + len(self._pending)
+        for offset, size in self._batches:
+            count += size
+        return count
+
+    def _flush(self):
+        if self._file is None:
+            self._file = tempfile.TemporaryFile()
+        self._file.seek(0, 2)
+        self._batches.append((self._file.tell(), len(self._pending)))
+        pickle.dump(self._pending, self._file, pickle.HIGHEST_PROTOCOL)
+        self._pending = []
+
+    def _replay(self, start=0, consume=False):
+        events = self.events
+        for idx in range(start, len(events)):
+            event = events[idx]
+            if consume:
+                events[idx] = None
+            yield event
+        start = max(0, start - len(events))
+        for offset, size in self._batches:
+            if start >= size:
+                start -= size
+                continue
+            self._file.seek(offset)
+            for event in pickle.load(self._file)[start:]:
+                yield event
+            start = 0
+        for event in self._pending[start:]:
+            yield event
+        if consume:
+            self.reset()
 
 
 class CopyTransformation(object):
@@ -1251,19 +1473,22 @@ class CopyTransformation(object):
             if mark:
                 if not self.accumulate:
                     self.buffer.reset()
-                events = [(mark, event)]
+                # Only the marks are kept here, the events of the selection
+                # are replayed from the buffer once it is complete
+                offset = self.buffer._count()
+                marks = [mark]
                 self.buffer.append(event)
                 start = mark
                 for mark, event in stream:
                     if start is not ENTER and mark != start:
                         stream.push((mark, event))
                         break
-                    events.append((mark, event))
+                    marks.append(mark)
                     self.buffer.append(event)
                     if start is ENTER and mark is EXIT:
                         break
-                for i in events:
-                    yield i
+                for item in izip(marks, self.buffer._replay(offset)):
+                    yield item
             else:
                 yield mark, event
 
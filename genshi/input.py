@@ -15,18 +15,27 @@
 sources.
 """
 
+import codecs
 from itertools import chain
 import htmlentitydefs as entities
-import HTMLParser as html
+import mmap
+import os
+import re
 from xml.parsers import expat
 
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
+
 from genshi.core import Attrs, QName, Stream, stripentities
 from genshi.core import START, END, XML_DECL, DOCTYPE, TEXT, START_NS, \
                         END_NS, START_CDATA, END_CDATA, PI, COMMENT
 from genshi.compat import StringIO, BytesIO
 
 
-__all__ = ['ET', 'ParseError', 'XMLParser', 'XML', 'HTMLParser', 'HTML']
+__all__ = ['ET', 'ParseError', 'XMLParser', 'XML', 'HTMLParser', 'HTML',
+           'LXMLParser']
 __docformat__ = 'restructuredtext en'
 
 
@@ -93,7 +102,10 @@ class XMLParser(object):
                    entities.name2codepoint.items()]
     _external_dtd = u'\n'.join(_entitydefs).encode('utf-8')
 
-    def __init__(self, source, filename=None, encoding=None):
+    bufsize = 4 * 1024 #: default number of bytes fed to Expat at a time
+    mmap_bufsize = 64 * 1024 #: default feed size for memory-mapped files
+
+    def __init__(self, source, filename=None, encoding=None, bufsize=None):
         """Initialize the parser for the given XML input.
         
         :param source: the XML text as a file-like object
@@ -102,9 +114,17 @@ class XMLParser(object):
                          encoding is assumed to be ASCII, UTF-8, or UTF-16, or
                          whatever the encoding specified in the XML declaration
                          (if any)
+        :param bufsize: the number of bytes to read from the source and feed to
+                        the parser at a time; this also bounds the number of
+                        events that are buffered between two reads
+        
+        :note: Changed in 0.7: added the `bufsize` argument
         """
         self.source = source
         self.filename = filename
+        if bufsize is not None:
+            self.bufsize = bufsize
+        self._close_source = False
 
         # Setup the Expat parser
         parser = expat.ParserCreate(encoding, '}')
@@ -136,6 +156,42 @@ class XMLParser(object):
         self.expat = parser
         self._queue = []
 
+    @classmethod
+    def fromfile(cls, filename, encoding=None, bufsize=None):
+        """Create a parser that reads the XML document from a memory-mapped
+        file.
+        
+        The file is fed to the parser directly from the memory map in chunks of
+        `bufsize` bytes, and the events produced by every chunk are passed on
+        before the next chunk is parsed. As long as the returned stream is
+        consumed lazily (for example by applying `Stream.select()` to it), the
+        memory used for parsing stays constant independent of the size of the
+        document.
+        
+        :param filename: the path to the file
+        :param encoding: the encoding of the file, if not declared by the file
+                         itself
+        :param bufsize: the number of bytes to feed to the parser at a time;
+                        defaults to `mmap_bufsize`
+        :return: the parser
+        :rtype: `XMLParser`
+        :note: Added in 0.7
+        """
+        if bufsize is None:
+            bufsize = cls.mmap_bufsize
+        fileobj = open(filename, 'rb')
+        try:
+            if os.fstat(fileobj.fileno()).st_size:
+                source = mmap.mmap(fileobj.fileno(), 0,
+                                   access=mmap.ACCESS_READ)
+            else: # empty files can not be mapped
+                source = BytesIO()
+        finally:
+            fileobj.close()
+        parser = cls(source, filename, encoding, bufsize=bufsize)
+        parser._close_source = True
+        return parser
+
     def parse(self):
         """Generator that parses the XML source, yielding markup events.
         
@@ -144,7 +200,7 @@ class XMLParser(object):
         """
         def _generate():
             try:
-                bufsize = 4 * 1024 # 4K
+                bufsize = self.bufsize
                 done = False
                 while 1:
                     while not done and len(self._queue) == 0:
@@ -164,13 +220,80 @@ class XMLParser(object):
                     if done:
                         break
             except expat.ExpatError, e:
+                self._release()
                 msg = str(e)
                 raise ParseError(msg, self.filename, e.lineno, e.offset)
+            except:
+                # Also release the source if parsing is aborted
+                self._release()
+                raise
+            self._release()
         return Stream(_generate()).filter(_coalesce)
 
+    def _release(self):
+        # Close the source if it was opened by the parser itself
+        if self._close_source:
+            self._close_source = False
+            self.source.close()
+
     def __iter__(self):
         return iter(self.parse())
 
+    def feed(self, data):
+        """Push a chunk of XML text to the parser, and return the events that
+        are complete so far.
+        
+        This provides an alternative to the `parse()` method for input that is
+        not available as a file-like object, such as data arriving on a socket:
+        
+        >>> parser = XMLParser(None)
+        >>> for kind, data, pos in parser.feed('<root id="2"><child>F'):
+        ...     print('%s %s' % (kind, data))
+        START (QName('root'), Attrs([(QName('id'), u'2')]))
+        START (QName('child'), Attrs())
+        >>> for kind, data, pos in parser.feed('oo</child>'):
+        ...     print('%s %s' % (kind, data))
+        TEXT Foo
+        END child
+        >>> for kind, data, pos in parser.feed('</root>') + parser.close():
+        ...     print('%s %s' % (kind, data))
+        END root
+        
+        Text at the end of a chunk is held back until the next chunk shows
+        whether it continues, so that adjacent text is always reported as a
+        single `TEXT` event, just like with `parse()`.
+        
+        :param data: the chunk of XML text, as a byte or unicode string
+        :return: the list of markup events that are ready
+        :rtype: `list`
+        :raises ParseError: if the XML text is not well formed
+        :note: Added in 0.7
+        """
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        try:
+            self.expat.Parse(data, False)
+        except expat.ExpatError, e:
+            raise ParseError(str(e), self.filename, e.lineno, e.offset)
+        return _ready(self)
+
+    def close(self):
+        """Signal the end of the XML text pushed to the parser using `feed()`,
+        and return any remaining events.
+        
+        :return: the list of remaining markup events
+        :rtype: `list`
+        :raises ParseError: if the XML text is not well formed
+        :note: Added in 0.7
+        """
+        try:
+            if hasattr(self, 'expat'):
+                self.expat.Parse('', True)
+                del self.expat # get rid of circular references
+        except expat.ExpatError, e:
+            raise ParseError(str(e), self.filename, e.lineno, e.offset)
+        return _ready(self, final=True)
+
     def _build_foreign(self, context, base, sysid, pubid):
         parser = self.expat.ExternalEntityParserCreate(context)
         parser.ParseFile(BytesIO(self._external_dtd))
@@ -253,7 +376,7 @@ class XMLParser(object):
                 raise error
 
 
-def XML(text):
+def XML(text, parser_class=None):
     """Parse the given XML source and return a markup stream.
     
     Unlike with `XMLParser`, the returned stream is reusable, meaning it can be
@@ -268,14 +391,19 @@ def XML(text):
     FooBar
     
     :param text: the XML source
+    :param parser_class: the parser class to use, for example `LXMLParser`;
+                         defaults to `XMLParser`
     :return: the parsed XML event stream
     :raises ParseError: if the XML text is not well-formed
+    :note: Changed in 0.7: added the `parser_class` argument
     """
-    return Stream(list(XMLParser(StringIO(text))))
+    if parser_class is None:
+        parser_class = XMLParser
+    return Stream(list(parser_class(StringIO(text))))
 
 
-class HTMLParser(html.HTMLParser, object):
-    """Parser for HTML input based on the Python `HTMLParser` module.
+class HTMLParser(object):
+    """Parser for HTML input.
     
     This class provides the same interface for generating stream events as
     `XMLParser`, and attempts to automatically balance tags.
@@ -290,11 +418,36 @@ class HTMLParser(html.HTMLParser, object):
     TEXT Foo
     END li
     END ul
+    
+    :note: Changed in 0.7: the parser no longer derives from the Python
+           `HTMLParser` class, but uses its own tokenizer that produces
+           coalesced text events directly
     """
 
     _EMPTY_ELEMS = frozenset(['area', 'base', 'basefont', 'br', 'col', 'frame',
                               'hr', 'img', 'input', 'isindex', 'link', 'meta',
                               'param'])
+    _CDATA_ELEMS = frozenset(['script', 'style'])
+
+    _NO_ATTRS = Attrs()
+
+    _TEXT_RE = re.compile(r'[^<&]+')
+    _ATTR = r'''([a-zA-Z_][-.:a-zA-Z_0-9]*)(\s*=\s*('[^']*'|"[^"]*"|[^\s"'=<>`]*))?'''
+    # common case of a complete, well-formed start tag; every attribute must be
+    # preceded by whitespace so that the expression never backtracks badly
+    _FAST_STARTTAG_RE = re.compile(r'<([a-zA-Z][-.a-zA-Z0-9:_]*)((?:\s+%s)*)'
+                                   r'\s*(/?)>' % _ATTR.replace('(', '(?:'))
+    _STARTTAG_RE = re.compile(r'<([a-zA-Z][-.a-zA-Z0-9:_]*)')
+    _STARTTAG_END_RE = re.compile(r'''(?:"[^"]*"|'[^']*'|[^'">])*>''')
+    _ATTR_RE = re.compile(r'\s*' + _ATTR)
+    _ATTRS_END_RE = re.compile(r'\s*(/?)\s*>')
+    _ENDTAG_RE = re.compile(r'</\s*([a-zA-Z][-.a-zA-Z0-9:_]*)?[^>]*>')
+    _COMMENT_RE = re.compile(r'<!--(.*?)--\s*>', re.DOTALL)
+    _DECL_RE = re.compile(r'<!(?:\[CDATA\[.*?\]\]|[^>]*)>', re.DOTALL)
+    _PI_RE = re.compile(r'<\?(.*?)>', re.DOTALL)
+    _CHARREF_RE = re.compile(r'&#(?:([0-9]+)|[xX]([0-9a-fA-F]+))(;?)')
+    _CHARREF_START_RE = re.compile(r'&#[xX]?\Z')
+    _ENTITYREF_RE = re.compile(r'&([a-zA-Z][-.a-zA-Z0-9]*)(;?)')
 
     def __init__(self, source, filename=None, encoding=None):
         """Initialize the parser for the given HTML input.
@@ -303,12 +456,20 @@ class HTMLParser(html.HTMLParser, object):
         :param filename: the name of the file, if known
         :param filename: encoding of the file; ignored if the input is unicode
         """
-        html.HTMLParser.__init__(self)
         self.source = source
         self.filename = filename
         self.encoding = encoding
+        self._decoder = None
+        self._rawdata = u''
+        self._lineno = 1 # line number at index `_scanned` of the raw data
+        self._linestart = 0 # index of the beginning of that line
+        self._scanned = 0
+        self._cdata_end = None # end tag regex while in script/style content
+        self._textbuf = []
+        self._textpos = None
         self._queue = []
         self._open_tags = []
+        self._qnames = {}
 
     def parse(self):
         """Generator that parses the HTML source, yielding markup events.
@@ -317,102 +478,334 @@ class HTMLParser(html.HTMLParser, object):
         :raises ParseError: if the HTML text is not well formed
         """
         def _generate():
-            try:
-                bufsize = 4 * 1024 # 4K
-                done = False
-                while 1:
-                    while not done and len(self._queue) == 0:
-                        data = self.source.read(bufsize)
-                        if not data: # end of data
-                            self.close()
-                            done = True
-                        else:
-                            if not isinstance(data, unicode):
-                                # bytes
-                                if self.encoding:
-                                    data = data.decode(self.encoding)
-                                else:
-                                    raise UnicodeError("source returned bytes, but no encoding specified")
-                            self.feed(data)
-                    for kind, data, pos in self._queue:
-                        yield kind, data, pos
-                    self._queue = []
-                    if done:
-                        open_tags = self._open_tags
-                        open_tags.reverse()
-                        for tag in open_tags:
-                            yield END, QName(tag), pos
-                        break
-            except html.HTMLParseError, e:
-                msg = '%s: line %d, column %d' % (e.msg, e.lineno, e.offset)
-                raise ParseError(msg, self.filename, e.lineno, e.offset)
-        return Stream(_generate()).filter(_coalesce)
+            bufsize = 4 * 1024 # 4K
+            while 1:
+                data = self.source.read(bufsize)
+                if not data: # end of data
+                    for event in self.close():
+                        yield event
+                    break
+                for event in self.feed(data):
+                    yield event
+        return Stream(_generate())
 
     def __iter__(self):
         return iter(self.parse())
 
-    def _enqueue(self, kind, data, pos=None):
-        if pos is None:
-            pos = self._getpos()
-        self._queue.append((kind, data, pos))
+    def feed(self, data):
+        """Push a chunk of HTML text to the parser, and return the events that
+        are complete so far.
+        
+        This provides an alternative to the `parse()` method for input that is
+        not available as a file-like object. Combined with a generator, it can
+        be used to filter and serialize HTML while it is being received:
+        
+        >>> def receive(chunks):
+        ...     parser = HTMLParser(None, encoding='utf-8')
+        ...     for chunk in chunks:
+        ...         for event in parser.feed(chunk):
+        ...             yield event
+        ...     for event in parser.close():
+        ...         yield event
+        >>> from genshi.filters import HTMLSanitizer
+        >>> stream = Stream(receive(['<p onclick="alert(1)">Hel', 'lo<ul>',
+        ...                          '<li>Foo</ul>'])) | HTMLSanitizer()
+        >>> print(stream)
+        <p>Hello<ul><li>Foo</li></ul></p>
+        
+        Any elements still open when `close()` is called are closed
+        implicitly.
+        
+        :param data: the chunk of HTML text; byte strings are decoded using
+                     the encoding passed to the constructor
+        :return: the list of markup events that are ready
+        :rtype: `list`
+        :raises ParseError: if the HTML text is not well formed
+        :note: Added in 0.7
+        """
+        self._rawdata += _decode(self, data)
+        self._tokenize()
+        queue = self._queue
+        self._queue = []
+        return queue
 
-    def _getpos(self):
-        lineno, column = self.getpos()
-        return (self.filename, lineno, column)
-
-    def handle_starttag(self, tag, attrib):
-        fixed_attrib = []
-        for name, value in attrib: # Fixup minimized attributes
-            if value is None:
-                value = unicode(name)
-            elif not isinstance(value, unicode):
-                value = value.decode(self.encoding, 'replace')
-            fixed_attrib.append((QName(name), stripentities(value)))
-
-        self._enqueue(START, (QName(tag), Attrs(fixed_attrib)))
-        if tag in self._EMPTY_ELEMS:
-            self._enqueue(END, QName(tag))
-        else:
-            self._open_tags.append(tag)
+    def close(self):
+        """Signal the end of the HTML text pushed to the parser using `feed()`,
+        and return any remaining events, including the `END` events of any
+        elements that are still open.
+        
+        :return: the list of remaining markup events
+        :rtype: `list`
+        :raises ParseError: if the HTML text is not well formed
+        :note: Added in 0.7
+        """
+        if self._decoder is not None:
+            self._rawdata += self._decoder.decode('', True)
+        self._tokenize(final=True)
+        self._flush()
+        pos = self._getpos(self._rawdata, 0)
+        while self._open_tags:
+            self._queue.append((END, self._open_tags.pop(), pos))
+        queue = self._queue
+        self._queue = []
+        return queue
 
-    def handle_endtag(self, tag):
-        if tag not in self._EMPTY_ELEMS:
-            while self._open_tags:
-                open_tag = self._open_tags.pop()
-                self._enqueue(END, QName(open_tag))
-                if open_tag.lower() == tag.lower():
+    def _tokenize(self, final=False):
+        rawdata = self._rawdata
+        end = len(rawdata)
+        pos = 0
+        textbuf = self._textbuf
+        text_match = self._TEXT_RE.match
+        starttag_match = self._FAST_STARTTAG_RE.match
+        while pos < end:
+            if self._cdata_end is not None:
+                # inside script or style, everything up to the end tag is text
+                match = self._cdata_end.search(rawdata, pos)
+                if match is None:
+                    if not final:
+                        # keep what might be the beginning of the end tag
+                        safe = rawdata.rfind('<', pos)
+                        if safe < 0:
+                            safe = end
+                        if safe > pos:
+                            self._text(rawdata, pos, rawdata[pos:safe])
+                        pos = safe
+                        break
+                    self._text(rawdata, pos, rawdata[pos:end])
+                    pos = end
                     break
+                if match.start() > pos:
+                    self._text(rawdata, pos, rawdata[pos:match.start()])
+                    pos = match.start()
+                self._cdata_end = None
 
-    def handle_data(self, text):
-        if not isinstance(text, unicode):
-            text = text.decode(self.encoding, 'replace')
-        self._enqueue(TEXT, text)
+            char = rawdata[pos]
+            if char == '<':
+                match = starttag_match(rawdata, pos)
+                if match is not None:
+                    tag, attrs, selfclose = match.groups()
+                    if attrs:
+                        attrs = self._ATTR_RE.findall(attrs)
+                    self._starttag(rawdata, pos, tag, attrs, selfclose)
+                    pos = match.end()
+                    continue
+                if pos + 1 == end:
+                    if not final:
+                        break
+                    newpos = -2
+                else:
+                    newpos = self._TOKENS.get(rawdata[pos + 1],
+                                              HTMLParser._parse_starttag)(
+                        self, rawdata, pos)
+            elif char == '&':
+                newpos = self._parse_ref(rawdata, pos, final)
+            else:
+                match = text_match(rawdata, pos)
+                if not textbuf:
+                    self._textpos = self._getpos(rawdata, pos)
+                textbuf.append(match.group())
+                pos = match.end()
+                continue
+
+            if newpos == -1: # incomplete, need more data
+                if not final:
+                    break
+                newpos = -2
+            if newpos == -2: # not markup after all, treat as text
+                self._text(rawdata, pos, char)
+                pos += 1
+            else:
+                pos = newpos
+
+        self._rawdata = rawdata[pos:]
+        self._scanned -= pos
+        self._linestart -= pos
+
+    def _getpos(self, rawdata, pos):
+        # Positions are only ever requested in ascending order, so newlines
+        # are counted incrementally
+        scanned = self._scanned
+        if pos > scanned:
+            newlines = rawdata.count('\n', scanned, pos)
+            if newlines:
+                self._lineno += newlines
+                self._linestart = rawdata.rindex('\n', scanned, pos) + 1
+            self._scanned = pos
+        return (self.filename, self._lineno, pos - self._linestart)
+
+    def _qname(self, name):
+        # Return the lowercased name as a `QName`, caching the result
+        qname = self._qnames.get(name)
+        if qname is None:
+            qname = self._qnames[name] = QName(name.lower())
+        return qname
+
+    def _text(self, rawdata, pos, text):
+        if not self._textbuf:
+            self._textpos = self._getpos(rawdata, pos)
+        self._textbuf.append(text)
 
-    def handle_charref(self, name):
-        if name.lower().startswith('x'):
-            text = unichr(int(name[1:], 16))
+    def _flush(self):
+        if self._textbuf:
+            self._queue.append((TEXT, u''.join(self._textbuf), self._textpos))
+            del self._textbuf[:]
+
+    def _enqueue(self, kind, data, rawdata, pos):
+        self._flush()
+        self._queue.append((kind, data, self._getpos(rawdata, pos)))
+
+    def _error(self, msg, rawdata, pos):
+        self._flush()
+        filename, lineno, offset = self._getpos(rawdata, pos)
+        msg = '%s: line %d, column %d' % (msg, lineno, offset)
+        raise ParseError(msg, filename, lineno, offset)
+
+    def _starttag(self, rawdata, pos, tag, attrs, selfclose):
+        if attrs:
+            fixed_attrs = []
+            for name, rest, value in attrs:
+                if not rest: # minimized attribute
+                    value = name.lower()
+                elif value[:1] in ('"', "'"):
+                    value = value[1:-1]
+                if '&' in value:
+                    value = stripentities(value)
+                fixed_attrs.append((self._qname(name), value))
+            attrs = Attrs(fixed_attrs)
         else:
-            text = unichr(int(name))
-        self._enqueue(TEXT, text)
+            attrs = self._NO_ATTRS
+        tag = self._qname(tag)
 
-    def handle_entityref(self, name):
-        try:
-            text = unichr(entities.name2codepoint[name])
-        except KeyError:
-            text = '&%s;' % name
-        self._enqueue(TEXT, text)
+        if self._textbuf:
+            self._flush()
+        queue = self._queue
+        pos = self._getpos(rawdata, pos)
+        queue.append((START, (tag, attrs), pos))
+        if selfclose or tag in self._EMPTY_ELEMS:
+            queue.append((END, tag, pos))
+        else:
+            self._open_tags.append(tag)
+            if tag in self._CDATA_ELEMS:
+                self._cdata_end = re.compile(r'</%s\s*>' % tag, re.I)
 
-    def handle_pi(self, data):
-        target, data = data.split(None, 1)
-        if data.endswith('?'):
-            data = data[:-1]
-        self._enqueue(PI, (target.strip(), data.strip()))
+    def _parse_starttag(self, rawdata, pos):
+        # Handle the start tags not matched by the regular expression for the
+        # common case: incomplete, malformed, or unusually formatted tags
+        match = self._STARTTAG_RE.match(rawdata, pos)
+        if match is None:
+            return -2
+        if self._STARTTAG_END_RE.match(rawdata, match.end()) is None:
+            return -1
+        tag = match.group(1)
 
-    def handle_comment(self, text):
-        self._enqueue(COMMENT, text)
+        attrs = []
+        attr_match = self._ATTR_RE.match
+        idx = match.end()
+        while 1:
+            match = attr_match(rawdata, idx)
+            if match is None:
+                break
+            attrs.append(match.groups())
+            idx = match.end()
+        match = self._ATTRS_END_RE.match(rawdata, idx)
+        if match is None:
+            self._error('junk characters in start tag: %r'
+                        % rawdata[idx:idx + 20], rawdata, pos)
 
+        self._starttag(rawdata, pos, tag, attrs, match.group(1))
+        return match.end()
+
+    def _parse_endtag(self, rawdata, pos):
+        match = self._ENDTAG_RE.match(rawdata, pos)
+        if match is None:
+            if rawdata.find('>', pos) < 0:
+                return -1
+            return -2
+        tag = match.group(1)
+        if tag and self._open_tags:
+            tag = tag.lower()
+            if tag not in self._EMPTY_ELEMS:
+                self._flush()
+                epos = self._getpos(rawdata, pos)
+                while self._open_tags:
+                    open_tag = self._open_tags.pop()
+                    self._queue.append((END, open_tag, epos))
+                    if open_tag == tag:
+                        break
+        return match.end()
+
+    def _parse_markup_decl(self, rawdata, pos):
+        if rawdata.startswith('<!--', pos):
+            match = self._COMMENT_RE.match(rawdata, pos)
+            if match is None:
+                return -1
+            self._enqueue(COMMENT, match.group(1), rawdata, pos)
+            return match.end()
+        if len(rawdata) - pos < 4 and u'<!--'.startswith(rawdata[pos:]):
+            return -1 # possibly the beginning of a comment
+        match = self._DECL_RE.match(rawdata, pos)
+        if match is None:
+            return -1
+        # doctype and other declarations are ignored
+        return match.end()
+
+    def _parse_pi(self, rawdata, pos):
+        match = self._PI_RE.match(rawdata, pos)
+        if match is None:
+            return -1
+        parts = match.group(1).split(None, 1)
+        if parts:
+            target = parts[0]
+            if len(parts) > 1:
+                data = parts[1]
+            else:
+                data = u''
+            if data.endswith('?'):
+                data = data[:-1]
+            elif target.endswith('?'):
+                target = target[:-1]
+            self._enqueue(PI, (target.strip(), data.strip()), rawdata, pos)
+        return match.end()
 
-def HTML(text, encoding=None):
+    _TOKENS = {'/': _parse_endtag, '!': _parse_markup_decl, '?': _parse_pi}
+
+    def _parse_ref(self, rawdata, pos, final):
+        end = len(rawdata)
+        if rawdata.startswith('&#', pos):
+            match = self._CHARREF_RE.match(rawdata, pos)
+            if match is not None:
+                if match.end() == end and not final:
+                    return -1 # number or semicolon may continue
+                decimal, hexadecimal, _ = match.groups()
+                try:
+                    if decimal:
+                        text = unichr(int(decimal))
+                    else:
+                        text = unichr(int(hexadecimal, 16))
+                except (ValueError, OverflowError):
+                    text = match.group()
+                self._text(rawdata, pos, text)
+                return match.end()
+            if not final and self._CHARREF_START_RE.match(rawdata, pos):
+                return -1
+            return -2
+        match = self._ENTITYREF_RE.match(rawdata, pos)
+        if match is not None:
+            if match.end() == end and not final:
+                return -1 # name or semicolon may continue
+            name = match.group(1)
+            try:
+                text = unichr(entities.name2codepoint[name])
+            except KeyError:
+                text = '&%s;' % name
+            self._text(rawdata, pos, text)
+            return match.end()
+        if pos + 1 == end and not final:
+            return -1
+        return -2
+
+
+def HTML(text, encoding=None, parser_class=None):
     """Parse the given HTML source and return a markup stream.
     
     Unlike with `HTMLParser`, the returned stream is reusable, meaning it can be
@@ -427,13 +820,355 @@ def HTML(text, encoding=None):
     Foo
     
     :param text: the HTML source
+    :param parser_class: the parser class to use; defaults to `HTMLParser`
     :return: the parsed XML event stream
     :raises ParseError: if the HTML text is not well-formed, and error recovery
                         fails
+    :note: Changed in 0.7: added the `parser_class` argument
     """
+    if parser_class is None:
+        parser_class = HTMLParser
     if isinstance(text, unicode):
-        return Stream(list(HTMLParser(StringIO(text), encoding=encoding)))
-    return Stream(list(HTMLParser(BytesIO(text), encoding=encoding)))
+        return Stream(list(parser_class(StringIO(text), encoding=encoding)))
+    return Stream(list(parser_class(BytesIO(text), encoding=encoding)))
+
+
+class LXMLParser(object):
+    """XML parser based on the incremental parser of the `lxml`_ package.
+    
+    .. _`lxml`: http://lxml.de/
+    
+    This class provides the same interface as `XMLParser`, including the
+    push-style `feed()` and `close()` methods, and generates the same markup
+    events, but delegates the actual parsing to ``libxml2`` where possible,
+    which is faster for large documents. It can also be passed to the `XML()`
+    function:
+    
+      XML(text, parser_class=LXMLParser)
+    
+    ``libxml2`` does not report all the details `XMLParser` does, so it is
+    only used for input it parses the same way. Documents that contain CDATA
+    sections, an internal DTD subset, a doctype declaration together with
+    comments or processing instructions before the root element, or that are
+    not in an ASCII compatible encoding are handed over to `XMLParser`. The
+    same goes for input ``libxml2`` rejects, such as HTML entities that are
+    not declared by the document, so that errors are reported the same way.
+    To make that possible, the input is kept in memory until the parser is
+    closed.
+    
+    While ``libxml2`` does the parsing, the positions of events are less
+    precise: only `START`, `COMMENT` and `PI` events provide the line number
+    (for a start tag spanning several lines, the line it ends on), and no
+    event provides the offset within the line.
+    
+    :note: Added in 0.7
+    """
+
+    bufsize = 64 * 1024 #: number of bytes fed to the parser at a time
+
+    _UNSUPPORTED = ('<![CDATA[',)
+    _XML_DECL_RE = re.compile(r'''<\?xml\s+version\s*=\s*(["'])(.*?)\1'''
+                              r'''(?:\s+encoding\s*=\s*(["'])(.*?)\3)?'''
+                              r'''(?:\s+standalone\s*=\s*(["'])(yes|no)\5)?'''
+                              r'''\s*\?>''')
+
+    def __init__(self, source, filename=None, encoding=None, bufsize=None):
+        """Initialize the parser for the given XML input.
+        
+        :param source: the XML text as a file-like object
+        :param filename: the name of the file, if appropriate
+        :param encoding: the encoding of the file, if not declared by the
+                         file itself
+        :param bufsize: the number of bytes to read from the source and feed to
+                        the parser at a time
+        :raises ImportError: if the `lxml` package is not installed
+        """
+        if lxml_etree is None:
+            raise ImportError('%s requires the lxml package' %
+                              type(self).__name__)
+        self.source = source
+        self.filename = filename
+        self.encoding = encoding
+        if bufsize is not None:
+            self.bufsize = bufsize
+        self._parser = lxml_etree.XMLPullParser(events=('start', 'end',
+                                                        'start-ns', 'comment',
+                                                        'pi'),
+                                                encoding=encoding)
+        self._queue = []
+        self._stack = [] # entries are [elem, last_child, text_done, ns]
+        self._prefixes = []
+        self._prolog = [] # comments and PIs before the root element
+        self._started = False
+        self._head = '' # beginning of the input, until the XML declaration
+                        # has been read
+        self._tail = '' # end of the input, may start an unsupported construct
+        self._chunks = [] # the input so far, in case `XMLParser` takes over
+        self._returned = 0 # number of events returned so far
+        self._fallback = None
+        if encoding and u'<?'.encode(encoding) != '<?':
+            self._switch()
+
+    def parse(self):
+        """Generator that parses the XML source, yielding markup events.
+        
+        :return: a markup event stream
+        :raises ParseError: if the XML text is not well formed
+        """
+        def _generate():
+            while 1:
+                data = self.source.read(self.bufsize)
+                if not data: # end of data
+                    for event in self.close():
+                        yield event
+                    break
+                for event in self.feed(data):
+                    yield event
+        return Stream(_generate())
+
+    def __iter__(self):
+        return iter(self.parse())
+
+    def feed(self, data):
+        """Push a chunk of text to the parser, and return the events that are
+        complete so far.
+        
+        :param data: the chunk of text, as a byte or unicode string
+        :return: the list of markup events that are ready
+        :rtype: `list`
+        :raises ParseError: if the text is not well formed
+        :see: `XMLParser.feed`
+        """
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        if self._fallback is not None:
+            return self._skip(self._fallback.feed(data))
+        self._chunks.append(data)
+        if not self._push(data):
+            return self._switch()
+        events = _ready(self)
+        self._returned += len(events)
+        return events
+
+    def close(self):
+        """Signal the end of the text pushed to the parser using `feed()`, and
+        return any remaining events.
+        
+        :return: the list of remaining markup events
+        :rtype: `list`
+        :raises ParseError: if the text is not well formed
+        """
+        if self._fallback is None and self._push(None):
+            self._chunks = None
+            return _ready(self, final=True)
+        events = []
+        if self._fallback is None:
+            events = self._switch()
+        return events + self._skip(self._fallback.close())
+
+    def _switch(self):
+        # Let `XMLParser` parse the input from the beginning, and continue
+        # after the events that have already been returned
+        self._parser = None
+        self._queue = []
+        self._fallback = XMLParser(None, self.filename, self.encoding)
+        data = ''.join(self._chunks)
+        self._chunks = None
+        if not data:
+            return []
+        return self._skip(self._fallback.feed(data))
+
+    def _skip(self, events):
+        if self._returned:
+            skip = min(self._returned, len(events))
+            self._returned -= skip
+            events = events[skip:]
+        return events
+
+    def _push(self, data):
+        # Feed the data to libxml2, returning whether it has been parsed the
+        # same way `XMLParser` would parse it
+        final = data is None
+        if not final:
+            text = self._tail + data
+            for marker in self._UNSUPPORTED:
+                if marker in text:
+                    return False
+            self._tail = text[-8:]
+        if self._head is not None:
+            if not final:
+                self._head += data
+            data = self._read_head(final)
+            if data is False:
+                return False
+            elif data is None:
+                return True
+        try:
+            if data:
+                self._parser.feed(data)
+            if final:
+                self._parser.close()
+        except lxml_etree.XMLSyntaxError:
+            return False
+        return self._translate()
+
+    def _read_head(self, final=False):
+        # Report the XML declaration, which libxml2 does not, and check that
+        # the encoding is compatible with ASCII. Returns the data to feed to
+        # libxml2, `None` if more data is needed, or `False` if the input is
+        # not supported.
+        head = self._head
+        if head.startswith(codecs.BOM_UTF8):
+            head = head[3:]
+        elif not final and codecs.BOM_UTF8.startswith(head):
+            return None
+        if len(head) < 6 and not final:
+            return None
+        if head[:2] in (codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE) or \
+                '\0' in head[:4]:
+            return False
+        if head.startswith('<?xml') and head[5:6].isspace():
+            if '?>' not in head:
+                if not final:
+                    return None
+                return False
+            match = self._XML_DECL_RE.match(head)
+            if match is None:
+                return False
+            version, encoding, standalone = match.group(2, 4, 6)
+            self._queue.append((XML_DECL, (unicode(version),
+                                           encoding and unicode(encoding),
+                                           {'yes': 1, 'no': 0}.get(standalone,
+                                                                   -1)),
+                                (self.filename, 1, 0)))
+        data = self._head
+        self._head = None
+        return data
+
+    def _translate(self):
+        enqueue = self._queue.append
+        stack = self._stack
+        unknown = (self.filename, -1, -1)
+        for action, node in self._parser.read_events():
+            if action == 'start':
+                if not self._started and not self._start_document(node):
+                    return False
+                if stack:
+                    self._child(stack[-1], node)
+                for prefix, uri in self._prefixes:
+                    enqueue((START_NS, (prefix, uri), unknown))
+                tag = QName(node.tag.lstrip('{'))
+                attrs = Attrs([(QName(name.lstrip('{')), unicode(value))
+                               for name, value in node.items()])
+                enqueue((START, (tag, attrs),
+                         (self.filename, node.sourceline or -1, -1)))
+                stack.append([node, None, False, self._prefixes])
+                self._prefixes = []
+            elif action == 'end':
+                entry = stack.pop()
+                self._text(entry)
+                enqueue((END, QName(node.tag.lstrip('{')), unknown))
+                for prefix, uri in reversed(entry[3]):
+                    enqueue((END_NS, prefix, unknown))
+                if entry[1] is not None:
+                    # free the memory used by the children already reported
+                    node.remove(entry[1])
+            elif action == 'start-ns':
+                if stack:
+                    self._text(stack[-1])
+                # reported right before the element, as the document type
+                # is only known at that point for the root element
+                self._prefixes.append((node[0] or '', unicode(node[1])))
+            else: # comment or processing instruction
+                pos = (self.filename, node.sourceline or -1, -1)
+                if action == 'comment':
+                    event = COMMENT, unicode(node.text or ''), pos
+                else:
+                    event = PI, (unicode(node.target),
+                                 unicode(node.text or '')), pos
+                if stack:
+                    self._child(stack[-1], node)
+                    enqueue(event)
+                elif not self._started:
+                    # held back, as the document type is only known once the
+                    # root element starts
+                    self._prolog.append(event)
+                else:
+                    enqueue(event)
+        return True
+
+    def _start_document(self, root):
+        # Report the document type and the comments and processing
+        # instructions preceding the root element
+        self._started = True
+        docinfo = root.getroottree().docinfo
+        if docinfo.internalDTD is not None:
+            return False
+        if docinfo.doctype:
+            if self._prolog:
+                # the order of the doctype and the other events is not known
+                return False
+            self._queue.append((DOCTYPE, (unicode(docinfo.root_name),
+                                          docinfo.public_id and
+                                          unicode(docinfo.public_id),
+                                          docinfo.system_url and
+                                          unicode(docinfo.system_url)),
+                                (self.filename, -1, -1)))
+        self._queue.extend(self._prolog)
+        self._prolog = None
+        return True
+
+    def _child(self, entry, node):
+        self._text(entry)
+        if entry[1] is not None:
+            entry[0].remove(entry[1])
+        entry[1] = node
+        entry[2] = False
+
+    def _text(self, entry):
+        # Emit the text preceding the next child or the end of the element
+        # unless that has been done already
+        if not entry[2]:
+            if entry[1] is None:
+                text = entry[0].text
+            else:
+                text = entry[1].tail
+            if text:
+                self._queue.append((TEXT, unicode(text),
+                                    (self.filename, -1, -1)))
+            entry[2] = True
+
+
+def _decode(parser, data):
+    """Decode a chunk of input for an HTML parser, unless it is already
+    unicode."""
+    if not isinstance(data, unicode):
+        # bytes
+        if parser.encoding:
+            # multi-byte characters may be split between chunks
+            if parser._decoder is None:
+                parser._decoder = codecs.getincrementaldecoder(
+                    parser.encoding)()
+            data = parser._decoder.decode(data)
+        else:
+            raise UnicodeError("source returned bytes, but no encoding specified")
+    return data
+
+
+def _ready(parser, final=False):
+    """Remove the events that are ready from the queue of a push parser, and
+    return them coalesced.
+    
+    Unless `final` is true, trailing text events are left on the queue, as
+    the next chunk of input may continue the text.
+    """
+    queue = parser._queue
+    cut = len(queue)
+    if not final:
+        while cut and queue[cut - 1][0] is TEXT:
+            cut -= 1
+    parser._queue = queue[cut:]
+    return list(_coalesce(queue[:cut]))
 
 
 def _coalesce(stream):
@@ -17,13 +17,19 @@ streams.
 
 from itertools import chain
 import re
+try:
+    import threading
+except ImportError:
+    import dummy_threading as threading
+from time import time
 
 from genshi.core import escape, Attrs, Markup, Namespace, QName, StreamEventKind
 from genshi.core import START, END, TEXT, XML_DECL, DOCTYPE, START_NS, END_NS, \
                         START_CDATA, END_CDATA, PI, COMMENT, XML_NAMESPACE
 
-__all__ = ['encode', 'get_serializer', 'DocType', 'XMLSerializer',
-           'XHTMLSerializer', 'HTMLSerializer', 'TextSerializer']
+__all__ = ['encode', 'get_serializer', 'DocType', 'RenderMetrics',
+           'XMLSerializer', 'XHTMLSerializer', 'HTMLSerializer',
+           'TextSerializer']
 __docformat__ = 'restructuredtext en'
 
 
@@ -79,6 +85,155 @@ def get_serializer(method='xml', **kwargs):
     return method(**kwargs)
 
 
+class RenderMetrics(object):
+    """Statistics about the serialization of a stream, as passed to the
+    ``metrics`` callback of `Stream.render()` and `Stream.serialize()`.
+    
+    >>> from genshi.input import XML
+    >>> stats = []
+    >>> output = XML('<p>Hello, <b>world</b>!</p>').render(metrics=stats.append)
+    >>> metrics = stats[0]
+    >>> sorted(metrics.events.items())
+    [('END', 2), ('START', 2), ('TEXT', 3)]
+    >>> metrics.bytes
+    27
+    
+    :note: Added in 0.7
+    """
+
+    def __init__(self):
+        self.events = {}
+        """A dictionary of the number of events passed to the serializer, keyed
+        by event kind."""
+        self.bytes = 0
+        """The size of the output, in bytes if it was encoded, and in characters
+        otherwise."""
+        self.stream_time = 0.0
+        """The time spent producing the events of the stream, which includes
+        any template processing and stream filters, in seconds."""
+        self.serialize_time = 0.0
+        """The time spent in the serializer (and encoding the output), in
+        seconds."""
+        self.buffer_peaks = {}
+        """A dictionary of the largest number of events that were buffered at
+        a time, keyed by the kind of buffer (``"match"`` for match templates,
+        ``"transform"`` for `Transformer` buffers)."""
+        self.cache_hits = 0
+        """The number of events for which the serializer reused cached
+        output."""
+        self.cache_misses = 0
+        """The number of events for which the serializer looked up cached
+        output in vain."""
+
+    def __repr__(self):
+        return '<%s: %d events, %d bytes>' % (type(self).__name__,
+                                              sum(self.events.values()),
+                                              self.bytes)
+
+    def cache_hit_rate(self):
+        """Return the fraction of cache lookups by the serializer that were
+        successful, or ``None`` if the serializer did not use a cache.
+        
+        :rtype: `float`
+        """
+        lookups = self.cache_hits + self.cache_misses
+        if not lookups:
+            return None
+        return float(self.cache_hits) / lookups
+
+    def buffered(self, kind, size):
+        """Record that the given number of events were buffered.
+        
+        :param kind: the kind of buffer
+        :param size: the number of events in the buffer
+        """
+        if size > self.buffer_peaks.get(kind, 0):
+            self.buffer_peaks[kind] = size
+
+
+_local = threading.local()
+_collecting = False # whether metrics have ever been collected in the process
+
+def _record_buffer(kind, size):
+    """Record the number of events buffered by the given kind of buffer in the
+    metrics of the stream currently being serialized, if any.
+    """
+    if _collecting:
+        metrics = getattr(_local, 'metrics', None)
+        if metrics is not None:
+            metrics.buffered(kind, size)
+
+
+def _measure(stream, metrics):
+    # Count the events of the stream and the time spent producing them, and
+    # make the metrics available to buffers while the events are produced
+    events = metrics.events
+    elapsed = 0
+    next = iter(stream).next
+    local = _local
+    while 1:
+        # The metrics are only active while the stream is advanced, so that
+        # they are not left behind if the serialization is aborted
+        previous = getattr(local, 'metrics', None)
+        local.metrics = metrics
+        start = time()
+        try:
+            try:
+                event = next()
+            except StopIteration:
+                event = None
+        finally:
+            elapsed += time() - start
+            local.metrics = previous
+        if event is None:
+            break
+        events[event[0]] = events.get(event[0], 0) + 1
+        yield event
+    metrics.stream_time += elapsed
+
+
+def _serialize(serializer, stream, callback):
+    """Serialize the given stream while collecting `RenderMetrics`, which are
+    passed to the callback function once the output is complete.
+    """
+    global _collecting
+    _collecting = True
+    metrics = RenderMetrics()
+    if isinstance(serializer, XMLSerializer):
+        serializer.metrics = metrics
+    elapsed = 0
+    size = 0
+    next = iter(serializer(_measure(stream, metrics))).next
+    while 1:
+        start = time()
+        try:
+            chunk = next()
+        except StopIteration:
+            elapsed += time() - start
+            break
+        elapsed += time() - start
+        size += len(chunk)
+        yield chunk
+    metrics.bytes = size
+    metrics.serialize_time = elapsed - metrics.stream_time
+    callback(metrics)
+
+
+def _cache_getter(cache, metrics):
+    # Return a function that looks up cached serializer output, and counts the
+    # cache hits and misses if metrics are being collected
+    if metrics is None:
+        return cache.get
+    def cache_get(key):
+        output = cache.get(key)
+        if output is None:
+            metrics.cache_misses += 1
+        else:
+            metrics.cache_hits += 1
+        return output
+    return cache_get
+
+
 class DocType(object):
     """Defines a number of commonly used DOCTYPE declarations as constants."""
 
@@ -180,6 +335,10 @@ class XMLSerializer(object):
 
     _PRESERVE_SPACE = frozenset()
 
+    metrics = None
+    """The `RenderMetrics` that cache hits and misses are counted in, if
+    any."""
+
     def __init__(self, doctype=None, strip_whitespace=True,
                  namespace_prefixes=None, cache=True):
         """Initialize the XML serializer.
@@ -209,7 +368,7 @@ class XMLSerializer(object):
         in_cdata = False
 
         cache = {}
-        cache_get = cache.get
+        cache_get = _cache_getter(cache, self.metrics)
         if self.cache:
             def _emit(kind, input, output):
                 cache[kind, input] = output
@@ -325,7 +484,7 @@ class XHTMLSerializer(XMLSerializer):
         in_cdata = False
 
         cache = {}
-        cache_get = cache.get
+        cache_get = _cache_getter(cache, self.metrics)
         if self.cache:
             def _emit(kind, input, output):
                 cache[kind, input] = output
@@ -456,7 +615,7 @@ class HTMLSerializer(XHTMLSerializer):
         noescape = False
 
         cache = {}
-        cache_get = cache.get
+        cache_get = _cache_getter(cache, self.metrics)
         if self.cache:
             def _emit(kind, input, output):
                 cache[kind, input] = output
@@ -38,6 +38,7 @@ Because the XPath engine operates on markup streams (as opposed to tree
 structures), it only implements a subset of the full XPath 1.0 language.
 """
 
+from bisect import bisect_left
 from collections import deque
 try:
     reduce # builtin in Python < 3
@@ -48,7 +49,7 @@ import operator
 import re
 from itertools import chain
 
-from genshi.core import Stream, Attrs, Namespace, QName
+from genshi.core import Stream, IndexedStream, Attrs, Namespace, QName
 from genshi.core import START, END, TEXT, START_NS, END_NS, COMMENT, PI, \
                         START_CDATA, END_CDATA
 
@@ -538,6 +539,7 @@ class Path(object):
                     break
             else:
                 raise NotImplemented('No strategy found for path')
+        self.targets = self._index_targets()
 
     def __repr__(self):
         paths = []
@@ -574,6 +576,10 @@ class Path(object):
             namespaces = {}
         if variables is None:
             variables = {}
+        if self.targets and isinstance(stream, IndexedStream) \
+                and stream.ends is not None:
+            return Stream(self._select_indexed(stream, namespaces, variables),
+                          serializer=stream.serializer)
         stream = iter(stream)
         def _generate(stream=stream, ns=namespaces, vs=variables):
             next = stream.next
@@ -597,6 +603,78 @@ class Path(object):
         return Stream(_generate(),
                       serializer=getattr(stream, 'serializer', None))
 
+    def _index_targets(self):
+        """Return the set of local names that any element matched by the path
+        must have, or `None` if matches can not be predicted that way.
+        
+        Only paths without predicates are considered, as positional predicates
+        depend on seeing every candidate node.
+        """
+        targets = set()
+        for path in self.paths:
+            for _, _, predicates in path:
+                if predicates:
+                    return None
+            steps = [step for step in path if step[0] is not ATTRIBUTE]
+            if not steps:
+                return None
+            nodetest = steps[-1][1]
+            if not isinstance(nodetest, (LocalNameTest, QualifiedNameTest)) \
+                    or nodetest.principal_type is ATTRIBUTE:
+                return None
+            targets.add(nodetest.name)
+        return targets
+
+    def _select_indexed(self, stream, namespaces, variables):
+        """Generate the matches of the path on an `IndexedStream`.
+        
+        Any element whose subtree does not contain an element with one of the
+        target local names is skipped as a whole, and only the `START` and
+        `END` events of the remaining elements are passed to the test function.
+        """
+        events = stream.events
+        ends = stream.ends
+        if len(self.targets) == 1:
+            positions = stream.index.get(list(self.targets)[0], [])
+        else:
+            positions = []
+            for name in self.targets:
+                positions.extend(stream.index.get(name, []))
+            positions.sort()
+        if not positions:
+            return
+
+        test = self.test()
+        idx = positions[0]
+        while stream.parents[idx] >= 0:
+            idx = stream.parents[idx]
+        num_events = len(events)
+        num_positions = len(positions)
+        while idx < num_events:
+            event = events[idx]
+            kind = event[0]
+            if kind is START:
+                end = ends[idx]
+                candidate = bisect_left(positions, idx)
+                if candidate == num_positions:
+                    break
+                if positions[candidate] > end:
+                    # no candidate element in this subtree
+                    idx = end + 1
+                    continue
+                result = test(event, namespaces, variables)
+                if result is True:
+                    for subevent in events[idx:end + 1]:
+                        yield subevent
+                    test(events[end], namespaces, variables, updateonly=True)
+                    idx = end + 1
+                    continue
+                elif result:
+                    yield result
+            elif kind is END:
+                test(event, namespaces, variables)
+            idx += 1
+
     def test(self, ignore_context=False):
         """Returns a function that can be used to track whether the path matches
         a specific stream event.
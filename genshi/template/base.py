@@ -127,7 +127,9 @@ class Context(object):
         self.pop = self.frames.popleft
         self.push = self.frames.appendleft
         self._match_templates = []
+        self._match_scopes = set() # elements that can define matches
         self._choice_stack = []
+        self._profile = None # the profiler, or `False` if not profiling
 
         # Helper functions for use in expressions
         def defined(name):
@@ -272,6 +274,8 @@ def _eval_expr(expr, ctxt, vars=None):
                  expression
     :return: the result of the evaluation
     """
+    if ctxt._profile:
+        return ctxt._profile._evaluate(expr, ctxt, vars)
     if vars:
         ctxt.push(vars)
     retval = expr.evaluate(ctxt)
@@ -280,6 +284,20 @@ def _eval_expr(expr, ctxt, vars=None):
     return retval
 
 
+def _forget_profile(stream, ctxt):
+    """Reset the decision whether to profile the rendering once the stream
+    has been consumed or aborted, so that a context that is used for another
+    rendering is sampled again.
+    """
+    try:
+        for event in stream:
+            yield event
+    except:
+        ctxt._profile = None
+        raise
+    ctxt._profile = None
+
+
 def _exec_suite(suite, ctxt, vars=None):
     """Execute the given `Suite` object.
     
@@ -368,6 +386,11 @@ class Template(DirectiveFactory):
 
     serializer = None
     _number_conv = unicode # function used to convert numbers to event data
+    _fold_constants = True # whether constant expressions are evaluated early
+
+    profile = None
+    """The `Profiler` used to collect timing statistics when the template is
+    rendered, or ``None``."""
 
     def __init__(self, source, filepath=None, filename=None, loader=None,
                  encoding=None, lookup='strict', allow_exec=True):
@@ -411,6 +434,7 @@ class Template(DirectiveFactory):
     def __getstate__(self):
         state = self.__dict__.copy()
         state['filters'] = []
+        state.pop('profile', None)
         return state
 
     def __setstate__(self, state):
@@ -461,10 +485,19 @@ class Template(DirectiveFactory):
     def _prepare(self, stream):
         """Call the `attach` method of every directive found in the template.
         
+        Expressions that only consist of literals are evaluated at this point:
+        expressions in text and attribute values are replaced by their result,
+        and ``if`` directives with a constant condition are either removed or,
+        together with their content, dropped from the stream.
+        
         :param stream: the event stream of the template
+        :note: Changed in 0.7: added the evaluation of constant expressions
         """
+        from genshi.template.directives import IfDirective
+        from genshi.template.eval import _constant_value, UNDEFINED
         from genshi.template.loader import TemplateNotFound
 
+        fold = self._can_fold_constants()
         for kind, data, pos in stream:
             if kind is SUB:
                 directives = []
@@ -474,12 +507,60 @@ class Template(DirectiveFactory):
                                                       namespaces, pos)
                     if directive:
                         directives.append(directive)
+                if fold:
+                    dead = False
+                    for directive in directives[:]:
+                        if type(directive) is not IfDirective:
+                            continue
+                        value = _constant_value(directive.expr)
+                        if value is UNDEFINED:
+                            continue
+                        if value:
+                            directives.remove(directive)
+                        elif directive is directives[0]:
+                            # Nothing would be evaluated before the condition
+                            dead = True
+                            break
+                    if dead:
+                        continue
                 substream = self._prepare(substream)
                 if directives:
                     yield kind, (directives, list(substream)), pos
                 else:
                     for event in substream:
                         yield event
+            elif fold and kind is EXPR:
+                value = _constant_value(data)
+                if value is None:
+                    continue
+                text = self._constant_text(value)
+                if text is None:
+                    yield kind, data, pos
+                else:
+                    yield TEXT, text, pos
+            elif fold and kind is START and data[1]:
+                tag, attrs = data
+                new_attrs = []
+                for name, value in attrs:
+                    if type(value) is list:
+                        values = []
+                        for subkind, subdata, subpos in value:
+                            if subkind is EXPR:
+                                subdata = _constant_value(subdata)
+                                if subdata is None:
+                                    continue
+                                subdata = self._constant_text(subdata)
+                            elif subkind is not TEXT:
+                                subdata = None
+                            if subdata is None:
+                                break
+                            values.append(subdata)
+                        else:
+                            if not values:
+                                continue
+                            value = ''.join(values)
+                    new_attrs.append((name, value))
+                yield kind, (tag, Attrs(new_attrs)), pos
             else:
                 if kind is INCLUDE:
                     href, cls, fallback = data
@@ -505,6 +586,29 @@ class Template(DirectiveFactory):
 
                 yield kind, data, pos
 
+    def _can_fold_constants(self):
+        # Filters and directives added to the template may rely on seeing the
+        # original expressions (the i18n filter and directives do, for
+        # example), so constants are only folded for plain templates
+        if not self._fold_constants:
+            return False
+        for filter_ in self.filters:
+            try:
+                if filter_.im_self is not self:
+                    return False
+            except AttributeError:
+                return False
+        return True
+
+    def _constant_text(self, value):
+        # Return the text a constant expression evaluates to, following the
+        # same rules as `_flatten`, or `None` if it is not a simple value
+        if isinstance(value, basestring):
+            return value
+        elif isinstance(value, (int, float, long)):
+            return self._number_conv(value)
+        return None
+
     def generate(self, *args, **kwargs):
         """Apply the template to the given context data.
         
@@ -530,13 +634,26 @@ class Template(DirectiveFactory):
         else:
             ctxt = Context(**kwargs)
 
+        profile = ctxt._profile
+        decided = False
+        if profile is None and self.profile is not None:
+            # Decide whether to profile this rendering, including any
+            # templates included or matched from it
+            profile = ctxt._profile = self.profile.sample() and self.profile
+            decided = True
+
         stream = self.stream
         for filter_ in self.filters:
             stream = filter_(iter(stream), ctxt, **vars)
+        if profile:
+            stream = profile._timed_template(self, stream)
+        if decided:
+            stream = _forget_profile(stream, ctxt)
         return Stream(stream, self.serializer)
 
     def _flatten(self, stream, ctxt, **vars):
         number_conv = self._number_conv
+        profile = ctxt._profile
         stack = []
         push = stack.append
         pop = stack.pop
@@ -563,7 +680,10 @@ class Template(DirectiveFactory):
                     yield kind, (tag, Attrs(new_attrs)), pos
 
                 elif kind is EXPR:
-                    result = _eval_expr(data, ctxt, vars)
+                    if profile:
+                        result = profile._evaluate(data, ctxt, vars, pos)
+                    else:
+                        result = _eval_expr(data, ctxt, vars)
                     if result is not None:
                         # First check for a string, otherwise the iterable test
                         # below succeeds, and the string will be chopped up into
@@ -584,6 +704,11 @@ class Template(DirectiveFactory):
                     # events to which those directives should be applied
                     push(stream)
                     stream = _apply_directives(data[1], data[0], ctxt, vars)
+                    if profile:
+                        stream = profile._timed('directive', pos,
+                                                ' '.join([repr(directive)
+                                                    for directive in data[0]]),
+                                                stream)
                     break
 
                 elif kind is EXEC:
@@ -616,7 +741,11 @@ class Template(DirectiveFactory):
                 try:
                     tmpl = self.loader.load(href, relative_to=event[2][0],
                                             cls=cls or self.__class__)
-                    for event in tmpl.generate(ctxt, **vars):
+                    included = tmpl.generate(ctxt, **vars)
+                    if ctxt._profile:
+                        included = ctxt._profile._timed('include', event[2],
+                                                        href, included)
+                    for event in included:
                         yield event
                 except TemplateNotFound:
                     if fallback is None:
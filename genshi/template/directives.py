@@ -13,12 +13,19 @@
 
 """Implementation of the various template directives."""
 
-from genshi.core import QName, Stream
+try:
+    import threading
+except ImportError:
+    import dummy_threading as threading
+
+from genshi.core import QName, Stream, START, END, TEXT, DOCTYPE, START_NS, \
+                        END_NS, START_CDATA, END_CDATA, PI, COMMENT
 from genshi.path import Path
 from genshi.template.base import TemplateRuntimeError, TemplateSyntaxError, \
-                                 EXPR, _apply_directives, _eval_expr
+                                 EXEC, EXPR, SUB, _apply_directives, _eval_expr
 from genshi.template.eval import Expression, ExpressionASTTransformer, \
                                  _ast, _parse
+from genshi.util import LRUCache
 
 __all__ = ['AttrsDirective', 'ChooseDirective', 'ContentDirective',
            'DefDirective', 'ForDirective', 'IfDirective', 'MatchDirective',
@@ -124,7 +131,22 @@ def _assignment(ast):
             return tuple([_names(child) for child in node.elts])
         elif isinstance(node, _ast.Name):
             return node.id
-    def _assign(data, value, names=_names(ast)):
+    names = _names(ast)
+    if type(names) is not tuple:
+        def _assign(data, value):
+            data[names] = value
+        return _assign
+    for name in names:
+        if type(name) is tuple:
+            break
+    else:
+        # Flat tuple of names, which is the common case for ``py:for``
+        indexed = list(enumerate(names))
+        def _assign(data, value):
+            for idx, name in indexed:
+                data[name] = value[idx]
+        return _assign
+    def _assign(data, value, names=names):
         if type(names) is tuple:
             for idx in range(len(names)):
                 _assign(data, value[idx], names[idx])
@@ -133,6 +155,94 @@ def _assignment(ast):
     return _assign
 
 
+def _select_calls(code):
+    """Return the number of times the given code object may call the
+    ``select()`` function of a match template, where any reference to that
+    function from a nested scope (such as a lambda or a generator expression)
+    counts as two.
+    """
+    count = 0
+    nodes = [(code.ast, False)]
+    while nodes:
+        node, nested = nodes.pop()
+        name = node.__class__.__name__
+        if name == 'Name' and node.id == 'select':
+            if nested:
+                return 2
+            count += 1
+        nested = nested or name in ('Lambda', 'ListComp', 'GeneratorExp',
+                                    'DictComp', 'SetComp', 'FunctionDef',
+                                    'For', 'While')
+        for field in node._fields:
+            value = getattr(node, field, None)
+            if isinstance(value, _ast.AST):
+                nodes.append((value, nested))
+            elif isinstance(value, (list, tuple)):
+                nodes.extend([(item, nested) for item in value
+                              if isinstance(item, _ast.AST)])
+    return count
+
+
+def _streamable(stream):
+    """Return whether the matched content of a match template with the given
+    body can be streamed instead of being buffered.
+    
+    That is the case if the body calls ``select()`` at most once, and nothing
+    in the body other than static markup is evaluated before that call, so
+    that consuming the matched content lazily can not change the output.
+    """
+    seen = [False] # whether the call to select() has been passed
+
+    def _expr(code):
+        calls = _select_calls(code)
+        if calls > 1 or calls and seen[0]:
+            return False
+        elif calls:
+            seen[0] = True
+            return True
+        return seen[0]
+
+    def _walk(stream):
+        for kind, data, pos in stream:
+            if kind is EXPR:
+                if not _expr(data):
+                    return False
+            elif kind is START:
+                for name, value in data[1]:
+                    if type(value) is list and not _walk(value):
+                        return False
+            elif kind is SUB:
+                if not seen[0]:
+                    return False
+                directives, substream = data
+                for directive in directives:
+                    if type(directive) is WithDirective:
+                        exprs = [expr for targets, expr in directive.vars]
+                    elif type(directive) in (AttrsDirective, ChooseDirective,
+                                             ForDirective, IfDirective,
+                                             OtherwiseDirective,
+                                             StripDirective, WhenDirective):
+                        exprs = [directive.expr]
+                    else:
+                        return False
+                    for expr in exprs:
+                        if expr is not None and _select_calls(expr):
+                            return False
+                if not _walk(substream):
+                    return False
+            elif kind is EXEC:
+                if not seen[0] or _select_calls(data):
+                    return False
+            elif kind not in _STATIC_KINDS:
+                return False
+        return True
+
+    return _walk(stream)
+
+_STATIC_KINDS = frozenset([START, END, TEXT, DOCTYPE, START_NS, END_NS,
+                           START_CDATA, END_CDATA, PI, COMMENT])
+
+
 class AttrsDirective(Directive):
     """Implementation of the ``py:attrs`` template directive.
     
@@ -253,11 +363,36 @@ class DefDirective(Directive):
         Hello, world!
       </p>
     </div>
+    
+    When used as an element, the ``cache`` attribute makes the function cache
+    its output per combination of arguments. The value is either the maximum
+    number of results kept for the lifetime of the template, or ``render`` to
+    keep the results only for the current rendering of the template:
+    
+    >>> tmpl = MarkupTemplate('''<div xmlns:py="http://genshi.edgewall.org/">
+    ...   <py:def function="icon(name)" cache="100">
+    ...     <img src="/icons/${name}.png" alt="${name.title()}"/>
+    ...   </py:def>
+    ...   ${icon('add')}${icon('delete')}${icon('add')}
+    ... </div>''')
+    >>> print(tmpl.generate())
+    <div>
+        <img src="/icons/add.png" alt="Add"/>
+        <img src="/icons/delete.png" alt="Delete"/>
+        <img src="/icons/add.png" alt="Add"/>
+    </div>
+    
+    This should only be used for functions whose output depends on nothing but
+    their arguments, which need to be hashable for the cache to be used.
     """
-    __slots__ = ['name', 'args', 'star_args', 'dstar_args', 'defaults']
+    __slots__ = ['name', 'args', 'star_args', 'dstar_args', 'defaults',
+                 'cache', 'template', '_cache']
 
     def __init__(self, args, template, namespaces=None, lineno=-1, offset=-1):
         Directive.__init__(self, None, template, namespaces, lineno, offset)
+        self.cache = None
+        self.template = template
+        self._cache = None
         ast = _parse(args).body
         self.args = []
         self.star_args = None
@@ -280,17 +415,91 @@ class DefDirective(Directive):
         else:
             self.name = ast.id
 
+    def __getstate__(self):
+        state = {}
+        for name in Directive.__slots__ + DefDirective.__slots__:
+            state[name] = getattr(self, name)
+        state['_cache'] = None
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+        self._init_cache()
+
     @classmethod
     def attach(cls, template, stream, value, namespaces, pos):
+        cache = None
         if type(value) is dict:
+            cache = value.get('cache')
             value = value.get('function')
-        return super(DefDirective, cls).attach(template, stream, value,
-                                               namespaces, pos)
+        directive, stream = super(DefDirective, cls).attach(template, stream,
+                                                            value, namespaces,
+                                                            pos)
+        if cache:
+            if cache != 'render':
+                try:
+                    cache = int(cache)
+                except ValueError:
+                    raise TemplateSyntaxError('Invalid cache size "%s" for '
+                                              'function "%s"' %
+                                              (cache, directive.name),
+                                              template.filepath, *pos[1:])
+            directive.cache = cache
+            directive._init_cache()
+        return directive, stream
+
+    def _init_cache(self):
+        self._cache = None
+        if self.cache and self.cache != 'render':
+            self._cache = LRUCache(self.cache)
 
     def __call__(self, stream, directives, ctxt, **vars):
         stream = list(stream)
+        cache = self._cache
+        if self.cache == 'render':
+            cache = {}
 
         def function(*args, **kwargs):
+            key = None
+            if cache is not None:
+                # Values such as `Markup` and `unicode`, or `True` and `1`,
+                # compare equal but render differently, so the types are part
+                # of the key
+                key = (_typed(args),
+                       tuple([(name, _typed(value)) for name, value
+                              in sorted(kwargs.items())]))
+                try:
+                    hash(key)
+                except TypeError: # unhashable arguments
+                    key = None
+            if key is None:
+                for event in _call(args, kwargs):
+                    yield event
+                return
+
+            _cache_lock.acquire()
+            try:
+                try:
+                    events = cache[key]
+                except KeyError:
+                    events = None
+            finally:
+                _cache_lock.release()
+            if events is None:
+                # Cache the flattened output, so that the expressions and
+                # directives in the function body need not be evaluated again
+                events = list(self.template._flatten(_call(args, kwargs),
+                                                     ctxt, **vars))
+                _cache_lock.acquire()
+                try:
+                    cache[key] = events
+                finally:
+                    _cache_lock.release()
+            for event in events:
+                yield event
+
+        def _call(args, kwargs):
             scope = {}
             args = list(args) # make mutable
             for name in self.args:
@@ -322,6 +531,16 @@ class DefDirective(Directive):
     def __repr__(self):
         return '<%s "%s">' % (type(self).__name__, self.name)
 
+_cache_lock = threading.RLock()
+
+def _typed(value):
+    """Return a cache key for the given value that includes its type, and the
+    types of the items of tuples.
+    """
+    if type(value) is tuple:
+        return (tuple, tuple([_typed(item) for item in value]))
+    return (type(value), value)
+
 
 class ForDirective(Directive):
     """Implementation of the ``py:for`` template directive for repeating an
@@ -336,7 +555,7 @@ class ForDirective(Directive):
       <li>1</li><li>2</li><li>3</li>
     </ul>
     """
-    __slots__ = ['assign', 'filename']
+    __slots__ = ['assign', 'name', 'filename']
 
     def __init__(self, value, template, namespaces=None, lineno=-1, offset=-1):
         if ' in ' not in value:
@@ -345,7 +564,11 @@ class ForDirective(Directive):
         assign, value = value.split(' in ', 1)
         ast = _parse(assign, 'exec')
         value = 'iter(%s)' % value.strip()
-        self.assign = _assignment(ast.body[0].value)
+        target = ast.body[0].value
+        self.assign = _assignment(target)
+        self.name = None
+        if isinstance(target, _ast.Name):
+            self.name = target.id
         self.filename = template.filepath
         Directive.__init__(self, value, template, namespaces, lineno, offset)
 
@@ -361,15 +584,32 @@ class ForDirective(Directive):
         if iterable is None:
             return
 
+        # The same scope is used for all iterations, so it is pushed on the
+        # context only once, and the loop body is replayed directly unless
+        # there are further directives to apply to it
+        name = self.name
         assign = self.assign
         scope = {}
         stream = list(stream)
-        for item in iterable:
-            assign(scope, item)
-            ctxt.push(scope)
-            for event in _apply_directives(stream, directives, ctxt, vars):
-                yield event
-            ctxt.pop()
+        ctxt.push(scope)
+        if not directives:
+            for item in iterable:
+                if name is None:
+                    assign(scope, item)
+                else:
+                    scope[name] = item
+                for event in stream:
+                    yield event
+        else:
+            directive, directives = directives[0], directives[1:]
+            for item in iterable:
+                if name is None:
+                    assign(scope, item)
+                else:
+                    scope[name] = item
+                for event in directive(iter(stream), directives, ctxt, **vars):
+                    yield event
+        ctxt.pop()
 
     def __repr__(self):
         return '<%s>' % type(self).__name__
@@ -421,7 +661,7 @@ class MatchDirective(Directive):
       </span>
     </div>
     """
-    __slots__ = ['path', 'namespaces', 'hints']
+    __slots__ = ['path', 'namespaces', 'hints', 'streamable']
 
     def __init__(self, value, template, hints=None, namespaces=None,
                  lineno=-1, offset=-1):
@@ -429,13 +669,17 @@ class MatchDirective(Directive):
         self.path = Path(value, template.filepath, lineno)
         self.namespaces = namespaces or {}
         self.hints = hints or ()
+        self.streamable = None
 
     @classmethod
     def attach(cls, template, stream, value, namespaces, pos):
         hints = []
         if type(value) is dict:
-            if value.get('buffer', '').lower() == 'false':
+            buffer = value.get('buffer', '').lower()
+            if buffer == 'false':
                 hints.append('not_buffered')
+            elif buffer == 'true':
+                hints.append('buffered')
             if value.get('once', '').lower() == 'true':
                 hints.append('match_once')
             if value.get('recursive', '').lower() == 'false':
@@ -445,8 +689,18 @@ class MatchDirective(Directive):
                stream
 
     def __call__(self, stream, directives, ctxt, **vars):
+        stream = list(stream)
+        hints = self.hints
+        if not hints or 'not_buffered' not in hints and \
+                'buffered' not in hints:
+            # Unless buffering was explicitly requested, determine whether the
+            # matched content can be streamed
+            if self.streamable is None:
+                self.streamable = _streamable(stream)
+            if self.streamable and not directives:
+                hints = frozenset(hints) | frozenset(['streamable'])
         ctxt._match_templates.append((self.path.test(ignore_context=True),
-                                      self.path, list(stream), self.hints,
+                                      self.path, stream, hints,
                                       self.namespaces, directives))
         return []
 
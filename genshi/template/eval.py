@@ -56,7 +56,7 @@ def _star_import_patch(mapping, modname):
 
 class Code(object):
     """Abstract base class for the `Expression` and `Suite` classes."""
-    __slots__ = ['source', 'code', 'ast', '_globals']
+    __slots__ = ['source', 'code', 'ast', '_globals', '_shared_globals']
 
     def __init__(self, source, filename=None, lineno=-1, lookup='strict',
                  xform=None):
@@ -76,7 +76,9 @@ class Code(object):
         """
         if isinstance(source, basestring):
             self.source = source
-            node = _parse(source, mode=self.mode)
+            node, code = _compile_source(source, mode=self.mode,
+                                         filename=filename, lineno=lineno,
+                                         xform=xform)
         else:
             assert isinstance(source, _ast.AST), \
                 'Expected string or AST node, but got %r' % source
@@ -87,15 +89,17 @@ class Code(object):
             else:
                 node = _ast.Module()
                 node.body = [source]
+            code = _compile(node, self.source, mode=self.mode,
+                            filename=filename, lineno=lineno, xform=xform)
 
         self.ast = node
-        self.code = _compile(node, self.source, mode=self.mode,
-                             filename=filename, lineno=lineno, xform=xform)
+        self.code = code
         if lookup is None:
             lookup = LenientLookup
         elif isinstance(lookup, basestring):
             lookup = {'lenient': LenientLookup, 'strict': StrictLookup}[lookup]
         self._globals = lookup.globals
+        self._shared_globals = _get_shared_globals(lookup, self.code)
 
     def __getstate__(self):
         state = {'source': self.source, 'ast': self.ast,
@@ -108,6 +112,7 @@ class Code(object):
         self.ast = state['ast']
         self.code = CodeType(0, *state['code'])
         self._globals = state['lookup'].globals
+        self._shared_globals = _get_shared_globals(state['lookup'], self.code)
 
     def __eq__(self, other):
         return (type(other) == type(self)) and (self.code == other.code)
@@ -173,7 +178,9 @@ class Expression(Code):
         :return: the result of the evaluation
         """
         __traceback_hide__ = 'before_and_this'
-        _globals = self._globals(data)
+        _globals = self._shared_globals
+        if _globals is None:
+            _globals = self._globals(data)
         return eval(self.code, _globals, {'__data__': data})
 
 
@@ -198,6 +205,79 @@ class Suite(Code):
         exec self.code in _globals, data
 
 
+_CONSTANT_NODES = frozenset(['Expression', 'Num', 'Str', 'Bytes',
+                             'NameConstant', 'Constant', 'BinOp', 'UnaryOp',
+                             'BoolOp', 'Compare', 'IfExp', 'Tuple', 'List'])
+_CONSTANT_NAMES = frozenset(['True', 'False', 'None'])
+
+def _constant_value(expr):
+    """Return the value of the given expression if it only consists of
+    literals and operators, and thus evaluates to the same value regardless of
+    the data it is evaluated against, or `UNDEFINED` if it doesn't.
+    
+    :param expr: the `Expression`
+    """
+    nodes = [expr.ast]
+    while nodes:
+        node = nodes.pop()
+        name = node.__class__.__name__
+        if name == 'Name':
+            if node.id not in _CONSTANT_NAMES:
+                return UNDEFINED
+        elif name not in _CONSTANT_NODES and not \
+                isinstance(node, (_ast.operator, _ast.unaryop, _ast.boolop,
+                                  _ast.cmpop, _ast.expr_context)):
+            return UNDEFINED
+        for field in node._fields:
+            value = getattr(node, field, None)
+            if isinstance(value, _ast.AST):
+                nodes.append(value)
+            elif isinstance(value, (list, tuple)):
+                nodes.extend([item for item in value
+                              if isinstance(item, _ast.AST)])
+    try:
+        return expr.evaluate({})
+    except Exception:
+        # Errors are left to be raised when the template is rendered
+        return UNDEFINED
+
+
+_shared_globals = {}
+
+def _get_shared_globals(lookup, code):
+    """Return a globals dictionary for the given lookup class that can be
+    shared by all evaluations of the code object, or `None` if the globals
+    need to be constructed for every evaluation.
+    
+    The data is passed to expressions in their locals, so the globals do not
+    depend on the data unless the code contains nested code objects (such as
+    lambdas or generator expressions), which look up the data in the globals,
+    or the lookup class overrides how the globals are constructed.
+    
+    The shared dictionary is used by all expressions in the process, so it
+    must be treated as read-only. Code that refers to ``globals`` could modify
+    it, and therefore gets a dictionary of its own for every evaluation.
+    """
+    try:
+        if lookup.globals.im_func is not LookupBase.globals.im_func:
+            return None
+    except AttributeError:
+        return None
+    for const in code.co_consts:
+        if isinstance(const, CodeType):
+            return None
+    # Names are usually looked up through the lookup class, in which case
+    # they appear among the constants
+    if 'globals' in code.co_names or 'globals' in code.co_consts:
+        return None
+    _globals = _shared_globals.get(lookup)
+    if _globals is None:
+        _globals = lookup.globals(None)
+        del _globals['__data__']
+        _shared_globals[lookup] = _globals
+    return _globals
+
+
 UNDEFINED = object()
 
 
@@ -428,8 +508,7 @@ def _parse(source, mode='eval'):
     return parse(source, mode)
 
 
-def _compile(node, source=None, mode='eval', filename=None, lineno=-1,
-             xform=None):
+def _code_filename(filename):
     if not filename:
         filename = '<string>'
     if IS_PYTHON2:
@@ -440,6 +519,12 @@ def _compile(node, source=None, mode='eval', filename=None, lineno=-1,
         # Python 3 requires unicode filenames
         if not isinstance(filename, unicode):
             filename = filename.decode('utf-8', 'replace')
+    return filename
+
+
+def _compile(node, source=None, mode='eval', filename=None, lineno=-1,
+             xform=None):
+    filename = _code_filename(filename)
     if lineno <= 0:
         lineno = 1
 
@@ -471,6 +556,51 @@ def _compile(node, source=None, mode='eval', filename=None, lineno=-1,
         return code
 
 
+_code_cache = {}
+_CODE_CACHE_SIZE = 2000
+
+def _compile_source(source, mode='eval', filename=None, lineno=-1, xform=None):
+    """Parse and compile the given source code, returning the AST and the code
+    object.
+    
+    As the same expressions tend to be used over and over in templates, the
+    result is shared between all code objects with the same source, mode, and
+    AST transformer, and only the file name and line number are adjusted. Code
+    that contains nested code objects (such as lambdas or generator
+    expressions) is only shared between code objects in the same file, as the
+    file name of the nested code objects can not simply be patched.
+    """
+    # The type is part of the key so that byte strings with non-ASCII
+    # characters are never compared with unicode strings
+    key = (type(source), source, mode, xform)
+    entry = _code_cache.get(key)
+    if entry is not None:
+        node, code, nested = entry
+        filename = _code_filename(filename)
+        if not nested or code.co_filename == filename:
+            if lineno <= 0:
+                lineno = 1
+            try:
+                code = build_code_chunk(code, filename, code.co_name, lineno)
+            except RuntimeError:
+                pass
+            else:
+                return node, code
+
+    node = _parse(source, mode=mode)
+    code = _compile(node, source, mode=mode, filename=filename, lineno=lineno,
+                    xform=xform)
+    nested = False
+    for const in code.co_consts:
+        if isinstance(const, CodeType):
+            nested = True
+            break
+    if len(_code_cache) >= _CODE_CACHE_SIZE:
+        _code_cache.clear()
+    _code_cache[key] = node, code, nested
+    return node, code
+
+
 def _new(class_, *args, **kwargs):
     ret = class_()
     for attr, value in zip(ret._fields, args):
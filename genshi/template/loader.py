@@ -78,7 +78,8 @@ class TemplateLoader(object):
     """
     def __init__(self, search_path=None, auto_reload=False,
                  default_encoding=None, max_cache_size=25, default_class=None,
-                 variable_lookup='strict', allow_exec=True, callback=None):
+                 variable_lookup='strict', allow_exec=True, callback=None,
+                 profile=None):
         """Create the template laoder.
         
         :param search_path: a list of absolute path names that should be
@@ -104,9 +105,13 @@ class TemplateLoader(object):
                          is passed the template object as only argument. This
                          callback can be used for example to add any desired
                          filters to the template
-        :see: `LenientLookup`, `StrictLookup`
+        :param profile: (optional) a `Profiler` that collects timing
+                        statistics whenever a template loaded by this loader
+                        is rendered
+        :see: `LenientLookup`, `StrictLookup`, `Profiler`
         
         :note: Changed in 0.5: Added the `allow_exec` argument
+        :note: Changed in 0.7: Added the `profile` argument
         """
         from genshi.template.markup import MarkupTemplate
 
@@ -127,6 +132,7 @@ class TemplateLoader(object):
         if callback is not None and not hasattr(callback, '__call__'):
             raise TypeError('The "callback" parameter needs to be callable')
         self.callback = callback
+        self.profile = profile
         self._cache = LRUCache(max_cache_size)
         self._uptodate = {}
         self._lock = threading.RLock()
@@ -234,6 +240,9 @@ class TemplateLoader(object):
                             filename = filepath
                         tmpl = self._instantiate(cls, fileobj, filepath,
                                                  filename, encoding=encoding)
+                        if self.profile is not None:
+                            tmpl.profile = self.profile
+                            self.profile._register(tmpl)
                         if self.callback:
                             self.callback(tmpl)
                         self._cache[cachekey] = tmpl
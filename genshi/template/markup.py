@@ -18,6 +18,7 @@ from itertools import chain
 from genshi.core import Attrs, Markup, Namespace, Stream, StreamEventKind
 from genshi.core import START, END, START_NS, END_NS, TEXT, PI, COMMENT
 from genshi.input import XMLParser
+from genshi.output import _record_buffer
 from genshi.template.base import BadDirectiveError, Template, \
                                  TemplateSyntaxError, _apply_directives, \
                                  EXEC, INCLUDE, SUB
@@ -59,6 +60,7 @@ class MarkupTemplate(Template):
                   ('strip', StripDirective)]
     serializer = 'xml'
     _number_conv = Markup
+    _match_scopes = None # positions of elements that can define matches
 
     def __init__(self, source, filepath=None, filename=None, loader=None,
                  encoding=None, lookup='strict', allow_exec=True):
@@ -299,14 +301,64 @@ class MarkupTemplate(Template):
         """
         assert not self._prepared, 'Too late for adding directives, ' \
                                    'template already prepared'
+        if factory is not self:
+            self._fold_constants = False
         self._stream = self._extract_directives(self._stream, namespace,
                                                 factory)
 
+    def _defines_matches(self):
+        """Return the positions of the elements in the template whose content
+        can define match templates, either directly or through dynamic
+        includes.
+        
+        Match templates that are defined inside the matched content apply to
+        that content as well, which requires it to be buffered.
+        """
+        if self._match_scopes is not None:
+            return self._match_scopes
+        scopes = set()
+        elements = [] # positions of all elements
+        starts = [] # positions of the enclosing elements
+        macro_matches = [False]
+
+        def _walk(stream, in_def):
+            for kind, data, pos in stream:
+                if kind is START:
+                    elements.append(pos)
+                    starts.append(pos)
+                elif kind is END:
+                    starts.pop()
+                elif kind is INCLUDE:
+                    scopes.update(starts)
+                elif kind is SUB:
+                    directives, substream = data
+                    nested_def = in_def
+                    for directive in directives:
+                        if isinstance(directive, MatchDirective):
+                            scopes.update(starts)
+                            macro_matches[0] = macro_matches[0] or in_def
+                        elif isinstance(directive, DefDirective):
+                            nested_def = True
+                    _walk(substream, nested_def)
+        _walk(self.stream, False)
+
+        if macro_matches[0]:
+            # A macro defines match templates, and it could be called from
+            # anywhere in the template
+            scopes.update(elements)
+        self._match_scopes = frozenset(scopes)
+        return self._match_scopes
+
     def _match(self, stream, ctxt, start=0, end=None, **vars):
         """Internal stream filter that applies any defined match templates
         to the stream.
         """
         match_templates = ctxt._match_templates
+        if start == 0 and end is None:
+            # Called as a filter of this template
+            scopes = self._defines_matches()
+            if scopes:
+                ctxt._match_scopes.update(scopes)
 
         def _strip(stream, append):
             depth = 1
@@ -332,10 +384,13 @@ class MarkupTemplate(Template):
                 yield event
                 continue
 
-            for idx, (test, path, template, hints, namespaces, directives) \
-                    in enumerate(match_templates):
-                if idx < start or end is not None and idx >= end:
-                    continue
+            # Only the match templates in the given range are considered; the
+            # loop is left after the first match, so iterating over a slice is
+            # safe even though matching may modify the list
+            idx = start - 1
+            for test, path, template, hints, namespaces, directives \
+                    in match_templates[start:end]:
+                idx += 1
 
                 if test(event, namespaces, ctxt) is True:
                     if 'match_once' in hints:
@@ -344,8 +399,8 @@ class MarkupTemplate(Template):
 
                     # Let the remaining match templates know about the event so
                     # they get a chance to update their internal state
-                    for test in [mt[0] for mt in match_templates[idx + 1:]]:
-                        test(event, namespaces, ctxt, updateonly=True)
+                    for mt in match_templates[idx + 1:]:
+                        mt[0](event, namespaces, ctxt, updateonly=True)
 
                     # Consume and store all events until an end event
                     # corresponding to this start event is encountered
@@ -358,8 +413,16 @@ class MarkupTemplate(Template):
                         inner = self._match(inner, ctxt, start=start,
                                             end=pre_end, **vars)
                     content = self._include(chain([event], inner, tail), ctxt)
-                    if 'not_buffered' not in hints:
+                    # The content is streamed if the match template asks for
+                    # it, or if that can not change the output and the content
+                    # can not define match templates of its own
+                    buffered = 'not_buffered' not in hints and (
+                        'streamable' not in hints or
+                        event[2] in ctxt._match_scopes
+                    )
+                    if buffered:
                         content = list(content)
+                        _record_buffer('match', len(content))
                     content = Stream(content)
 
                     # Make the select() function available in the body of the
@@ -371,25 +434,31 @@ class MarkupTemplate(Template):
                     vars = dict(select=select)
 
                     # Recursively process the output
+                    pos = template and template[0][2] or event[2]
                     template = _apply_directives(template, directives, ctxt,
                                                  vars)
-                    for event in self._match(self._flatten(template, ctxt,
-                                                           **vars),
-                                             ctxt, start=idx + 1, **vars):
+                    output = self._match(self._flatten(template, ctxt, **vars),
+                                         ctxt, start=idx + 1, **vars)
+                    if ctxt._profile:
+                        output = ctxt._profile._timed('match', pos,
+                                                      path.source, output)
+                    for event in output:
                         yield event
 
                     # If the match template did not actually call select to
-                    # consume the matched stream, the original events need to
-                    # be consumed here or they'll get appended to the output
-                    if not selected[0]:
+                    # consume the matched stream, or did not iterate over the
+                    # selection, the original events need to be consumed here
+                    # or they'll get appended to the output
+                    if not selected[0] or not buffered:
                         for event in content:
                             pass
 
                     # Let the remaining match templates know about the last
                     # event in the matched content, so they can update their
                     # internal state accordingly
-                    for test in [mt[0] for mt in match_templates[idx + 1:]]:
-                        test(tail[0], namespaces, ctxt, updateonly=True)
+                    if tail:
+                        for mt in match_templates[idx + 1:]:
+                            mt[0](tail[0], namespaces, ctxt, updateonly=True)
 
                     break
 
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2010 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://genshi.edgewall.org/wiki/License.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://genshi.edgewall.org/log/.
+
+"""Collection of timing statistics about the rendering of templates.
+
+A `Profiler` is attached to a template by setting its ``profile`` attribute,
+or to all templates of a loader using the ``profile`` argument of the
+`TemplateLoader`. While a template is rendered, the profiler records the wall
+time spent in the template itself, in every directive, expression, include,
+and match template:
+
+>>> from genshi.template import MarkupTemplate
+>>> tmpl = MarkupTemplate('''<ul xmlns:py="http://genshi.edgewall.org/">
+...   <li py:for="item in items">${item}</li>
+... </ul>''', filename='list.html')
+>>> tmpl.profile = Profiler()
+>>> output = tmpl.generate(items=[1, 2, 3]).render()
+>>> for kind, location, name, calls, total in tmpl.profile.stats('location'):
+...     print('%-10s %-12s %-16s %d' % (kind, location, name, calls))
+template   list.html                     1
+directive  list.html:2  <ForDirective>   1
+expression list.html:2  item             3
+expression list.html:2  iter(items)      1
+
+Times are inclusive: the time of a template includes the time spent in its
+directives and expressions, for example.
+"""
+
+import random
+try:
+    import threading
+except ImportError:
+    import dummy_threading as threading
+from time import time
+try:
+    import json
+except ImportError:
+    json = None
+
+__all__ = ['Profiler']
+__docformat__ = 'restructuredtext en'
+
+
+class Profiler(object):
+    """Collects the number of calls and the accumulated wall time of the
+    various parts of templates, aggregated in-process over all renderings.
+    
+    To keep the overhead down in production use, only a fraction of the
+    renderings can be profiled by specifying a `sample_rate`.
+    
+    :note: Added in 0.7
+    """
+
+    def __init__(self, sample_rate=1.0, timer=time):
+        """Create the profiler.
+        
+        :param sample_rate: the fraction of renderings to profile, between
+                            ``0.0`` and ``1.0``
+        :param timer: the function used to get the current time in seconds
+        """
+        self.sample_rate = sample_rate
+        self.timer = timer
+        self._lock = threading.Lock()
+        self._filenames = {} # maps file paths to template file names
+        self.clear()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_lock'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__ = state
+        self._lock = threading.Lock()
+
+    def add(self, kind, location, name, elapsed, calls=1):
+        """Record the time spent in some part of a template.
+        
+        :param kind: the kind of the part, such as ``"template"`` or
+                     ``"directive"``
+        :param location: the file name and line number of the part
+        :param name: a description of the part, such as the source of an
+                     expression
+        :param elapsed: the time spent, in seconds
+        :param calls: the number of calls the time was spent on
+        """
+        key = (kind, location, name)
+        self._lock.acquire()
+        try:
+            entry = self._stats.get(key)
+            if entry is None:
+                self._stats[key] = [calls, elapsed]
+            else:
+                entry[0] += calls
+                entry[1] += elapsed
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        """Discard all statistics collected so far."""
+        self._stats = {}
+
+    def sample(self):
+        """Return whether the next rendering of a template should be
+        profiled, according to the sample rate.
+        
+        :rtype: `bool`
+        """
+        rate = self.sample_rate
+        return rate >= 1 or rate > 0 and random.random() < rate
+
+    def stats(self, sort='time', limit=None):
+        """Return the collected statistics as a list of
+        ``(kind, location, name, calls, time)`` tuples.
+        
+        :param sort: ``"time"`` to sort by the total time, ``"calls"`` to sort
+                     by the number of calls, or ``"location"`` to sort by the
+                     file name and line number
+        :param limit: the maximum number of entries to return
+        :rtype: `list`
+        """
+        self._lock.acquire()
+        try:
+            stats = [key + tuple(entry) for key, entry in self._stats.items()]
+        finally:
+            self._lock.release()
+        if sort == 'location':
+            stats.sort(key=lambda s: (s[1], s[0], s[2]))
+        else:
+            idx = {'time': 4, 'calls': 3}[sort]
+            stats.sort(key=lambda s: (-s[idx], s[1], s[0], s[2]))
+        if limit is not None:
+            stats = stats[:limit]
+        return stats
+
+    def report(self, sort='time', limit=None):
+        """Return the collected statistics formatted as a table.
+        
+        :param sort: the sort order, see `stats()`
+        :param limit: the maximum number of entries to include
+        :rtype: `unicode`
+        """
+        lines = [u'%-10s %8s %12s %12s  %s' % ('kind', 'calls', 'total (ms)',
+                                               'per call', 'location')]
+        for kind, location, name, calls, total in self.stats(sort, limit):
+            lines.append(u'%-10s %8d %12.3f %12.3f  %s %s' % (
+                kind, calls, total * 1000, total * 1000 / (calls or 1),
+                location, name
+            ))
+        return u'\n'.join(lines)
+
+    def to_json(self, sort='time', limit=None):
+        """Return the collected statistics as a JSON string, a list of objects
+        with ``kind``, ``location``, ``name``, ``calls`` and ``time``
+        properties.
+        
+        :param sort: the sort order, see `stats()`
+        :param limit: the maximum number of entries to include
+        :rtype: `str`
+        """
+        if json is None:
+            raise RuntimeError('The json module is not available')
+        return json.dumps([
+            dict(kind=kind, location=location, name=name, calls=calls,
+                 time=total)
+            for kind, location, name, calls, total in self.stats(sort, limit)
+        ])
+
+    # Instrumentation used by the template engine
+
+    def _location(self, pos):
+        # Event positions refer to templates either by their file path or by
+        # their file name, so use the file name consistently
+        filename = pos[0] or '<string>'
+        filename = self._filenames.get(filename, filename)
+        if pos[1] < 0:
+            return filename
+        return '%s:%d' % (filename, pos[1])
+
+    def _evaluate(self, expr, ctxt, vars, pos=None):
+        if pos is None:
+            # An expression of a directive
+            pos = (expr.code.co_filename, expr.code.co_firstlineno, -1)
+        timer = self.timer
+        start = timer()
+        if vars:
+            ctxt.push(vars)
+        try:
+            retval = expr.evaluate(ctxt)
+        finally:
+            if vars:
+                ctxt.pop()
+        self.add('expression', self._location(pos), expr.source,
+                 timer() - start)
+        return retval
+
+    def _register(self, template):
+        if template.filename and template.filepath != template.filename:
+            self._filenames[template.filepath] = template.filename
+
+    def _timed_template(self, template, stream):
+        self._register(template)
+        return self._timed('template', (template.filepath, -1, -1), '',
+                           stream)
+
+    def _timed(self, kind, pos, name, stream):
+        # Measure the time spent producing the events of the given stream,
+        # which does not include the time the consumer spends on the events
+        location = self._location(pos)
+        timer = self.timer
+        elapsed = 0
+        next = iter(stream).next
+        while 1:
+            start = timer()
+            try:
+                event = next()
+            except StopIteration:
+                elapsed += timer() - start
+                break
+            elapsed += timer() - start
+            yield event
+        self.add(kind, location, name, elapsed)
+
@@ -16,7 +16,7 @@ import unittest
 
 def suite():
     from genshi.template.tests import base, directives, eval, interpolation, \
-                                      loader, markup, plugin, text
+                                      loader, markup, plugin, profiling, text
     suite = unittest.TestSuite()
     suite.addTest(base.suite())
     suite.addTest(directives.suite())
@@ -25,6 +25,7 @@ def suite():
     suite.addTest(loader.suite())
     suite.addTest(markup.suite())
     suite.addTest(plugin.suite())
+    suite.addTest(profiling.suite())
     suite.addTest(text.suite())
     return suite
 
@@ -16,6 +16,7 @@ import re
 import sys
 import unittest
 
+from genshi.core import Markup
 from genshi.template import directives, MarkupTemplate, TextTemplate, \
                             TemplateRuntimeError, TemplateSyntaxError
 
@@ -406,6 +407,89 @@ class DefDirectiveTestCase(unittest.TestCase):
           </div>
         </doc>""", tmpl.generate().render(encoding=None))
 
+    def _counting_template(self, cache):
+        return MarkupTemplate("""<doc xmlns:py="http://genshi.edgewall.org/">
+          <py:def function="badge(name, title=None)" cache="%s"><b
+            title="$title">${count(name)}</b></py:def>
+          ${badge('a')}${badge('b')}${badge('a')}${badge(name='a')}
+          ${badge('a', title='A')}${badge(['a'])}${badge(['a'])}
+        </doc>""" % cache)
+
+    def test_function_cache(self):
+        """
+        Verify that the output of a cached function is only generated once per
+        combination of arguments, and reused across renderings.
+        """
+        calls = []
+        def count(name):
+            calls.append(name)
+            return len(calls)
+        tmpl = self._counting_template(10)
+        self.assertEqual("""<doc>
+          <b>1</b><b>2</b><b>1</b><b>3</b>
+          <b title="A">4</b><b>5</b><b>6</b>
+        </doc>""", tmpl.generate(count=count).render(encoding=None))
+        # Lists are not hashable, so those calls are never cached
+        self.assertEqual("""<doc>
+          <b>1</b><b>2</b><b>1</b><b>3</b>
+          <b title="A">4</b><b>7</b><b>8</b>
+        </doc>""", tmpl.generate(count=count).render(encoding=None))
+
+    def test_function_cache_per_render(self):
+        """
+        Verify that the output of a function cached only for the current
+        rendering is discarded afterwards.
+        """
+        calls = []
+        def count(name):
+            calls.append(name)
+            return len(calls)
+        tmpl = self._counting_template('render')
+        tmpl.generate(count=count).render(encoding=None)
+        self.assertEqual(6, len(calls))
+        tmpl.generate(count=count).render(encoding=None)
+        self.assertEqual(12, len(calls))
+
+    def test_function_cache_pickle(self):
+        """
+        Verify that templates with cached functions can be pickled.
+        """
+        import pickle
+        tmpl = self._counting_template(10)
+        tmpl.generate(count=len).render(encoding=None)
+        unpickled = pickle.loads(pickle.dumps(tmpl, 2))
+        self.assertEqual("""<doc>
+          <b>1</b><b>1</b><b>1</b><b>1</b>
+          <b title="A">1</b><b>1</b><b>1</b>
+        </doc>""", unpickled.generate(count=len).render(encoding=None))
+
+    def test_function_cache_argument_types(self):
+        """
+        Verify that calls with arguments that compare equal but have different
+        types, such as `Markup` and `unicode`, are cached separately.
+        """
+        tmpl = MarkupTemplate("""<doc xmlns:py="http://genshi.edgewall.org/">
+          <py:def function="show(v)" cache="10"><b>${v}</b></py:def>
+          ${show(a)}${show(b)}${show(1)}${show(True)}
+          ${show(v=a)}${show(v=b)}${show(v=1)}${show(v=True)}
+        </doc>""")
+        a = Markup('<i>x</i>')
+        b = u'<i>x</i>'
+        self.assertEqual("""<doc>
+          <b><i>x</i></b><b>&lt;i&gt;x&lt;/i&gt;</b><b>1</b><b>True</b>
+          <b><i>x</i></b><b>&lt;i&gt;x&lt;/i&gt;</b><b>1</b><b>True</b>
+        </doc>""", tmpl.generate(a=a, b=b).render(encoding=None))
+
+    def test_function_cache_invalid_size(self):
+        """
+        Verify that an invalid cache size is reported as a syntax error.
+        """
+        try:
+            self._counting_template('yes').generate()
+            self.fail('Expected TemplateSyntaxError')
+        except TemplateSyntaxError, e:
+            self.assertEqual(2, e.lineno)
+
 
 class ForDirectiveTestCase(unittest.TestCase):
     """Tests for the `py:for` template directive."""
@@ -475,6 +559,36 @@ class ForDirectiveTestCase(unittest.TestCase):
         </doc>""", tmpl.generate(items=enumerate(dict(a=1, b=2).items()))
                        .render(encoding=None))
 
+    def test_scope_per_loop(self):
+        """
+        Verify that the loop variables are only visible inside the loop, while
+        changes made by code in the loop body persist between iterations.
+        """
+        tmpl = MarkupTemplate("""<doc xmlns:py="http://genshi.edgewall.org/">
+          <py:for each="item in items">
+            <?python total = locals().get('total', 0) + item ?>
+            <p>$item: $total</p>
+          </py:for>
+          <p>${defined('item')}</p>
+        </doc>""")
+        self.assertEqual("""<doc>
+            <p>1: 1</p>
+            <p>2: 3</p>
+          <p>False</p>
+        </doc>""", tmpl.generate(items=[1, 2]).render(encoding=None))
+
+    def test_with_other_directives(self):
+        """
+        Verify that the remaining directives are applied on every iteration.
+        """
+        tmpl = MarkupTemplate("""<doc xmlns:py="http://genshi.edgewall.org/">
+          <p py:for="k, v in items" py:if="v" py:strip="k == 'b'">$k</p>
+        </doc>""")
+        self.assertEqual("""<doc>
+          <p>a</p>b
+        </doc>""", tmpl.generate(items=[('a', 1), ('b', 2), ('c', 0)])
+                       .render(encoding=None))
+
     def test_not_iterable(self):
         """
         Verify that assignment to nested tuples works correctly.
@@ -1005,6 +1119,113 @@ class MatchDirectiveTestCase(unittest.TestCase):
           </body>
         </html>""", tmpl.generate().render())
 
+    def _match_directives(self, tmpl):
+        tmpl.generate().render()
+        return [event[1][0][0] for event in tmpl.stream
+                if event[0] == 'SUB']
+
+    def test_streamed_content(self):
+        """
+        Verify that the matched content is only buffered when the match
+        template needs it.
+        """
+        tmpl = MarkupTemplate("""<doc xmlns:py="http://genshi.edgewall.org/">
+          <py:match path="a"><b title="A">${select('text()')}</b></py:match>
+          <py:match path="b"><b py:if="x">${select('text()')}</b></py:match>
+          <py:match path="c"><b>${select('@x')}${select('text()')}</b></py:match>
+          <py:match path="d"><b>${x}${select('text()')}</b></py:match>
+          <py:match path="e" buffer="true">${select('text()')}</py:match>
+          <py:match path="f">${select('text()')}<i py:if="x">$x</i></py:match>
+          <py:match path="g"><b py:for="i in range(2)">${select('.')}</b></py:match>
+          <py:match path="h">${[select(p) for p in 'ab']}</py:match>
+        </doc>""")
+        self.assertEqual([True, False, False, False, None, True, False, False],
+                         [d.streamable for d in self._match_directives(tmpl)])
+
+    def test_streamed_content_evaluation_order(self):
+        """
+        Verify that code in the matched content is still executed before the
+        match template if the match template depends on it.
+        """
+        tmpl = MarkupTemplate("""<doc xmlns:py="http://genshi.edgewall.org/">
+          <py:match path="greeting"><b>${name}: ${select('text()')}</b></py:match>
+          <greeting><?python name = 'Dude' ?>Hello</greeting>
+        </doc>""")
+        self.assertEqual("""<doc>
+          <b>Dude: Hello</b>
+        </doc>""", tmpl.generate(name='Nobody').render(encoding=None))
+
+    def test_streamed_content_not_iterated(self):
+        """
+        Verify that streamed content is consumed even if the match template
+        calls ``select()`` without iterating over the result.
+        """
+        tmpl = MarkupTemplate("""<html xmlns:py="http://genshi.edgewall.org/">
+          <py:match path="body"><body>${select('*') and 'x'}</body></py:match>
+          <body><p>a</p><p>b</p></body><div>after</div>
+        </html>""")
+        self.assertEqual("""<html>
+          <body>x</body><div>after</div>
+        </html>""", tmpl.generate().render(encoding=None))
+
+    def test_streamed_content_later_match(self):
+        """
+        Verify that match templates defined after a match template that
+        streams its content still apply to the rest of the document.
+        """
+        tmpl = MarkupTemplate("""<html xmlns:py="http://genshi.edgewall.org/">
+          <py:match path="body"><body>${select('*') and 'x'}</body></py:match>
+          <py:match path="em"><em/></py:match>
+          <body><p>a</p><p>b</p></body><em>z</em>
+        </html>""")
+        self.assertEqual("""<html>
+          <body>x</body><em/>
+        </html>""", tmpl.generate().render(encoding=None))
+
+    def test_streamed_content_defines_match(self):
+        """
+        Verify that matched content is buffered if it defines match templates,
+        which then also apply to the content before their definition.
+        """
+        tmpl = MarkupTemplate("""<html xmlns:py="http://genshi.edgewall.org/">
+          <py:match path="body"><body>${select('*')}</body></py:match>
+          <body><p>a</p><py:match path="p"><i>${select('text()')}</i></py:match><p>b</p></body>
+        </html>""")
+        collected = []
+        output = tmpl.generate().render(encoding=None,
+                                        metrics=collected.append)
+        self.assertEqual("""<html>
+          <body><i>a</i><i>b</i></body>
+        </html>""", output)
+        self.assertEqual(1, len(collected[0].buffer_peaks))
+
+    def test_streamed_content_not_buffered(self):
+        """
+        Verify that matched content that can be streamed is not buffered.
+        """
+        tmpl = MarkupTemplate("""<html xmlns:py="http://genshi.edgewall.org/">
+          <py:match path="body"><body>${select('*')}</body></py:match>
+          <body><p>a</p><p>b</p></body>
+        </html>""")
+        collected = []
+        output = tmpl.generate().render(encoding=None,
+                                        metrics=collected.append)
+        self.assertEqual("""<html>
+          <body><p>a</p><p>b</p></body>
+        </html>""", output)
+        self.assertEqual({}, collected[0].buffer_peaks)
+
+    def test_streamed_content_body_defines_match(self):
+        """
+        Verify that the content of a match template that defines match
+        templates itself is not streamed.
+        """
+        tmpl = MarkupTemplate("""<doc xmlns:py="http://genshi.edgewall.org/">
+          <py:match path="a"><b>${select('*')}<py:match path="p"><i/></py:match></b></py:match>
+        </doc>""")
+        self.assertEqual([False],
+                         [d.streamable for d in self._match_directives(tmpl)])
+
     # FIXME
     #def test_match_after_step(self):
     #    tmpl = MarkupTemplate("""<div xmlns:py="http://genshi.edgewall.org/">
@@ -21,7 +21,7 @@ import unittest
 from genshi.core import Markup
 from genshi.template.base import Context
 from genshi.template.eval import Expression, Suite, Undefined, UndefinedError, \
-                                 UNDEFINED
+                                 LenientLookup, UNDEFINED
 from genshi.compat import BytesIO, IS_PYTHON2, wrapped_bytes
 
 
@@ -37,6 +37,62 @@ class ExpressionTestCase(unittest.TestCase):
         self.assertEqual(hash(expr), hash(Expression('x,y')))
         self.assertNotEqual(hash(expr), hash(Expression('y, x')))
 
+    def test_shared_code(self):
+        expr1 = Expression('item.name', filename='a.html', lineno=3)
+        expr2 = Expression('item.name', filename='b.html', lineno=7)
+        assert expr1.ast is expr2.ast
+        self.assertEqual(expr1.code.co_code, expr2.code.co_code)
+        self.assertEqual(('a.html', 3), (expr1.code.co_filename,
+                                         expr1.code.co_firstlineno))
+        self.assertEqual(('b.html', 7), (expr2.code.co_filename,
+                                         expr2.code.co_firstlineno))
+        data = {'item': {'name': 'foo'}}
+        self.assertEqual('foo', expr2.evaluate(data))
+
+    def test_shared_code_lookup(self):
+        expr1 = Expression('nothing', lookup='lenient')
+        expr2 = Expression('nothing', lookup='strict')
+        assert isinstance(expr1.evaluate({}), Undefined)
+        self.assertRaises(UndefinedError, expr2.evaluate, {})
+
+    def test_shared_code_nested(self):
+        expr1 = Expression('[x for x in (lambda: items)()]', filename='a.html')
+        expr2 = Expression('[x for x in (lambda: items)()]', filename='b.html')
+        for expr, filename in [(expr1, 'a.html'), (expr2, 'b.html')]:
+            nested = [c for c in expr.code.co_consts if hasattr(c, 'co_code')]
+            self.assertEqual(1, len(nested))
+            self.assertEqual(filename, nested[0].co_filename)
+        self.assertEqual([1, 2], expr2.evaluate({'items': [1, 2]}))
+
+    def test_shared_globals(self):
+        expr1 = Expression('x', lookup='strict')
+        expr2 = Expression('y', lookup='strict')
+        self.assertEqual(id(expr1._shared_globals),
+                         id(expr2._shared_globals))
+        self.assertEqual(1, expr1.evaluate({'x': 1}))
+        self.assertEqual(2, expr1.evaluate({'x': 2}))
+        expr = Expression('list(y for y in x)')
+        self.assertEqual(None, expr._shared_globals)
+        self.assertEqual([1, 2], expr.evaluate({'x': [1, 2]}))
+
+    def test_shared_globals_not_modified(self):
+        expr = Expression("globals().setdefault('leak', x)")
+        self.assertEqual(None, expr._shared_globals)
+        self.assertEqual(1, expr.evaluate({'x': 1}))
+        self.assertEqual(2, expr.evaluate({'x': 2}))
+        self.assertEqual(False, 'leak' in Expression('x')._shared_globals)
+
+    def test_shared_globals_custom_lookup(self):
+        class MyLookup(LenientLookup):
+            @classmethod
+            def globals(cls, data):
+                _globals = LenientLookup.globals(data)
+                _globals['_lookup_name'] = lambda data, name: len(data)
+                return _globals
+        expr = Expression('answer', lookup=MyLookup)
+        self.assertEqual(None, expr._shared_globals)
+        self.assertEqual(2, expr.evaluate({'x': 1, 'y': 2}))
+
     def test_pickle(self):
         expr = Expression('1 < 2')
         buf = BytesIO()
@@ -20,9 +20,10 @@ import tempfile
 import unittest
 
 from genshi.compat import BytesIO, StringIO
-from genshi.core import Markup
+from genshi.core import Markup, START, TEXT
 from genshi.input import XML
-from genshi.template.base import BadDirectiveError, TemplateSyntaxError
+from genshi.template.base import BadDirectiveError, TemplateSyntaxError, \
+                                 EXPR, SUB
 from genshi.template.loader import TemplateLoader, TemplateNotFound
 from genshi.template.markup import MarkupTemplate
 
@@ -756,6 +757,45 @@ class MarkupTemplateTestCase(unittest.TestCase):
           </lines>
         </rhyme>""", tmpl.generate().render(encoding=None)) 
 
+    def test_constant_expressions(self):
+        tmpl = MarkupTemplate("""<p xmlns:py="http://genshi.edgewall.org/"
+          class="${'a' + 'b'} c" title="${None}">${3 - 2} ${x}
+          ${'&lt;' * 2}${None}${(1, 2)}</p>""")
+        kinds = [kind for kind, data, pos in tmpl.stream]
+        self.assertEqual([START, TEXT, TEXT, EXPR, TEXT, TEXT, EXPR], kinds[:7])
+        self.assertEqual(('class', 'ab c'), tmpl.stream[0][1][1][0])
+        self.assertEqual("""<p class="ab c">1 42
+          &lt;&lt;12</p>""", tmpl.generate(x=42).render(encoding=None))
+
+    def test_constant_if(self):
+        tmpl = MarkupTemplate("""<div xmlns:py="http://genshi.edgewall.org/">
+          <p py:if="True">on</p><p py:if="1 > 2">off</p>
+          <p py:if="0" py:content="undefined_name">off</p>
+          <p py:for="x in items" py:if="False">${x}</p>
+          <p py:if="x">${x}</p>
+        </div>""")
+        self.assertEqual(2, len([e for e in tmpl.stream if e[0] is SUB]))
+        self.assertEqual("""<div>
+          <p>on</p>
+          <p>1</p>
+        </div>""", tmpl.generate(x=1, items=[1]).render(encoding=None))
+
+    def test_constant_errors_at_runtime(self):
+        tmpl = MarkupTemplate("""<p xmlns:py="http://genshi.edgewall.org/"
+          py:if="False">${1 / 0}</p>""")
+        self.assertEqual('', tmpl.generate().render(encoding=None))
+        tmpl = MarkupTemplate('<p>${1 / 0}</p>')
+        self.assertRaises(ZeroDivisionError, tmpl.generate().render)
+
+    def test_constant_not_folded_with_custom_directives(self):
+        from genshi.filters.i18n import Translator
+        tmpl = MarkupTemplate("""<p xmlns:py="http://genshi.edgewall.org/"
+          title="${'Save'}">${'Save'}</p>""")
+        Translator(lambda s: s.upper()).setup(tmpl)
+        self.assert_(EXPR in [kind for kind, data, pos in tmpl.stream])
+        self.assertEqual('<p title="Save">Save</p>',
+                         tmpl.generate().render(encoding=None))
+
 
 def suite():
     suite = unittest.TestSuite()
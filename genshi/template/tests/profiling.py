@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2010 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://genshi.edgewall.org/wiki/License.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://genshi.edgewall.org/log/.
+
+import doctest
+import os
+import shutil
+import tempfile
+import unittest
+
+from genshi.template.base import Context
+from genshi.template.loader import TemplateLoader
+from genshi.template.markup import MarkupTemplate
+from genshi.template.profiling import Profiler, json
+from genshi.template.text import NewTextTemplate
+
+
+class ProfilerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp(suffix='profiling_test')
+        self._write('layout.html', """<html
+            xmlns:py="http://genshi.edgewall.org/" py:strip="">
+          <py:match path="body" once="true"><body>
+            <div>${select('*')}</div>
+          </body></py:match>
+        </html>""")
+        self._write('footer.html', """<p>Footer</p>""")
+        self._write('index.html', """<html
+            xmlns:py="http://genshi.edgewall.org/"
+            xmlns:xi="http://www.w3.org/2001/XInclude">
+          <xi:include href="layout.html" />
+          <body>
+            <p py:for="item in items" py:if="item">${item}</p>
+            <xi:include href="${footer}" />
+          </body>
+        </html>""")
+
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+
+    def _write(self, filename, text):
+        fileobj = open(os.path.join(self.dirname, filename), 'w')
+        try:
+            fileobj.write(text)
+        finally:
+            fileobj.close()
+
+    def _render(self, profiler):
+        loader = TemplateLoader([self.dirname], profile=profiler)
+        tmpl = loader.load('index.html')
+        return tmpl.generate(items=[1, 0, 2], footer='footer.html') \
+                   .render(encoding=None)
+
+    def test_loader(self):
+        profiler = Profiler()
+        self._render(profiler)
+        stats = dict([((kind, location, name), calls) for kind, location,
+                      name, calls, total in profiler.stats()])
+        self.assertEqual(1, stats[('template', 'index.html', '')])
+        self.assertEqual(1, stats[('template', 'footer.html', '')])
+        self.assertEqual(1, stats[('include', 'index.html:7', 'footer.html')])
+        self.assertEqual(1, stats[('match', 'layout.html:3', 'body')])
+        self.assertEqual(1, stats[('directive', 'index.html:6',
+                                   '<ForDirective> <IfDirective "item">')])
+        # Three evaluations by py:if, two by the ${item} expression
+        self.assertEqual(5, stats[('expression', 'index.html:6', 'item')])
+        self.assertEqual(1, stats[('expression', 'index.html:6',
+                                   'iter(items)')])
+        self.assertEqual(1, stats[('expression', 'layout.html:4',
+                                   "select('*')")])
+
+    def test_aggregation(self):
+        profiler = Profiler()
+        self._render(profiler)
+        self._render(profiler)
+        for kind, location, name, calls, total in profiler.stats():
+            if kind == 'expression' and name == 'item':
+                self.assertEqual(10, calls)
+                break
+        else:
+            self.fail('No statistics for the expression')
+        profiler.clear()
+        self.assertEqual([], profiler.stats())
+
+    def test_output_unchanged(self):
+        self.assertEqual(self._render(None), self._render(Profiler()))
+
+    def test_sample_rate(self):
+        profiler = Profiler(sample_rate=0)
+        self._render(profiler)
+        self.assertEqual([], profiler.stats())
+
+    def test_report(self):
+        profiler = Profiler()
+        self._render(profiler)
+        lines = profiler.report(limit=3).splitlines()
+        self.assertEqual(4, len(lines))
+        self.assertEqual(['kind', 'calls', 'total', '(ms)', 'per', 'call',
+                          'location'], lines[0].split())
+        # The template being rendered always takes the most time
+        self.assertEqual('template', lines[1].split()[0])
+
+    def test_sort_by_calls(self):
+        profiler = Profiler()
+        self._render(profiler)
+        calls = [stat[3] for stat in profiler.stats('calls')]
+        self.assertEqual(5, calls[0])
+        self.assertEqual(sorted(calls, reverse=True), calls)
+
+    if json:
+        def test_to_json(self):
+            profiler = Profiler()
+            self._render(profiler)
+            data = json.loads(profiler.to_json())
+            self.assertEqual(len(profiler.stats()), len(data))
+            self.assertEqual(['calls', 'kind', 'location', 'name', 'time'],
+                             sorted(data[0].keys()))
+
+    def test_text_template(self):
+        profiler = Profiler()
+        tmpl = NewTextTemplate('{% for item in items %}${item}{% end %}',
+                               filename='list.txt')
+        tmpl.profile = profiler
+        self.assertEqual('12', tmpl.render(dict(items=[1, 2])))
+        kinds = [stat[0] for stat in profiler.stats('location')]
+        self.assertEqual(['template', 'directive', 'expression',
+                          'expression'], kinds)
+
+    def test_sample_rate_reused_context(self):
+        samples = []
+        def sample():
+            samples.append(len(samples) % 2 == 0)
+            return samples[-1]
+        profiler = Profiler()
+        profiler.sample = sample
+        tmpl = MarkupTemplate('<p>${x}</p>', filename='p.html')
+        tmpl.profile = profiler
+        ctxt = Context(x=1)
+        for idx in range(4):
+            self.assertEqual('<p>1</p>', tmpl.generate(ctxt).render())
+        self.assertEqual([True, False, True, False], samples)
+        stats = dict([((kind, name), calls) for kind, location, name, calls,
+                      total in profiler.stats()])
+        self.assertEqual(2, stats[('template', '')])
+        self.assertEqual(2, stats[('expression', 'x')])
+
+    def test_aborted_rendering(self):
+        profiler = Profiler()
+        tmpl = MarkupTemplate('<p>${x}</p>', filename='p.html')
+        tmpl.profile = profiler
+        ctxt = Context(x=1)
+        stream = iter(tmpl.generate(ctxt))
+        stream.next()
+        self.assertEqual(profiler, ctxt._profile)
+        stream.close()
+        self.assertEqual(None, ctxt._profile)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(doctest.DocTestSuite(Profiler.__module__))
+    suite.addTest(unittest.makeSuite(ProfilerTestCase, 'test'))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
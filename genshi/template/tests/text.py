@@ -17,7 +17,9 @@ import shutil
 import tempfile
 import unittest
 
-from genshi.template.base import TemplateSyntaxError
+from genshi.builder import tag
+from genshi.core import TEXT
+from genshi.template.base import Context, TemplateSyntaxError
 from genshi.template.loader import TemplateLoader
 from genshi.template.text import OldTextTemplate, NewTextTemplate
 
@@ -115,6 +117,13 @@ Included
             ----- Included data above this line -----""",
                          tmpl.generate().render(encoding=None))
 
+    def test_render(self):
+        tmpl = OldTextTemplate("""#for item in items
+ * $item
+#end
+""")
+        self.assertEqual(' * 1\n * 2\n', tmpl.render({'items': [1, 2]}))
+
 
 class NewTextTemplateTestCase(unittest.TestCase):
     """Tests for text template processing."""
@@ -262,6 +271,70 @@ Included
     ----- Included data above this line -----""",
                           tmpl.generate().render(encoding=None))
 
+    def _assert_render(self, tmpl, **data):
+        expected = tmpl.generate(**data).render(encoding=None)
+        self.assertEqual(expected, tmpl.render(data))
+        self.assertEqual(expected, tmpl.render(Context(**data)))
+        self.assertEqual(expected.encode('utf-8'),
+                         tmpl.render(data, encoding='utf-8'))
+        return expected
+
+    def test_render(self):
+        tmpl = NewTextTemplate(u"""Dear ${name},
+{% def greeting(who) %}Hi, ${who}!{% end %}\
+${greeting('all')}
+{% for item in items %}\
+{% if item % 2 %} * ${item}: ${'%.1f' % (item / 2.0)} ${item * 2}
+{% end %}\
+{% end %}\
+{% with total=sum(items) %}Total: ${total}{% end %}
+${elem} ${none}${text}""", allow_exec=True)
+        self.assertEqual(u"""Dear J\xf6e,
+Hi, all!
+ * 1: 0.5 2
+ * 3: 1.5 6
+Total: 6
+bold <&>""", self._assert_render(tmpl, name=u'J\xf6e',
+                                       items=[1, 2, 3],
+                                       elem=tag.b('bold'), none=None,
+                                       text='<&>'))
+
+    def test_render_exec(self):
+        tmpl = NewTextTemplate("""{% python
+        def foo():
+            return [1, 2]
+        %}${foo()} ${x}""", allow_exec=True)
+        self.assertEqual('12 42', self._assert_render(tmpl, x=42))
+
+    def test_render_include(self):
+        file1 = open(os.path.join(self.dirname, 'tmpl1.txt'), 'w')
+        try:
+            file1.write("Included ${x}")
+        finally:
+            file1.close()
+
+        file2 = open(os.path.join(self.dirname, 'tmpl2.txt'), 'w')
+        try:
+            file2.write("""{% include tmpl1.txt %}
+{% include ${'%s.txt' % ('tmpl1',)} %}""")
+        finally:
+            file2.close()
+
+        loader = TemplateLoader([self.dirname])
+        tmpl = loader.load('tmpl2.txt', cls=NewTextTemplate)
+        self.assertEqual('Included 1\nIncluded 1',
+                         self._assert_render(tmpl, x=1))
+
+    def test_render_with_filters(self):
+        def upper(stream, ctxt=None):
+            for kind, data, pos in stream:
+                if kind is TEXT:
+                    data = data.upper()
+                yield kind, data, pos
+        tmpl = NewTextTemplate('Hello, ${name}!')
+        tmpl.filters.append(upper)
+        self.assertEqual('HELLO, JOE!', tmpl.render({'name': 'joe'}))
+
 
 def suite():
     suite = unittest.TestSuite()
@@ -28,19 +28,139 @@ new syntax to remain compatible with future Genshi releases.
 
 import re
 
-from genshi.core import TEXT
-from genshi.template.base import BadDirectiveError, Template, \
-                                 TemplateSyntaxError, EXEC, INCLUDE, SUB
+from genshi.core import TEXT, _ensure
+from genshi.template.base import BadDirectiveError, Context, Template, \
+                                 TemplateSyntaxError, EXEC, EXPR, INCLUDE, \
+                                 SUB, _apply_directives, _eval_expr, \
+                                 _exec_suite
 from genshi.template.eval import Suite
 from genshi.template.directives import *
 from genshi.template.directives import Directive
 from genshi.template.interpolation import interpolate
 
-__all__ = ['NewTextTemplate', 'OldTextTemplate', 'TextTemplate']
+__all__ = ['NewTextTemplate', 'OldTextTemplate', 'TextTemplate',
+           'TextTemplateBase']
 __docformat__ = 'restructuredtext en'
 
 
-class NewTextTemplate(Template):
+class TextTemplateBase(Template):
+    """Base class for the text-based template engines, implementing rendering
+    of text templates directly to a string.
+    
+    :since: version 0.7
+    """
+
+    def render(self, data=None, encoding=None):
+        """Apply the template to the given context data and return the output.
+        
+        >>> tmpl = NewTextTemplate('Hello, ${name}!')
+        >>> print(tmpl.render({'name': 'world'}))
+        Hello, world!
+        
+        The result is the same as that of calling ``generate()`` and rendering
+        the stream it returns, but the output is collected directly into a
+        list of strings, without passing events through the template filters
+        and the text serializer. If filters have been added to the template,
+        for example by the `Translator`, or if the template is being
+        profiled, this method falls back to rendering the stream.
+        
+        :param data: a dictionary of context data, or a `Context` instance
+        :param encoding: how the output string should be encoded; if set to
+                         `None`, this method returns a `unicode` object
+        :return: a `str` or `unicode` object (depending on the `encoding`
+                 parameter)
+        """
+        if isinstance(data, Context):
+            ctxt = data
+        else:
+            ctxt = Context(**(data or {}))
+        if self._renders_directly():
+            parts = []
+            self._render(self.stream, ctxt, {}, parts.append)
+            output = u''.join(parts)
+        else:
+            output = self.generate(ctxt).render(encoding=None)
+        if encoding is not None:
+            return output.encode(encoding, 'replace')
+        return output
+
+    def _renders_directly(self):
+        filters = self.filters
+        return self.profile is None and len(filters) == 2 and \
+               filters[0] == self._flatten and filters[1] == self._include
+
+    def _render(self, stream, ctxt, vars, append):
+        # Equivalent of the `_flatten` and `_include` filters followed by the
+        # text serializer, passing the text of each event to `append`
+        number_conv = self._number_conv
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        stream = iter(stream)
+
+        while 1:
+            for kind, data, pos in stream:
+
+                if kind is TEXT:
+                    append(data)
+
+                elif kind is EXPR:
+                    result = _eval_expr(data, ctxt, vars)
+                    if result is not None:
+                        if isinstance(result, basestring):
+                            append(result)
+                        elif isinstance(result, (int, float, long)):
+                            append(number_conv(result))
+                        elif hasattr(result, '__iter__'):
+                            push(stream)
+                            stream = _ensure(result)
+                            break
+                        else:
+                            append(unicode(result))
+
+                elif kind is SUB:
+                    push(stream)
+                    stream = _apply_directives(data[1], data[0], ctxt, vars)
+                    break
+
+                elif kind is EXEC:
+                    _exec_suite(data, ctxt, vars)
+
+                elif kind is INCLUDE:
+                    self._render_include(data, pos, ctxt, vars, append)
+
+            else:
+                if not stack:
+                    break
+                stream = pop()
+
+    def _render_include(self, data, pos, ctxt, vars, append):
+        from genshi.template.loader import TemplateNotFound
+
+        href, cls, fallback = data
+        if not isinstance(href, basestring):
+            parts = []
+            for subkind, subdata, subpos in self._flatten(href, ctxt, **vars):
+                if subkind is TEXT:
+                    parts.append(subdata)
+            href = ''.join([x for x in parts if x is not None])
+        try:
+            tmpl = self.loader.load(href, relative_to=pos[0],
+                                    cls=cls or self.__class__)
+            if isinstance(tmpl, TextTemplateBase) and \
+                    tmpl._renders_directly():
+                tmpl._render(tmpl.stream, ctxt, vars, append)
+            else:
+                for kind, data, pos in tmpl.generate(ctxt, **vars):
+                    if kind is TEXT:
+                        append(data)
+        except TemplateNotFound:
+            if fallback is None:
+                raise
+            self._render(fallback, ctxt, vars, append)
+
+
+class NewTextTemplate(TextTemplateBase):
     r"""Implementation of a simple text-based template engine. This class will
     replace `OldTextTemplate` in a future release.
     
@@ -234,7 +354,7 @@ class NewTextTemplate(Template):
         return stream
 
 
-class OldTextTemplate(Template):
+class OldTextTemplate(TextTemplateBase):
     """Legacy implementation of the old syntax text-based templates. This class
     is provided in a transition phase for backwards compatibility. New code
     should use the `NewTextTemplate` class and the improved syntax it provides.
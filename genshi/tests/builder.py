@@ -14,7 +14,8 @@
 import doctest
 import unittest
 
-from genshi.builder import Element, tag
+from genshi.builder import Element, Fragment, tag
+from genshi.compat import StringIO
 from genshi.core import Attrs, Markup, Stream
 from genshi.input import XML
 
@@ -63,11 +64,112 @@ class ElementFactoryTestCase(unittest.TestCase):
         self.assertEqual(m, Markup('See <a href="http://genshi.edgwall.org">'
                                    'genshi</a>'))
 
+    def test_deep_nesting(self):
+        elem = inner = tag.div()
+        for i in range(5000):
+            child = tag.div()
+            inner(child)
+            inner = child
+        events = list(elem.generate())
+        self.assertEqual(10002, len(events))
+        self.assertEqual(u'<div>' * 5001 + u'</div>' * 5001,
+                         elem.render('html'))
+
+
+class RenderTestCase(unittest.TestCase):
+
+    def _assert_render(self, node):
+        for method in ('xml', 'xhtml', 'html'):
+            expected = node.generate().render(method, encoding=None)
+            output = node.render(method)
+            self.assertEqual(expected, output)
+            self.assertEqual(Markup, type(output))
+
+    def test_render(self):
+        self._assert_render(tag.p('Hello ', tag.em('world', class_='x'), '!'))
+        self._assert_render(tag.form(tag.input(type='checkbox', checked='on'),
+                                     tag.select(tag.option('1 < 2',
+                                                           selected=''))))
+        self._assert_render(tag.div(tag.br, tag.hr, tag.textarea, tag.p))
+
+    def test_render_whitespace(self):
+        self._assert_render(tag.div('a  \n\n\n', tag.pre(' b  \n\n\nc  '),
+                                    ' d \t\n', '\n\ne'))
+        self._assert_render(tag.textarea('a  \n\n', tag.b('  \n\n'), ' \n'))
+
+    def test_render_noescape(self):
+        self._assert_render(tag.div(tag.script('a < b && c'), 'a < b',
+                                    tag.style('p > a {}')))
+        self.assertEqual('<script>a < b && c</script>',
+                         tag.script('a < b && c').render('html'))
+
+    def test_render_fragment(self):
+        self._assert_render(tag('Hello, ', tag.em('world'), 42, None, '!'))
+        self._assert_render(Fragment())
+
+    def test_render_stream_child(self):
+        self._assert_render(tag.span(XML('<b>Foo</b>'), 'bar'))
+
+    def test_render_namespaced(self):
+        xhtml = tag['http://www.w3.org/1999/xhtml']
+        self._assert_render(xhtml.html(xhtml.body(lang='en')))
+        self._assert_render(tag.p(tag.span(**{'xml:lang': 'en'})))
+
+    def test_render_encoding(self):
+        elem = tag.p(u'caf\xe9')
+        self.assertEqual('<p>caf\xc3\xa9</p>', elem.render(encoding='utf-8'))
+        self.assertEqual('<p>caf&#233;</p>', elem.render(encoding='ascii'))
+        self.assertEqual(u'caf\xe9', elem.render('text'))
+
+    def test_render_serializer_options(self):
+        elem = tag.html(tag.body(tag.pre('a\n\n\n\nb')))
+        output = elem.render('html', doctype='html5')
+        self.assertEqual('<!DOCTYPE html>\n<html><body><pre>a\n\n\n\nb'
+                         '</pre></body></html>', output)
+        self.assertEqual(Markup, type(output))
+        elem = tag.div('a\n\n\n\nb')
+        self.assertEqual('<div>a\nb</div>', elem.render())
+        self.assertEqual('<div>a\n\n\n\nb</div>',
+                         elem.render(strip_whitespace=False))
+        self.assertEqual('<!DOCTYPE html>\n<html></html>',
+                         tag.html().render('html', encoding='utf-8',
+                                           doctype='html5'))
+
+    def test_render_out(self):
+        out = StringIO()
+        self.assertEqual(None, tag.p(u'caf\xe9').render(out=out))
+        self.assertEqual(u'<p>caf\xe9</p>', out.getvalue())
+        out = StringIO()
+        tag.br.render('html', encoding='utf-8', out=out, doctype='html5')
+        self.assertEqual('<!DOCTYPE html>\n<br>', out.getvalue())
+
+    def test_render_subclass(self):
+        class Upper(Element):
+            __slots__ = []
+            def _generate(self):
+                for kind, data, pos in Element._generate(self):
+                    if kind is Stream.TEXT:
+                        data = data.upper()
+                    yield kind, data, pos
+        elem = tag.div(Upper('b')('bold'), Upper('i')(tag.em('it')))
+        self.assertEqual('<div><b>BOLD</b><i><em>IT</em></i></div>',
+                         elem.render())
+        self.assertEqual('<b>BOLD</b>', Upper('b')('bold').render('html'))
+
+    def test_render_cached_start_tag(self):
+        cells = tag.tr([tag.td(str(i), class_='cell') for i in range(3)])
+        self.assertEqual('<tr><td class="cell">0</td><td class="cell">1</td>'
+                         '<td class="cell">2</td></tr>', cells.render())
+        cells.children[1](class_='other')
+        self.assertEqual('<tr><td class="cell">0</td><td class="other">1</td>'
+                         '<td class="cell">2</td></tr>', cells.render())
+
 
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(doctest.DocTestSuite(Element.__module__))
     suite.addTest(unittest.makeSuite(ElementFactoryTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(RenderTestCase, 'test'))
     return suite
 
 
@@ -12,11 +12,15 @@
 # history and logs, available at http://genshi.edgewall.org/log/.
 
 import doctest
+import os
+import shutil
 import sys
+import tempfile
 import unittest
 
-from genshi.core import Attrs, Stream
-from genshi.input import XMLParser, HTMLParser, ParseError
+from genshi.core import Attrs, QName, Stream
+from genshi.input import XMLParser, HTMLParser, ParseError, LXMLParser, \
+                         lxml_etree
 from genshi.compat import StringIO, BytesIO
 
 
@@ -50,6 +54,94 @@ bar</elem>'''
         self.assertEqual(('id', 'foo'), attrib[1])
         self.assertEqual(('class', 'bar'), attrib[2])
 
+    def test_bufsize_bounds_batches(self):
+        text = '<root>%s</root>' % ('<item>Foo</item>' * 100)
+        parser = XMLParser(StringIO(text), bufsize=32)
+        stream = iter(parser.parse())
+        stream.next()
+        self.assert_(len(parser._queue) < 10)
+        self.assertEqual(302, len(list(stream)) + 1)
+
+    def test_fromfile(self):
+        dirname = tempfile.mkdtemp(suffix='genshi_test')
+        try:
+            path = os.path.join(dirname, 'doc.xml')
+            fileobj = open(path, 'wb')
+            try:
+                fileobj.write(u'<root><item>Foo \u2013</item>'
+                              u'<item>Bar</item></root>'.encode('utf-8'))
+            finally:
+                fileobj.close()
+            parser = XMLParser.fromfile(path, bufsize=8)
+            self.assertEqual(8, parser.bufsize)
+            self.assertEqual(u'Foo \u2013Bar',
+                             parser.parse().select('item/text()').render(
+                                 encoding=None))
+            self.assertRaises(ValueError, parser.source.read, 1)
+            kind, data, pos = list(XMLParser.fromfile(path))[1]
+            self.assertEqual((path, 1, 6), pos)
+        finally:
+            shutil.rmtree(dirname)
+
+    def test_fromfile_empty(self):
+        dirname = tempfile.mkdtemp(suffix='genshi_test')
+        try:
+            path = os.path.join(dirname, 'empty.xml')
+            open(path, 'wb').close()
+            self.assertRaises(ParseError, list, XMLParser.fromfile(path))
+        finally:
+            shutil.rmtree(dirname)
+
+    def test_fromfile_parse_error(self):
+        dirname = tempfile.mkdtemp(suffix='genshi_test')
+        try:
+            path = os.path.join(dirname, 'broken.xml')
+            fileobj = open(path, 'wb')
+            try:
+                fileobj.write('<root><item>Foo</root>')
+            finally:
+                fileobj.close()
+            parser = XMLParser.fromfile(path, bufsize=8)
+            self.assertRaises(ParseError, list, parser)
+            self.assertRaises(ValueError, parser.source.read, 1)
+
+            parser = XMLParser.fromfile(path, bufsize=8)
+            stream = iter(parser.parse())
+            stream.next()
+            stream.close()
+            self.assertRaises(ValueError, parser.source.read, 1)
+        finally:
+            shutil.rmtree(dirname)
+
+    def test_feed_bytewise(self):
+        text = u'<?xml version="1.0"?>\n<root id="2"><!-- c -->' \
+               u'<child>Foo \u2013 &amp; bar</child><![CDATA[x]]></root>'
+        expected = list(XMLParser(StringIO(text)))
+        data = text.encode('utf-8')
+        parser = XMLParser(None)
+        events = []
+        for idx in range(len(data)):
+            events.extend(parser.feed(data[idx:idx + 1]))
+        events.extend(parser.close())
+        self.assertEqual([e[:2] for e in expected], [e[:2] for e in events])
+
+    def test_feed_holds_back_text(self):
+        parser = XMLParser(None)
+        self.assertEqual(1, len(parser.feed('<root>Foo')))
+        events = parser.feed('bar<br/>')
+        self.assertEqual((Stream.TEXT, 'Foobar'), events[0][:2])
+        self.assertEqual(3, len(events))
+
+    def test_feed_error(self):
+        parser = XMLParser(None)
+        parser.feed('<root>')
+        self.assertRaises(ParseError, parser.feed, '</boot>')
+
+    def test_close_error(self):
+        parser = XMLParser(None)
+        parser.feed('<root>')
+        self.assertRaises(ParseError, parser.close)
+
     def test_unicode_input(self):
         text = u'<div>\u2013</div>'
         events = list(XMLParser(StringIO(text)))
@@ -245,6 +337,89 @@ bar</elem>'''
         self.assertEqual((Stream.END, 'b'), events[3][:2])
         self.assertEqual((Stream.END, 'span'), events[4][:2])
 
+    def test_feed_bytewise(self):
+        text = u'<div class="x"><p>Foo \u2013 &amp; &#x27;bar<br>baz' \
+               u'<!-- c --></div><ul><li>1'
+        expected = list(HTMLParser(StringIO(text)))
+        data = text.encode('utf-8')
+        parser = HTMLParser(None, encoding='utf-8')
+        events = []
+        for idx in range(len(data)):
+            events.extend(parser.feed(data[idx:idx + 1]))
+        events.extend(parser.close())
+        self.assertEqual([e[:2] for e in expected], [e[:2] for e in events])
+
+    def test_feed_unicode(self):
+        parser = HTMLParser(None)
+        events = parser.feed(u'<p>Foo</p>') + parser.close()
+        self.assertEqual(3, len(events))
+        self.assertEqual(Stream.END, events[-1][0])
+
+    def test_feed_bytes_without_encoding(self):
+        parser = HTMLParser(None)
+        self.assertRaises(UnicodeError, parser.feed, '<p>Foo</p>')
+
+    def test_script_content(self):
+        text = u'<script>if (a < b && c) { x = "</p>"; }</SCRIPT >x'
+        events = list(HTMLParser(StringIO(text)))
+        self.assertEqual((Stream.TEXT, u'if (a < b && c) { x = "</p>"; }'),
+                         events[1][:2])
+        self.assertEqual((Stream.END, 'script'), events[2][:2])
+        self.assertEqual((Stream.TEXT, u'x'), events[3][:2])
+
+    def test_script_content_fed_in_chunks(self):
+        parser = HTMLParser(None)
+        events = parser.feed(u'<style>p > a {} </st') + parser.feed(u'yle>')
+        events += parser.feed(u'x') + parser.close()
+        self.assertEqual([(Stream.START, ('style', ())),
+                          (Stream.TEXT, u'p > a {} '),
+                          (Stream.END, 'style'),
+                          (Stream.TEXT, u'x')], [e[:2] for e in events])
+
+    def test_quoted_gt_in_attribute(self):
+        text = u'<a title="1 > 0" href=\'/?a=1&amp;b=2\'>x</a>'
+        events = list(HTMLParser(StringIO(text)))
+        self.assertEqual(Attrs([('title', u'1 > 0'), ('href', u'/?a=1&b=2')]),
+                         events[0][1][1])
+
+    def test_unusual_attribute_spacing(self):
+        text = u'<a title="x"href="y" >z</a>'
+        events = list(HTMLParser(StringIO(text)))
+        self.assertEqual(Attrs([('title', u'x'), ('href', u'y')]),
+                         events[0][1][1])
+
+    def test_self_closing_tag(self):
+        events = list(HTMLParser(StringIO(u'<div/>x')))
+        self.assertEqual([(Stream.START, ('div', ())), (Stream.END, 'div'),
+                          (Stream.TEXT, 'x')], [e[:2] for e in events])
+
+    def test_malformed_start_tag(self):
+        self.assertRaises(ParseError, list,
+                          HTMLParser(StringIO(u'<p>\n<div&x>foo</div>')))
+        try:
+            list(HTMLParser(StringIO(u'<p>\n <div&x>foo</div>')))
+        except ParseError, e:
+            self.assertEqual((2, 1), (e.lineno, e.offset))
+
+    def test_less_than_in_text(self):
+        events = list(HTMLParser(StringIO(u'<p>a < b <3 & c</p>')))
+        self.assertEqual((Stream.TEXT, u'a < b <3 & c'), events[1][:2])
+
+    def test_ignored_markup_coalesces_text(self):
+        text = u'a<!DOCTYPE html>b</br>c<![CDATA[x]]>d'
+        events = list(HTMLParser(StringIO(text)))
+        self.assertEqual([(Stream.TEXT, u'abcd')], [e[:2] for e in events])
+
+    def test_positions(self):
+        text = u'<div>\n  <p class="x">foo\n</p> <b>bar</b></div>'
+        events = list(HTMLParser(StringIO(text), filename='test.html'))
+        self.assertEqual([('test.html', 1, 0), ('test.html', 1, 5),
+                          ('test.html', 2, 2), ('test.html', 2, 15),
+                          ('test.html', 3, 0), ('test.html', 3, 4),
+                          ('test.html', 3, 5), ('test.html', 3, 8),
+                          ('test.html', 3, 11), ('test.html', 3, 15)],
+                         [e[2] for e in events])
+
     def test_hex_charref(self):
         text = u'<span>&#x27;</span>'
         events = list(HTMLParser(StringIO(text)))
@@ -254,11 +429,118 @@ bar</elem>'''
         self.assertEqual((Stream.END, 'span'), events[2][:2])
 
 
+class LXMLParserTestCase(unittest.TestCase):
+
+    CORPUS = [
+        u'<root id="2"><child>Foo</child></root>',
+        u'<root xmlns="urn:a" xmlns:x="urn:x" x:a="1" b="2"><x:e>F</x:e>'
+        u'<e xmlns:y="urn:y"/></root>',
+        u'<root>\n  <a title="x &amp; y">1 &lt; 2</a>\n  <!-- note -->\n'
+        u'  <?php echo 1 ?>tail\n</root>',
+        u'<root><a><b><c>deep</c></b></a>–<d/></root><!-- after -->',
+        u'<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Strict//EN" '
+        u'"http://www.w3.org/TR/xhtml1/DTD/xhtml1-strict.dtd">\n'
+        u'<html xmlns="http://www.w3.org/1999/xhtml"><p>Foo</p></html>',
+        u'<?xml version="1.0" encoding="utf-8" standalone="yes"?>\n'
+        u'<!-- prolog --><?xml-stylesheet href="a.css"?><root a="1\n\t2">'
+        u'x\r\ny</root>',
+        u'﻿<?xml version=\'1.0\' standalone=\'no\' ?><root/>',
+    ]
+
+    # Input that libxml2 does not parse the same way as Expat
+    FALLBACK_CORPUS = [
+        u'<root>a<![CDATA[x < y]]>b</root>',
+        u'<root>&nbsp;&#8212;</root>',
+        u'<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Strict//EN" '
+        u'"http://www.w3.org/TR/xhtml1/DTD/xhtml1-strict.dtd">\n'
+        u'<html><p>&nbsp;</p></html>',
+        u'<!DOCTYPE root [<!ATTLIST root a CDATA "1">]><root/>',
+        u'<!-- prolog --><!DOCTYPE root><root/>',
+    ]
+
+    def _events(self, parser):
+        return [event[:2] for event in parser]
+
+    def test_parity(self):
+        for text in self.CORPUS:
+            data = text.encode('utf-8')
+            for bufsize in (1, 7, None):
+                self.assertEqual(
+                    self._events(XMLParser(BytesIO(data))),
+                    self._events(LXMLParser(BytesIO(data), bufsize=bufsize)))
+
+    def test_parity_fallback(self):
+        for text in self.FALLBACK_CORPUS:
+            data = text.encode('utf-8')
+            expected = list(XMLParser(BytesIO(data)))
+            # Positions are exact as well if XMLParser takes over before any
+            # events have been returned
+            self.assertEqual(expected, list(LXMLParser(BytesIO(data))))
+            for bufsize in (1, 7):
+                self.assertEqual(
+                    self._events(expected),
+                    self._events(LXMLParser(BytesIO(data), bufsize=bufsize)))
+
+    def test_parity_utf16(self):
+        data = self.CORPUS[3].encode('utf-16')
+        self.assertEqual(list(XMLParser(BytesIO(data))),
+                         list(LXMLParser(BytesIO(data))))
+
+    def test_parity_parse_error(self):
+        for text in (u'<root><a></root>', u'', u'<root>&foo;</root>',
+                     u'<?xml version="1.0"?><root>'):
+            try:
+                list(XMLParser(StringIO(text)))
+                self.fail('Expected ParseError')
+            except ParseError, e:
+                expected = e
+            try:
+                list(LXMLParser(StringIO(text)))
+                self.fail('Expected ParseError')
+            except ParseError, e:
+                self.assertEqual(str(expected), str(e))
+                self.assertEqual(expected.lineno, e.lineno)
+                self.assertEqual(expected.offset, e.offset)
+
+    def test_fallback_after_events(self):
+        chunks = ['<root><a>1</a>', '<b>2</b>', 'x<![CDAT', 'A[3]]></root>']
+        parser = XMLParser(None)
+        expected = []
+        for chunk in chunks:
+            expected += parser.feed(chunk)
+        expected += parser.close()
+        parser = LXMLParser(None)
+        events = parser.feed(chunks[0]) + parser.feed(chunks[1])
+        self.assertEqual(self._events(expected[:len(events)]),
+                         self._events(events))
+        for chunk in chunks[2:]:
+            events += parser.feed(chunk)
+        events += parser.close()
+        self.assertEqual(self._events(expected), self._events(events))
+
+    def test_start_position(self):
+        text = u'<root>\n<child a="1"/>\n  <!-- c --></root>'
+        expected = [(kind, event_pos[1]) for kind, data, event_pos
+                    in XMLParser(StringIO(text))
+                    if kind in (Stream.START, Stream.COMMENT)]
+        self.assertEqual(expected, [(kind, event_pos[1]) for kind, data,
+                                    event_pos in LXMLParser(StringIO(text))
+                                    if kind in (Stream.START, Stream.COMMENT)])
+
+    def test_via_function(self):
+        from genshi.input import XML
+        self.assertEqual('<root><a>1</a></root>',
+                         XML('<root><a>1</a></root>',
+                             parser_class=LXMLParser).render())
+
+
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(doctest.DocTestSuite(XMLParser.__module__))
     suite.addTest(unittest.makeSuite(XMLParserTestCase, 'test'))
     suite.addTest(unittest.makeSuite(HTMLParserTestCase, 'test'))
+    if lxml_etree is not None:
+        suite.addTest(unittest.makeSuite(LXMLParserTestCase, 'test'))
     return suite
 
 if __name__ == '__main__':
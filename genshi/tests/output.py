@@ -18,7 +18,7 @@ import sys
 from genshi.core import Attrs, Stream, QName
 from genshi.input import HTML, XML
 from genshi.output import DocType, XMLSerializer, XHTMLSerializer, \
-                          HTMLSerializer, EmptyTagFilter
+                          HTMLSerializer, EmptyTagFilter, RenderMetrics
 
 
 class XMLSerializerTestCase(unittest.TestCase):
@@ -451,12 +451,108 @@ class EmptyTagFilterTestCase(unittest.TestCase):
                          [ev[0] for ev in stream])
 
 
+class RenderMetricsTestCase(unittest.TestCase):
+
+    def _render(self, stream, **kwargs):
+        collected = []
+        output = stream.render(metrics=collected.append, **kwargs)
+        self.assertEqual(1, len(collected))
+        return output, collected[0]
+
+    def test_events_and_bytes(self):
+        stream = XML(u'<p>H\xe9llo, <b>world</b></p>')
+        output, metrics = self._render(stream, encoding='utf-8')
+        self.assertEqual({Stream.START: 2, Stream.END: 2, Stream.TEXT: 2},
+                         metrics.events)
+        self.assertEqual(len(output), metrics.bytes)
+        self.assertEqual(len(output) - 1, len(output.decode('utf-8')))
+
+    def test_serialize_callback(self):
+        stream = XML('<p>Hello, <b>world</b></p>')
+        collected = []
+        output = stream.serialize('xml', metrics=collected.append)
+        self.assertEqual([], collected)
+        output = ''.join(output)
+        self.assertEqual(1, len(collected))
+        self.assertEqual(len(output), collected[0].bytes)
+
+    def test_times(self):
+        stream = XML('<p>Hello, <b>world</b></p>')
+        output, metrics = self._render(stream)
+        self.assertTrue(metrics.stream_time >= 0)
+        self.assertTrue(metrics.serialize_time >= 0)
+
+    def test_cache_hit_rate(self):
+        stream = XML('<ul><li>a</li><li>a</li><li>a</li></ul>')
+        output, metrics = self._render(stream, method='html')
+        self.assertEqual(6, metrics.cache_hits)
+        self.assertEqual(5, metrics.cache_misses)
+        self.assertEqual(6 / 11.0, metrics.cache_hit_rate())
+
+    def test_cache_hit_rate_without_cache(self):
+        stream = XML('<p>Hello</p>')
+        output, metrics = self._render(stream, method='text')
+        self.assertEqual(None, metrics.cache_hit_rate())
+
+    def test_buffered(self):
+        metrics = RenderMetrics()
+        metrics.buffered('match', 3)
+        metrics.buffered('match', 2)
+        metrics.buffered('transform', 5)
+        self.assertEqual({'match': 3, 'transform': 5}, metrics.buffer_peaks)
+
+    def test_transformer_buffer(self):
+        from genshi.filters.transform import StreamBuffer, Transformer
+        buffer = StreamBuffer()
+        stream = XML('<doc><a>1 <b>2</b></a><c/></doc>') | \
+                 Transformer('a').copy(buffer).end().select('c').append(buffer)
+        output, metrics = self._render(stream)
+        self.assertEqual('<doc><a>1 <b>2</b></a><c><a>1 <b>2</b></a></c></doc>',
+                         output)
+        self.assertEqual({'transform': 6}, metrics.buffer_peaks)
+
+    def test_match_buffer(self):
+        from genshi.template import MarkupTemplate
+        tmpl = MarkupTemplate("""<doc xmlns:py="http://genshi.edgewall.org/">
+          <py:match path="item" buffer="true"><x>${select('*')}</x></py:match>
+          <item><a/><b/></item>
+        </doc>""")
+        output, metrics = self._render(tmpl.generate())
+        self.assertEqual({'match': 6}, metrics.buffer_peaks)
+
+    def test_aborted_serialization(self):
+        from genshi.output import _local
+        from genshi.template import MarkupTemplate
+        tmpl = MarkupTemplate("""<doc xmlns:py="http://genshi.edgewall.org/">
+          <py:match path="item" buffer="true"><x>${select('*')}</x></py:match>
+          <item><a/></item>
+        </doc>""")
+        collected = []
+        output = tmpl.generate().serialize('xml', metrics=collected.append)
+        output.next()
+        output.close()
+        self.assertEqual([], collected)
+        self.assertEqual(None, getattr(_local, 'metrics', None))
+
+        def fail(stream):
+            for event in stream:
+                yield event
+            raise ValueError('failed')
+        try:
+            self._render(tmpl.generate() | fail)
+            self.fail('Expected ValueError')
+        except ValueError:
+            pass
+        self.assertEqual(None, getattr(_local, 'metrics', None))
+
+
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(XMLSerializerTestCase, 'test'))
     suite.addTest(unittest.makeSuite(XHTMLSerializerTestCase, 'test'))
     suite.addTest(unittest.makeSuite(HTMLSerializerTestCase, 'test'))
     suite.addTest(unittest.makeSuite(EmptyTagFilterTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(RenderMetricsTestCase, 'test'))
     suite.addTest(doctest.DocTestSuite(XMLSerializer.__module__))
     return suite
 
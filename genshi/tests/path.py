@@ -14,6 +14,7 @@
 import doctest
 import unittest
 
+from genshi.core import IndexedStream, Stream
 from genshi.input import XML
 from genshi.path import Path, PathParser, PathSyntaxError, GenericStrategy, \
                         SingleStepStrategy, SimplePathStrategy
@@ -22,6 +23,7 @@ from genshi.path import Path, PathParser, PathSyntaxError, GenericStrategy, \
 class FakePath(Path):
     def __init__(self, strategy):
         self.strategy = strategy
+        self.targets = None
     def test(self, ignore_context = False):
         return self.strategy.test(ignore_context)
 
@@ -651,6 +653,45 @@ class PathTestCase(unittest.TestCase):
         self.assert_(not self._test_support(SimplePathStrategy, 'foo:bar'))
         self.assert_(not self._test_support(SimplePathStrategy, 'a/@foo:bar'))
 
+    def test_indexed_skips_subtrees(self):
+        xml = IndexedStream(XML('<root><a><x/><x/></a><b><c id="1"/></b>'
+                                '<c id="2"><c id="3"/></c></root>'))
+        seen = []
+        class RecordingPath(Path):
+            def test(self, ignore_context=False):
+                test = Path.test(self, ignore_context)
+                def _test(event, namespaces, variables, updateonly=False):
+                    seen.append(event)
+                    return test(event, namespaces, variables, updateonly)
+                return _test
+        path = RecordingPath('.//c')
+        self.assertEqual(set(['c']), path.targets)
+        self.assertEqual('<c id="1"/><c id="2"><c id="3"/></c>',
+                         path.select(xml).render(encoding=None))
+        self.assertEqual([], [e for e in seen if e[1][0] in ('a', 'x')])
+
+    def test_indexed_index(self):
+        xml = IndexedStream(XML('<root><a>1</a><b><a>2</a></b></root>'))
+        self.assertEqual([1, 5], xml.index['a'])
+        self.assertEqual(8, xml.ends[4])
+        self.assertEqual(4, xml.ends[8])
+        self.assertEqual(5, xml.parents[6])
+        self.assertEqual(-1, xml.parents[0])
+        self.assertEqual('<a>2</a>', str(Stream(xml.subtree(5))))
+
+    def test_indexed_not_wellformed(self):
+        stream = IndexedStream(list(XML('<root><a/></root>'))[:-1])
+        self.assertEqual(None, stream.ends)
+        self.assertEqual('<a/>', Path('a').select(stream).render())
+
+    def test_index_targets(self):
+        self.assertEqual(set(['a', 'b']), Path('x/a|.//b/@id').targets)
+        self.assertEqual(None, Path('a[1]').targets)
+        self.assertEqual(None, Path('a/text()').targets)
+        self.assertEqual(None, Path('a/*').targets)
+        self.assertEqual(None, Path('@id').targets)
+        self.assertEqual(None, Path('//@id').targets)
+
     def _test_strategies(self, input, path, output,
                          namespaces=None, variables=None):
         for strategy in self.strategies:
@@ -681,6 +722,13 @@ class PathTestCase(unittest.TestCase):
         msg += '\nRendered:\t%r' % rendered
         self.assertEqual(output, rendered, msg)
 
+        rendered = path.select(IndexedStream(input), namespaces=namespaces,
+                               variables=variables).render(encoding=None)
+        msg = 'Bad output using indexed stream'
+        msg += '\nExpected:\t%r' % output
+        msg += '\nRendered:\t%r' % rendered
+        self.assertEqual(output, rendered, msg)
+
         if len(path.paths) == 1:
             self._test_strategies(input, path.paths[0], output,
                                   namespaces=namespaces, variables=variables)